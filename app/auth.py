@@ -3,7 +3,6 @@ import logging
 from datetime import timedelta, timezone, datetime
 from typing import Optional
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
@@ -12,6 +11,8 @@ from calendar import timegm
 
 from .crud.users import get_user_by_username
 from .database import get_db
+from .hashing import password_policy
+from .change_feed import record_change
 from .models.users import User
 
 logger = logging.getLogger(__name__)
@@ -21,24 +22,15 @@ load_dotenv()
 SECRET_KEY = os.environ.get("SECRET_KEY")
 ALGORITHM = os.environ.get("ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get("ACCESS_TOKEN_EXPIRE_MINUTES", 15))
+# Comma separated usernames allowed to use the admin endpoints
+ADMIN_USERNAMES = {name.strip() for name in os.environ.get("ADMIN_USERNAMES", "").split(",") if name.strip()}
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """
-    Verify a plaintext password against a hashed password.
-
-    :param plain_password: The plaintext password to verify.
-    :param hashed_password: The hashed password to verify against.
-    :return: True if the password matches, False otherwise.
-    """
-    logger.info("Verifying password")
-    return pwd_context.verify(plain_password, hashed_password)
-
 def authenticate_user(db: Session, username: str, password: str) -> Optional[User]:
     """
-    Authenticate the user by their username and password.
+    Authenticate the user by their username and password. If the stored hash was made
+    under a different cost than the current hashing policy, it is replaced on success.
 
     :param db: The database session.
     :param username: The username to authenticate.
@@ -50,9 +42,16 @@ def authenticate_user(db: Session, username: str, password: str) -> Optional[Use
     if not user:
         logger.warning(f"Authentication failed: User {username} not found")
         return None
-    if not verify_password(password, user.hashed_password):
+    logger.info("Verifying password")
+    verified, new_hash = password_policy.verify_and_update(password, user.hashed_password)
+    if not verified:
         logger.warning(f"Authentication failed: Incorrect password for user {username}")
         return None
+    if new_hash:
+        logger.info(f"Rehashing password for user {username} under the current policy")
+        user.hashed_password = new_hash
+        record_change(db, "user", username)
+        db.commit()
     
     logger.info(f"User {username} authenticated successfully")
     return user
@@ -112,3 +111,17 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
 
     logger.info(f"Current user {username} retrieved successfully")
     return user
+
+
+def get_current_admin(current_user: User = Depends(get_current_user)):
+    """
+    Get the current user if they are listed in ADMIN_USERNAMES.
+
+    :param current_user: The authenticated user.
+    :return: The authenticated admin.
+    :raises HTTPException: If the user is not an admin.
+    """
+    if current_user.username not in ADMIN_USERNAMES:
+        logger.warning(f"User {current_user.username} is not an admin")
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
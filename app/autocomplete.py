@@ -0,0 +1,287 @@
+import os
+import sys
+import time
+import heapq
+import asyncio
+import logging
+import threading
+from bisect import bisect_left, insort
+from itertools import groupby, islice
+from typing import Callable, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from . import database
+from .metrics import metrics
+from .models.movies import Movie
+from .models.ratings import Rating
+from .schemas.movies import TitleSuggestion, TitleSuggestionResponse
+
+logger = logging.getLogger(__name__)
+
+AUTOCOMPLETE_ENABLED = os.environ.get("AUTOCOMPLETE_ENABLED", "true").lower() == "true"
+# Full rebuilds pick up other workers' changes and refresh rating counts
+AUTOCOMPLETE_REBUILD_SECONDS = float(os.environ.get("AUTOCOMPLETE_REBUILD_SECONDS", 600))
+
+# Ranked results kept per (prefix, limit); a write only drops the prefixes of its own title
+AUTOCOMPLETE_MEMO_ENTRIES = int(os.environ.get("AUTOCOMPLETE_MEMO_ENTRIES", 2000))
+# Prefixes up to this many characters, which match the most titles, have their most rated titles precomputed
+AUTOCOMPLETE_SHORT_PREFIX = int(os.environ.get("AUTOCOMPLETE_SHORT_PREFIX", 2))
+# Most rated titles kept per short prefix: the largest limit a search may ask for
+AUTOCOMPLETE_TOP_TITLES = 50
+# Most titles ranked for one uncached prefix that the precomputed titles do not answer,
+# bounding how long a search holds the lock
+AUTOCOMPLETE_MAX_SCAN = int(os.environ.get("AUTOCOMPLETE_MAX_SCAN", 20_000))
+# Last character of the Unicode range, bounding the titles that start with a prefix
+_MAX_CHAR = "\U0010ffff"
+
+
+def fold(title: str) -> str:
+    return " ".join(title.casefold().split())
+
+
+def _rank(folded: str, movie_id: int, rating_count: int) -> Tuple[int, int, str, int]:
+    # Sorts best first: most rated, then shortest, then alphabetical
+    return -rating_count, len(folded), folded, movie_id
+
+
+def _entry_bytes(title: str, folded: str) -> int:
+    # The key tuple and folded string, the title and the dict slots pointing at them
+    return sys.getsizeof((folded, 0)) + sys.getsizeof(folded) + sys.getsizeof(title) + 3 * 8
+
+
+class TitleIndex:
+    """
+    Case-folded movie titles in a sorted list, searched by prefix with bisect.
+
+    Titles starting with a prefix form one contiguous slice of the list; the most rated
+    of them are returned. Writes in this worker update the index in place, and periodic
+    rebuilds from the database pick up changes made by other workers and new rating counts.
+
+    The most rated titles of every prefix of up to AUTOCOMPLETE_SHORT_PREFIX characters
+    are precomputed at build time and kept up to date by writes. Filtered by a longer
+    prefix, they answer it exactly when enough of them match. Other prefixes rank the titles
+    in their slice; one that matches more than AUTOCOMPLETE_MAX_SCAN titles ranks only the
+    first of them in alphabetical order.
+
+    Ranked results are memoized by prefix. A write can only change the results of the
+    prefixes of the titles it adds or removes, so only those are dropped.
+    """
+
+    def __init__(self):
+        self.built = False
+        self._keys: List[Tuple[str, int]] = []
+        self._titles: Dict[int, Tuple[str, str]] = {}
+        self._counts: Dict[int, int] = {}
+        self._memo: Dict[str, Dict[int, List[TitleSuggestion]]] = {}
+        # Short prefix -> ranks of its most rated titles, best first
+        self._top: Dict[str, List[Tuple[int, int, str, int]]] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    @property
+    def memory_bytes(self) -> int:
+        top = sys.getsizeof(self._top) + sum(sys.getsizeof(ranks) for ranks in list(self._top.values()))
+        return self._bytes + top + sys.getsizeof(self._keys) + sys.getsizeof(self._titles) + sys.getsizeof(self._counts)
+
+    def build(self, db: Session) -> None:
+        """
+        Replace the index with one built from a scan of live movie titles and their rating counts.
+        """
+        start = time.perf_counter()
+        statement = (
+            select(Movie.movie_id, Movie.title, func.count(Rating.id))
+            .outerjoin(Rating, Rating.movie_id == Movie.movie_id)
+            .where(Movie.deleted_at.is_(None))
+            .group_by(Movie.movie_id, Movie.title)
+            .execution_options(yield_per=10_000)
+        )
+        keys, titles, counts, size = [], {}, {}, 0
+        for movie_id, title, rating_count in db.execute(statement):
+            folded = fold(title)
+            keys.append((folded, movie_id))
+            titles[movie_id] = (title, folded)
+            counts[movie_id] = rating_count
+            size += _entry_bytes(title, folded)
+        keys.sort()
+        # Titles sharing a prefix are adjacent in the sorted keys
+        top = {}
+        for length in range(1, AUTOCOMPLETE_SHORT_PREFIX + 1):
+            for prefix, group in groupby(keys, key=lambda key: key[0][:length]):
+                if len(prefix) == length:
+                    top[prefix] = heapq.nsmallest(
+                        AUTOCOMPLETE_TOP_TITLES, (_rank(folded, movie_id, counts[movie_id]) for folded, movie_id in group)
+                    )
+
+        with self._lock:
+            self._keys, self._titles, self._counts, self._bytes, self._top = keys, titles, counts, size, top
+            self._memo.clear()
+            self.built = True
+        logger.info(f"Built title index: {len(keys)} titles, {self.memory_bytes / 1024 / 1024:.1f}MiB "
+                    f"in {(time.perf_counter() - start) * 1000:.0f}ms")
+
+    def add(self, movie_id: int, title: str, rating_count: int = 0) -> None:
+        with self._lock:
+            self._add(movie_id, title, rating_count)
+
+    def rename(self, movie_id: int, title: str) -> None:
+        with self._lock:
+            self._add(movie_id, title, self._counts.get(movie_id, 0))
+
+    def remove(self, movie_id: int) -> None:
+        with self._lock:
+            self._remove(movie_id)
+
+    def _add(self, movie_id: int, title: str, rating_count: int) -> None:
+        self._remove(movie_id)
+        folded = fold(title)
+        insort(self._keys, (folded, movie_id))
+        self._titles[movie_id] = (title, folded)
+        self._counts[movie_id] = rating_count
+        self._bytes += _entry_bytes(title, folded)
+        rank = _rank(folded, movie_id, rating_count)
+        for prefix in self._short_prefixes(folded):
+            ranks = self._top.setdefault(prefix, [])
+            insort(ranks, rank)
+            del ranks[AUTOCOMPLETE_TOP_TITLES:]
+        self._forget(folded)
+
+    def _remove(self, movie_id: int) -> None:
+        entry = self._titles.pop(movie_id, None)
+        if entry is None:
+            return
+        title, folded = entry
+        position = bisect_left(self._keys, (folded, movie_id))
+        if position < len(self._keys) and self._keys[position] == (folded, movie_id):
+            del self._keys[position]
+        rank = _rank(folded, movie_id, self._counts.pop(movie_id, 0))
+        self._bytes -= _entry_bytes(title, folded)
+        for prefix in self._short_prefixes(folded):
+            ranks = self._top.get(prefix, [])
+            if rank in ranks:
+                # The title that moves up into the list is only found by ranking the prefix again
+                self._top[prefix] = self._scan(prefix, AUTOCOMPLETE_TOP_TITLES)
+                if not self._top[prefix]:
+                    del self._top[prefix]
+        self._forget(folded)
+
+    @staticmethod
+    def _short_prefixes(folded: str) -> List[str]:
+        return [folded[:length] for length in range(1, min(len(folded), AUTOCOMPLETE_SHORT_PREFIX) + 1)]
+
+    def _scan(self, folded: str, limit: int, max_scan: Optional[int] = None) -> List[Tuple[int, int, str, int]]:
+        # Rank the titles starting with folded, or only the first max_scan of them
+        start = bisect_left(self._keys, (folded,))
+        end = bisect_left(self._keys, (folded + _MAX_CHAR,), lo=start)
+        if max_scan is not None:
+            end = min(end, start + max_scan)
+        return heapq.nsmallest(
+            limit, (_rank(key, movie_id, self._counts[movie_id]) for key, movie_id in islice(self._keys, start, end))
+        )
+
+    def _best(self, folded: str, limit: int) -> List[Tuple[int, int, str, int]]:
+        top = self._top.get(folded[:AUTOCOMPLETE_SHORT_PREFIX])
+        if top is not None:
+            # The best matches among a short prefix's most rated titles are the prefix's best
+            # matches, as long as there are enough of them or the list holds every title
+            matches = [rank for rank in top if rank[2].startswith(folded)]
+            if len(matches) >= limit or len(top) < AUTOCOMPLETE_TOP_TITLES:
+                return matches[:limit]
+        return self._scan(folded, limit, AUTOCOMPLETE_MAX_SCAN)
+
+    def _forget(self, folded: str) -> None:
+        # The memoized prefixes whose results can include this title
+        for length in range(1, len(folded) + 1):
+            self._memo.pop(folded[:length], None)
+
+    def search(self, prefix: str, limit: int) -> List[TitleSuggestion]:
+        """
+        The most rated titles starting with prefix, ignoring case and repeated spaces.
+        """
+        folded = fold(prefix)
+        with self._lock:
+            results = self._memo.get(folded, {}).get(limit)
+            if results is not None:
+                return results
+            results = [
+                TitleSuggestion(id=movie_id, title=self._titles[movie_id][0], rating_count=self._counts[movie_id])
+                for _, _, _, movie_id in self._best(folded, limit)
+            ]
+            if folded not in self._memo and len(self._memo) >= AUTOCOMPLETE_MEMO_ENTRIES:
+                # Dicts keep insertion order: drop the prefix memoized longest ago
+                del self._memo[next(iter(self._memo))]
+            self._memo.setdefault(folded, {})[limit] = results
+            return results
+
+
+class AutocompleteService:
+    """
+    Owns the title index: builds it at startup and rebuilds it in the background.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session]):
+        self.session_factory = session_factory
+        self.index = TitleIndex()
+        self._task: Optional[asyncio.Task] = None
+
+    def rebuild(self) -> None:
+        db = self.session_factory()
+        try:
+            self.index.build(db)
+        finally:
+            db.close()
+
+    def suggest(self, prefix: str, limit: int) -> TitleSuggestionResponse:
+        if not fold(prefix):
+            # Whitespace alone would match, and rank, every title
+            raise HTTPException(status_code=400, detail="prefix must contain a non-space character")
+        if not self.index.built:
+            raise HTTPException(status_code=503, detail="Title suggestions are not available yet")
+        return TitleSuggestionResponse(
+            message="Title suggestions retrieved successfully",
+            data=self.index.search(prefix, limit),
+        )
+
+    async def start(self) -> None:
+        try:
+            await run_in_threadpool(self.rebuild)
+        except Exception as e:
+            logger.error(f"Failed to build title index: {str(e)}")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(AUTOCOMPLETE_REBUILD_SECONDS)
+            try:
+                await run_in_threadpool(self.rebuild)
+            except Exception as e:
+                logger.error(f"Failed to rebuild title index: {str(e)}")
+
+
+autocomplete_service = AutocompleteService(database.SessionLocal)
+title_index = autocomplete_service.index
+
+metrics.describe("autocomplete_index_titles", "Titles in the autocomplete index.")
+metrics.describe("autocomplete_index_bytes", "Approximate memory used by the autocomplete index.")
+metrics.add_collector(lambda: [
+    ("autocomplete_index_titles", {}, len(title_index)),
+    ("autocomplete_index_bytes", {}, title_index.memory_bytes),
+])
+
+async def start_autocomplete() -> None:
+    if AUTOCOMPLETE_ENABLED:
+        await autocomplete_service.start()
+
+async def stop_autocomplete() -> None:
+    await autocomplete_service.stop()
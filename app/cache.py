@@ -0,0 +1,81 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+CACHE_TTL_SECONDS = float(os.environ.get("CACHE_TTL_SECONDS", 60))
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", 10_000))
+
+
+class LocalCache:
+    """
+    A bounded, thread-safe LRU cache with a TTL, local to one worker process.
+
+    Entries are dropped by the change feed when another request (in this or any other
+    worker) commits a change to the cached entity. Keys are normalized to strings so that
+    ids parsed from change events match the ids used by the read paths.
+
+    A reader takes the cache generation before querying the database and passes it back
+    to set(). If an invalidation happened in between, the possibly stale value is not stored.
+    """
+
+    def __init__(self, name: str, max_entries: int = CACHE_MAX_ENTRIES, ttl: float = CACHE_TTL_SECONDS):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        key = str(key)
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any, generation: Optional[int] = None) -> None:
+        key = str(key)
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        """
+        Drop one entry, or every entry when key is None.
+        """
+        with self._lock:
+            self._generation += 1
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(str(key), None)
+
+    def apply_change(self, event) -> None:
+        """
+        Change feed callback. An event without an id means changes may have been missed.
+        """
+        self.invalidate(event.id)
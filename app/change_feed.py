@@ -0,0 +1,171 @@
+import os
+import time
+import select
+import logging
+import threading
+from collections import defaultdict
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+CHANGE_FEED_CHANNEL = os.environ.get("CHANGE_FEED_CHANNEL", "app_changes")
+# "auto" listens on Postgres and broadcasts in-process otherwise; "local" never listens
+CHANGE_FEED_BACKEND = os.environ.get("CHANGE_FEED_BACKEND", "auto")
+
+
+class ChangeEvent(NamedTuple):
+    """
+    A committed change. id is None when a listener may have missed events and every
+    cached entry of the entity must be dropped.
+    """
+    entity: str
+    id: Optional[str]
+    version: int
+
+    def encode(self) -> str:
+        return f"{self.entity}:{self.id}:{self.version}"
+
+    @classmethod
+    def decode(cls, payload: str) -> "ChangeEvent":
+        """
+        Parse an encoded change. Cache keys may contain colons, so the entity is taken from
+        the left and the version from the right.
+
+        :raises ValueError: If the payload is not an encoded change.
+        """
+        entity, rest = payload.split(":", 1)
+        id, version = rest.rsplit(":", 1)
+        return cls(entity, id, int(version))
+
+
+class ChangeFeed:
+    """
+    Fans committed changes out to the caches of every worker.
+
+    Write paths record changes on their session with record_change(). When the session
+    commits, the changes are applied to this worker's subscribers right away. On Postgres
+    they are also sent with NOTIFY inside the committing transaction, so they are delivered
+    exactly when the write becomes visible, and a listener thread in every worker applies
+    them to its own subscribers.
+    """
+
+    def __init__(self, channel: str = CHANGE_FEED_CHANNEL):
+        self.channel = channel
+        self.listening = False
+        self._subscribers: Dict[str, List[Callable[[ChangeEvent], None]]] = defaultdict(list)
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+
+    def subscribe(self, entity: str, callback: Callable[[ChangeEvent], None]) -> None:
+        self._subscribers[entity].append(callback)
+
+    def dispatch(self, change: ChangeEvent) -> None:
+        for callback in self._subscribers.get(change.entity, ()):
+            try:
+                callback(change)
+            except Exception as e:
+                logger.error(f"Change feed subscriber failed for {change.entity} {change.id}: {str(e)}")
+
+    def reset(self) -> None:
+        """
+        Tell every subscriber that changes may have been missed.
+        """
+        version = time.time_ns()
+        for entity in list(self._subscribers):
+            self.dispatch(ChangeEvent(entity, None, version))
+
+    def start(self, engine: Engine) -> None:
+        if CHANGE_FEED_BACKEND == "local" or engine.dialect.name != "postgresql":
+            logger.info("Change feed using the in-process broadcaster")
+            return
+        self.listening = True
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._listen, args=(engine,), name="change-feed", daemon=True)
+        self._thread.start()
+        logger.info(f"Change feed listening on channel {self.channel}")
+
+    def stop(self) -> None:
+        self.listening = False
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _listen(self, engine: Engine) -> None:
+        while not self._stopping.is_set():
+            connection = None
+            try:
+                # A dedicated connection, detached so LISTEN state never returns to the pool
+                connection = engine.raw_connection()
+                connection.detach()
+                dbapi_connection = connection.driver_connection
+                dbapi_connection.autocommit = True
+                with dbapi_connection.cursor() as cursor:
+                    cursor.execute(f'LISTEN "{self.channel}"')
+                # Anything committed while we were not listening is unknown
+                self.reset()
+                while not self._stopping.is_set():
+                    if select.select([dbapi_connection], [], [], 1.0) == ([], [], []):
+                        continue
+                    dbapi_connection.poll()
+                    while dbapi_connection.notifies:
+                        notify = dbapi_connection.notifies.pop(0)
+                        try:
+                            change = ChangeEvent.decode(notify.payload)
+                        except ValueError:
+                            # Someone else's NOTIFY on the channel; not worth reconnecting over
+                            logger.warning(f"Ignoring malformed change feed payload: {notify.payload!r}")
+                            continue
+                        self.dispatch(change)
+            except Exception as e:
+                logger.error(f"Change feed listener failed, reconnecting: {str(e)}")
+                self._stopping.wait(1.0)
+            finally:
+                if connection is not None:
+                    connection.close()
+
+
+change_feed = ChangeFeed()
+
+
+def record_change(db: Session, entity: str, id) -> None:
+    """
+    Record a change to publish when the session commits.
+
+    :param db: The session making the change.
+    :param entity: The kind of cached entity that changed, e.g. "movie" or "rating".
+    :param id: The cache key of the entity that changed.
+    """
+    db.info.setdefault("changes", set()).add((entity, str(id)))
+
+
+@event.listens_for(Session, "before_commit")
+def _notify_changes(session: Session) -> None:
+    changes = session.info.get("changes")
+    if not changes or session.get_bind().dialect.name != "postgresql":
+        return
+    version = time.time_ns()
+    for entity, id in changes:
+        session.execute(
+            text("SELECT pg_notify(:channel, :payload)"),
+            {"channel": change_feed.channel, "payload": ChangeEvent(entity, id, version).encode()},
+        )
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_changes(session: Session) -> None:
+    changes = session.info.pop("changes", None)
+    if not changes:
+        return
+    version = time.time_ns()
+    for entity, id in changes:
+        change_feed.dispatch(ChangeEvent(entity, id, version))
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changes(session: Session) -> None:
+    session.info.pop("changes", None)
@@ -0,0 +1,187 @@
+import os
+import gzip
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .metrics import metrics
+
+try:
+    import brotli
+except ImportError:  # brotli is optional
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESSION_ENABLED = os.environ.get("COMPRESSION_ENABLED", "true").lower() == "true"
+# Bodies smaller than this are sent as they are
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", 1024))
+COMPRESSION_GZIP_LEVEL = int(os.environ.get("COMPRESSION_GZIP_LEVEL", 6))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get("COMPRESSION_BROTLI_QUALITY", 5))
+# Compressed bodies kept for reuse, keyed by the digest of the uncompressed body
+COMPRESSION_CACHE_ENTRIES = int(os.environ.get("COMPRESSION_CACHE_ENTRIES", 256))
+
+# Bodies at least this large are compressed in the threadpool instead of on the event loop
+THREADPOOL_MIN_SIZE = 256 * 1024
+# Streams are flushed to the client as they are produced and never buffered
+STREAMING_TYPES = ("text/event-stream", "application/x-ndjson")
+
+metrics.describe("http_compression_bytes_in_total", "Uncompressed bytes of compressed responses.")
+metrics.describe("http_compression_bytes_out_total", "Compressed bytes sent.")
+metrics.describe("http_compression_cpu_seconds_total", "CPU time spent compressing responses.")
+metrics.describe("http_compression_cache_total", "Compressed body lookups by outcome.")
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """
+    Pick br or gzip from an Accept-Encoding header, honouring q-values and preferring
+    br when it is installed and accepted with the same weight.
+    """
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        weights[name.strip().lower()] = quality
+
+    available = ["br", "gzip"] if brotli is not None else ["gzip"]
+    best, best_weight = None, 0.0
+    for encoding in available:
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=COMPRESSION_BROTLI_QUALITY)
+    # mtime=0 keeps the output identical for identical bodies
+    return gzip.compress(body, compresslevel=COMPRESSION_GZIP_LEVEL, mtime=0)
+
+
+class CompressedBodyCache:
+    """
+    A small thread-safe LRU of compressed bodies. Hot endpoints serialize cached data
+    to identical bytes, so hashing the body finds the compressed form without running
+    the compressor again.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[Tuple[str, bytes], bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[str, bytes]) -> Optional[bytes]:
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Tuple[str, bytes], value: bytes) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+
+class CompressionMiddleware:
+    """
+    Content-negotiated gzip (and brotli when installed) for complete response bodies.
+
+    Streaming responses, responses that already have a Content-Encoding and bodies below
+    the size threshold are passed through untouched. Compressed bodies of successful GET
+    responses are cached by the digest of the uncompressed body.
+    """
+
+    def __init__(self, app: ASGIApp, min_size: int = COMPRESSION_MIN_SIZE, cache_entries: int = COMPRESSION_CACHE_ENTRIES):
+        self.app = app
+        self.min_size = min_size
+        self.cache = CompressedBodyCache(cache_entries)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not COMPRESSION_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        cacheable = scope["method"] == "GET"
+        start: Optional[Message] = None
+        passthrough = False
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal start, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                content_type = headers.get("content-type", "")
+                if "content-encoding" in headers or content_type.startswith(STREAMING_TYPES):
+                    passthrough = True
+                    await send(message)
+                else:
+                    start = message
+                return
+
+            body = message.get("body", b"")
+            if message.get("more_body", False) or len(body) < self.min_size:
+                # Multi-part bodies are streamed, and small ones are not worth compressing
+                passthrough = True
+                await send(start)
+                await send(message)
+                return
+
+            compressed = await self._compress(body, encoding, cacheable and start["status"] == 200)
+            headers = MutableHeaders(raw=start["headers"])
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(compressed))
+            headers.add_vary_header("Accept-Encoding")
+            await send(start)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_compressed)
+
+    async def _compress(self, body: bytes, encoding: str, cacheable: bool) -> bytes:
+        key = None
+        if cacheable:
+            key = (encoding, hashlib.blake2b(body, digest_size=16).digest())
+            cached = self.cache.get(key)
+            if cached is not None:
+                metrics.inc("http_compression_cache_total", outcome="hit")
+                return cached
+            metrics.inc("http_compression_cache_total", outcome="miss")
+
+        if len(body) >= THREADPOOL_MIN_SIZE:
+            compressed, cpu_seconds = await run_in_threadpool(self._timed_compress, body, encoding)
+        else:
+            compressed, cpu_seconds = self._timed_compress(body, encoding)
+        metrics.inc("http_compression_bytes_in_total", len(body), encoding=encoding)
+        metrics.inc("http_compression_bytes_out_total", len(compressed), encoding=encoding)
+        metrics.inc("http_compression_cpu_seconds_total", cpu_seconds, encoding=encoding)
+        if key is not None:
+            self.cache.set(key, compressed)
+        return compressed
+
+    @staticmethod
+    def _timed_compress(body: bytes, encoding: str) -> Tuple[bytes, float]:
+        started = time.thread_time()
+        compressed = compress(body, encoding)
+        return compressed, time.thread_time() - started
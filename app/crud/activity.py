@@ -0,0 +1,78 @@
+import logging
+from uuid import UUID
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from ..models.comments import Comment
+from ..models.movies import Movie
+from ..models.ratings import Rating
+from ..schemas.activity import UserCommentItem, UserCommentsPage, UserRatingItem, UserRatingsPage, UserMoviesPage
+from ..schemas.movies import MovieInDB
+
+logger = logging.getLogger(__name__)
+
+# Pages are keyset-paginated on (user_id, id): each page continues after the last id of
+# the previous one, so it is a range scan of the composite index however deep it goes.
+# One extra row is fetched to tell whether another page follows.
+
+def get_user_ratings(db: Session, user_id: UUID, after: Optional[UUID], limit: int) -> UserRatingsPage:
+    logger.info(f"Fetching ratings of user {user_id} after {after}")
+    stmt = (
+        select(Rating.id, Rating.movie_id, Movie.title, Rating.rating)
+        .join(Movie, Movie.movie_id == Rating.movie_id)
+        .where(Rating.user_id == user_id, Movie.deleted_at.is_(None))
+        .order_by(Rating.id)
+        .limit(limit + 1)
+    )
+    if after is not None:
+        stmt = stmt.where(Rating.id > after)
+    rows = db.execute(stmt).all()
+
+    items = [
+        UserRatingItem(id=id, movie_id=movie_id, movie_title=title, rating=rating)
+        for id, movie_id, title, rating in rows[:limit]
+    ]
+    next_cursor = items[-1].id if len(rows) > limit else None
+    return UserRatingsPage(message="Ratings retrieved successfully", data=items, next_cursor=next_cursor)
+
+def get_user_comments(db: Session, user_id: UUID, after: Optional[UUID], limit: int) -> UserCommentsPage:
+    logger.info(f"Fetching comments of user {user_id} after {after}")
+    stmt = (
+        select(Comment.id, Comment.movie_id, Movie.title, Comment.content, Comment.parent_id)
+        .join(Movie, Movie.movie_id == Comment.movie_id)
+        .where(Comment.user_id == user_id, Movie.deleted_at.is_(None))
+        .order_by(Comment.id)
+        .limit(limit + 1)
+    )
+    if after is not None:
+        stmt = stmt.where(Comment.id > after)
+    rows = db.execute(stmt).all()
+
+    items = [
+        UserCommentItem(id=id, movie_id=movie_id, movie_title=title, content=content, parent_id=parent_id)
+        for id, movie_id, title, content, parent_id in rows[:limit]
+    ]
+    next_cursor = items[-1].id if len(rows) > limit else None
+    return UserCommentsPage(message="Comments retrieved successfully", data=items, next_cursor=next_cursor)
+
+def get_user_movies(db: Session, user_id: UUID, after: Optional[int], limit: int) -> UserMoviesPage:
+    logger.info(f"Fetching movies of user {user_id} after {after}")
+    stmt = select(Movie).where(Movie.user_id == user_id, Movie.deleted_at.is_(None)).order_by(Movie.movie_id).limit(limit + 1)
+    if after is not None:
+        stmt = stmt.where(Movie.movie_id > after)
+    movies = db.execute(stmt).scalars().all()
+
+    items = [
+        MovieInDB(
+            id=movie.movie_id,
+            title=movie.title,
+            description=movie.description,
+            release_date=movie.release_date,
+            user_id=movie.user_id
+        )
+        for movie in movies[:limit]
+    ]
+    next_cursor = items[-1].id if len(movies) > limit else None
+    return UserMoviesPage(message="Movies retrieved successfully", data=items, next_cursor=next_cursor)
@@ -1,14 +1,23 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import Text, cast, func, literal, select, tuple_
+from sqlalchemy.orm import Session, aliased
 from uuid import UUID
-from typing import List
+from typing import Iterator, List
 import logging
+import os
 from fastapi import HTTPException
 
 from ..models.comments import Comment
-from ..schemas.comments import CommentCreate, CommentInDB, CommentReply
+from ..models.movies import Movie
+from ..schemas.comments import CommentCreate, CommentInDB, CommentReply, CommentStreamItem
+from ..change_feed import record_change
 
 logger = logging.getLogger(__name__)
 
+# Number of rows fetched per round trip when streaming a comment thread
+COMMENT_STREAM_BATCH_SIZE = int(os.environ.get("COMMENT_STREAM_BATCH_SIZE", 500))
+# Number of top-level comments whose threads are read per query when streaming
+COMMENT_STREAM_THREADS = int(os.environ.get("COMMENT_STREAM_THREADS", 100))
+
 def add_comment(db: Session, comment: CommentCreate, user_id: UUID) -> Comment:
     logger.info(f"Adding comment for movie {comment.movie_id} by user {user_id}")
     db_comment = Comment(
@@ -18,6 +27,7 @@ def add_comment(db: Session, comment: CommentCreate, user_id: UUID) -> Comment:
         parent_id=None  # Not a reply
     )
     db.add(db_comment)
+    record_change(db, "comment", comment.movie_id)
     db.commit()
     db.refresh(db_comment)
     logger.info(f"Comment added with id {db_comment.id}")
@@ -26,30 +36,165 @@ def add_comment(db: Session, comment: CommentCreate, user_id: UUID) -> Comment:
 
 def get_comments_by_movie(db: Session, movie_id: int) -> List[CommentInDB]:
     logger.info(f"Fetching comments for movie {movie_id}")
-    top_level_comments = db.query(Comment).filter(Comment.movie_id == movie_id, Comment.parent_id.is_(None)).all()
+    # One query for the whole thread; rows come level by level, so a parent is always seen
+    # before its replies and the tree is assembled in a single pass over plain tuples
+    tree = _comment_tree(Comment.movie_id == movie_id, _movie_is_live(movie_id))
+    rows = db.execute(select(tree).order_by(*_thread_order(tree))).all()
 
-    if not top_level_comments:
+    if not rows:
         logger.error(f"No comments found for movie {movie_id}")
         raise HTTPException(status_code=404, detail="No comments found for this movie")
 
-    def fetch_replies(comment: Comment) -> CommentInDB:
-        replies = db.query(Comment).filter(Comment.parent_id == comment.id).all()
-        comment_in_db = CommentInDB(
-            id=comment.id,
-            user_id=comment.user_id,
-            content=comment.content,
-            movie_id=comment.movie_id,
-            parent_id=comment.parent_id,
-            replies=[fetch_replies(reply) for reply in replies]
+    all_comments = []
+    by_id = {}
+    for id, user_id, content, comment_movie_id, parent_id, _, depth in rows:
+        # Values come straight from the database, so they are not validated again
+        comment = CommentInDB.model_construct(
+            id=id,
+            user_id=user_id,
+            content=content,
+            movie_id=comment_movie_id,
+            parent_id=parent_id,
+            replies=[],
         )
-        return comment_in_db
-
-    all_comments = [fetch_replies(comment) for comment in top_level_comments]
+        by_id[id] = comment
+        if depth == 0:
+            all_comments.append(comment)
+        else:
+            by_id[parent_id].replies.append(comment)
 
-    logger.info(f"Returning comments for movie {movie_id}")
+    logger.info(f"Returning {len(rows)} comments for movie {movie_id}")
 
     return all_comments
 
+def _movie_is_live(movie_id: int):
+    return select(Movie.movie_id).where(Movie.movie_id == movie_id, Movie.deleted_at.is_(None)).exists()
+
+def _comment_tree(*anchor, sort_key=None):
+    """
+    Build a recursive query that walks down from the top-level comments matching anchor.
+    Each row carries its depth below its top-level comment and, given a sort_key, a path
+    of the sort keys of the comments above it, so ordering by the path is depth first.
+    """
+    columns = [
+        Comment.id,
+        Comment.user_id,
+        Comment.content,
+        Comment.movie_id,
+        Comment.parent_id,
+        Comment.created_at,
+        literal(0).label("depth"),
+    ]
+    if sort_key is not None:
+        columns.append(sort_key(Comment).label("path"))
+    tree = select(*columns).where(Comment.parent_id.is_(None), *anchor).cte("comment_tree", recursive=True)
+    reply = aliased(Comment)
+    columns = [
+        reply.id,
+        reply.user_id,
+        reply.content,
+        reply.movie_id,
+        reply.parent_id,
+        reply.created_at,
+        tree.c.depth + 1,
+    ]
+    if sort_key is not None:
+        columns.append(cast(tree.c.path + "/" + sort_key(reply), Text))
+    return tree.union_all(select(*columns).join(tree, reply.parent_id == tree.c.id))
+
+def _thread_order(tree):
+    # Parents before their replies and siblings oldest first. Comments written before created_at
+    # was recorded have none; they sort first, by id, which only roughly follows their age.
+    return tree.c.depth, tree.c.created_at.nulls_first(), tree.c.id
+
+def _sort_key(dialect: str):
+    """
+    Return a function that renders a comment's position among its siblings as text of a
+    fixed width: created_at, zeros for comments without one, followed by the id. Bytewise
+    order of these keys is _thread_order.
+    """
+    if dialect == "postgresql":
+        def created(comment):
+            return func.to_char(func.timezone("UTC", comment.created_at), "YYYYMMDDHH24MISSUS")
+        width = 20
+    else:
+        # SQLite stores datetimes as fixed-width "YYYY-MM-DD HH:MM:SS.ffffff" text
+        def created(comment):
+            return cast(comment.created_at, Text)
+        width = 26
+    return lambda comment: func.coalesce(created(comment), "0" * width) + cast(comment.id, Text)
+
+def _top_level_batches(db: Session, movie_id: int, batch_size: int) -> Iterator[List[UUID]]:
+    """
+    Yield the ids of a movie's top-level comments in thread order, batch_size at a time,
+    paging on the sort key instead of an offset. Stops early if the movie is deleted.
+    """
+    top_level = select(Comment.id).where(
+        Comment.movie_id == movie_id, Comment.parent_id.is_(None), _movie_is_live(movie_id)
+    )
+    for stmt, keys in (
+        (top_level.where(Comment.created_at.is_(None)), (Comment.id,)),
+        (top_level.where(Comment.created_at.is_not(None)), (Comment.created_at, Comment.id)),
+    ):
+        last = None
+        while True:
+            page = stmt.add_columns(*keys[:-1]).order_by(*keys).limit(batch_size)
+            if last is not None:
+                page = page.where(tuple_(*keys) > tuple_(*last))
+            rows = db.execute(page).all()
+            if rows:
+                yield [row.id for row in rows]
+            if len(rows) < batch_size:
+                break
+            last = (*rows[-1][1:], rows[-1].id)
+
+def stream_comments_by_movie(db: Session, movie_id: int) -> Iterator[str]:
+    logger.info(f"Streaming comments for movie {movie_id}")
+    has_comments = (
+        db.query(Comment.id)
+        .join(Movie, Movie.movie_id == Comment.movie_id)
+        .filter(Comment.movie_id == movie_id, Comment.parent_id.is_(None), Movie.deleted_at.is_(None))
+        .first()
+    )
+
+    if not has_comments:
+        logger.error(f"No comments found for movie {movie_id}")
+        raise HTTPException(status_code=404, detail="No comments found for this movie")
+
+    def generate() -> Iterator[str]:
+        # The request's session has already been closed by the time the body is sent,
+        # so the stream checks out its own connection and releases it when done.
+        # Threads are read COMMENT_STREAM_THREADS top-level comments at a time, so the first
+        # line waits for the database to sort one batch rather than the whole movie. Each
+        # batch is sorted depth first by the database and read through a server-side
+        # cursor, so memory is bounded by COMMENT_STREAM_BATCH_SIZE rows however deep it is.
+        dialect = db.get_bind().dialect.name
+        sort_key = _sort_key(dialect)
+        try:
+            for top_level_ids in _top_level_batches(db, movie_id, COMMENT_STREAM_THREADS):
+                tree = _comment_tree(Comment.id.in_(top_level_ids), sort_key=sort_key)
+                # Postgres needs the "C" collation to stop locale rules from skipping "/" and "-"
+                path = tree.c.path.collate("C") if dialect == "postgresql" else tree.c.path
+                rows = db.execute(
+                    select(tree).order_by(path),
+                    execution_options={"yield_per": COMMENT_STREAM_BATCH_SIZE, "stream_results": True},
+                )
+                for row in rows:
+                    item = CommentStreamItem(
+                        id=row.id,
+                        user_id=row.user_id,
+                        content=row.content,
+                        movie_id=row.movie_id,
+                        parent_id=row.parent_id,
+                        depth=row.depth,
+                    )
+                    yield item.model_dump_json() + "\n"
+        finally:
+            db.close()
+            logger.info(f"Finished streaming comments for movie {movie_id}")
+
+    return generate()
+
 def add_nested_comment(db: Session, payload: CommentReply, user_id: UUID) -> Comment:
     logger.info(f"Adding reply comment for movie {payload.movie_id} by user {user_id}")
     reply_comment = Comment(
@@ -59,6 +204,7 @@ def add_nested_comment(db: Session, payload: CommentReply, user_id: UUID) -> Com
         parent_id=payload.parent_id
     )
     db.add(reply_comment)
+    record_change(db, "comment", payload.movie_id)
     db.commit()
     db.refresh(reply_comment)
     logger.info(f"Reply comment added with id {reply_comment.id}")
@@ -1,58 +1,118 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import bindparam, delete, func, select, text
+from sqlalchemy.orm import Session, aliased
 from uuid import UUID
-from typing import List
-from fastapi import HTTPException
+from typing import List, Optional
+from datetime import datetime
+from fastapi import BackgroundTasks, HTTPException
 import logging
+import os
 
+from .. import database
+from ..models.comments import Comment
 from ..models.movies import Movie
-from ..schemas.movies import MovieCreate, MovieInDB, MovieUpdate, MovieResponse
+from ..models.ratings import Rating
+from ..schemas.movies import MovieCreate, MovieFields, MovieFieldsResponse, MovieInDB, MovieUpdate, MovieResponse
+from ..cache import LocalCache
+from ..change_feed import change_feed, record_change
+from ..autocomplete import title_index
+from ..recommendations import recommendation_service
 
 logger = logging.getLogger(__name__)
 
+# Movies by id, dropped whenever any worker commits a change to the movie
+movie_cache = LocalCache("movies")
+change_feed.subscribe("movie", movie_cache.apply_change)
 
-def get_movies(db: Session) -> MovieResponse:
-    logger.info("Fetching all movies")
-    db_movies = db.query(Movie).offset(0).limit(10).all()
+# Columns a movie read can select, by response field name
+MOVIE_FIELDS = {
+    "id": Movie.movie_id,
+    "title": Movie.title,
+    "description": Movie.description,
+    "release_date": Movie.release_date,
+    "user_id": Movie.user_id,
+}
+# Lists leave out the description, the only large column, unless it is asked for
+MOVIE_LIST_FIELDS = ["id", "title", "release_date", "user_id"]
+
+# Hot lookups are built once at import; executions only bind parameters
+_movie_by_id = select(Movie).where(Movie.movie_id == bindparam("movie_id"), Movie.deleted_at.is_(None))
+# Reads select plain columns and skip building Movie entities in the identity map
+_movie_columns_by_id = select(*MOVIE_FIELDS.values()).where(Movie.movie_id == bindparam("movie_id"), Movie.deleted_at.is_(None))
+
+# Movies with more ratings and comments than this are deleted in the background
+MOVIE_PURGE_THRESHOLD = int(os.environ.get("MOVIE_PURGE_THRESHOLD", 5000))
+# Rows removed per transaction by the background purge
+MOVIE_PURGE_BATCH_SIZE = int(os.environ.get("MOVIE_PURGE_BATCH_SIZE", 1000))
+# PostgreSQL advisory lock held by the one worker finishing interrupted purges
+MOVIE_PURGE_LOCK_KEY = 7_301_003
+
+
+def parse_movie_fields(fields: Optional[str], default: Optional[List[str]] = None) -> List[str]:
+    """
+    Turn a comma separated fields= parameter into the list of fields to return, id first.
+    Without the parameter, default is returned (all fields when it is None).
+    """
+    if fields is None:
+        return list(default or MOVIE_FIELDS)
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in names if name not in MOVIE_FIELDS]
+    if unknown:
+        logger.warning(f"Unknown movie fields requested: {unknown}")
+        raise HTTPException(status_code=400, detail=f"Unknown fields {', '.join(unknown)}; choose from {', '.join(MOVIE_FIELDS)}")
+    # The id is always returned so a result can be followed up
+    return ["id"] + [name for name in dict.fromkeys(names) if name != "id"]
+
+def select_movie_fields(movie: MovieInDB, fields: List[str]) -> MovieFields:
+    return MovieFields(**{field: getattr(movie, field) for field in fields})
+
+def get_movies(db: Session, fields: Optional[List[str]] = None) -> MovieFieldsResponse:
+    fields = fields or MOVIE_LIST_FIELDS
+    logger.info(f"Fetching all movies with fields {fields}")
+    # Only the requested columns are selected, and rows are not loaded as entities
+    stmt = (
+        select(*[MOVIE_FIELDS[field] for field in fields])
+        .where(Movie.deleted_at.is_(None))
+        .order_by(Movie.movie_id)
+        .offset(0)
+        .limit(10)
+    )
+    rows = db.execute(stmt).all()
     
-    if not db_movies:
+    if not rows:
         logger.error("No movies found")
         raise HTTPException(status_code=404, detail="No movies found")
     
-    logger.info(f"Found {len(db_movies)} movies")
-    
-    # Manually map each SQLAlchemy model instance to a Pydantic model instance
-    movies = [
-        MovieInDB(
-            id=movie.movie_id,
-            title=movie.title,
-            description=movie.description,
-            release_date=movie.release_date,
-            user_id=movie.user_id,
-        )
-        for movie in db_movies
-    ]
-    
-    response = MovieResponse(message="Movies retrieved successfully", data=movies)
+    logger.info(f"Found {len(rows)} movies")
+    # Rows map straight into response models; unselected fields stay unset and are omitted
+    movies = [MovieFields.model_construct(**dict(zip(fields, row))) for row in rows]
+    response = MovieFieldsResponse(message="Movies retrieved successfully", data=movies)
     return response
 
 def get_movie_id(db: Session, movie_id: int) -> MovieResponse:
     logger.info(f"Fetching movie with id={movie_id}")
-    data = db.query(Movie).filter(Movie.movie_id == movie_id).first()
-    if not data:
-        logger.warning(f"Movie with id={movie_id} not found")
-        raise HTTPException(status_code=404, detail="Movie not found")
-    logger.info(f"Found movie: {data.title}")
-    data = MovieResponse(message="Movie retrieved successfully", data=MovieInDB(title=data.title, description=data.description, release_date=data.release_date, id=data.movie_id, user_id=data.user_id))
+    movie = movie_cache.get(movie_id)
+    if movie is None:
+        generation = movie_cache.generation
+        row = db.execute(_movie_columns_by_id, {"movie_id": movie_id}).first()
+        if not row:
+            logger.warning(f"Movie with id={movie_id} not found")
+            raise HTTPException(status_code=404, detail="Movie not found")
+        movie = MovieInDB.model_construct(**dict(zip(MOVIE_FIELDS, row)))
+        movie_cache.set(movie_id, movie, generation)
+    logger.info(f"Found movie: {movie.title}")
+    data = MovieResponse(message="Movie retrieved successfully", data=movie)
     return data
 
-def get_movie_title(db: Session, title: str) -> MovieResponse:
+def get_movie_title(db: Session, title: str, fields: Optional[List[str]] = None) -> MovieFieldsResponse:
+    fields = fields or list(MOVIE_FIELDS)
     logger.info(f"Fetching movie with title={title}")
-    data = db.query(Movie).filter(Movie.title == title).first()
-    if not data:
+    stmt = select(*[MOVIE_FIELDS[field] for field in fields]).where(Movie.title == title, Movie.deleted_at.is_(None)).limit(1)
+    row = db.execute(stmt).first()
+    if not row:
         logger.warning(f"Movie with title={title} not found")
         raise HTTPException(status_code=404, detail="Movie not found")
-    logger.info(f"Found movie: {data.title}")
-    data = MovieResponse(message="Movie retrieved successfully", data=MovieInDB(title=data.title, description=data.description, release_date=data.release_date, id=data.movie_id, user_id=data.user_id))
+    logger.info(f"Found movie: {title}")
+    data = MovieFieldsResponse(message="Movie retrieved successfully", data=MovieFields.model_construct(**dict(zip(fields, row))))
     return data
 
 def add_movie(db: Session, movie: MovieCreate, user_id: UUID) -> MovieResponse:
@@ -72,15 +132,18 @@ def add_movie(db: Session, movie: MovieCreate, user_id: UUID) -> MovieResponse:
         user_id=user_id
     )
     db.add(db_movie)
+    db.flush()
+    record_change(db, "movie", db_movie.movie_id)
     db.commit()
     db.refresh(db_movie)
+    title_index.add(db_movie.movie_id, db_movie.title)
     logger.info(f"Added movie with id={db_movie.user_id}")
     db_movie = MovieResponse(message="Movie added successfully", data=MovieInDB(title=db_movie.title, description=db_movie.description, release_date=db_movie.release_date, id=db_movie.movie_id, user_id=db_movie.user_id))
     return db_movie
 
 def update_movie_by_id(db: Session, movie_id: int, movie: MovieUpdate, user_id: UUID) -> MovieResponse:
     logger.info(f"Updating movie with id={movie_id}")
-    db_movie = db.query(Movie).filter(Movie.movie_id == movie_id).first()
+    db_movie = db.execute(_movie_by_id, {"movie_id": movie_id}).scalars().first()
     
     if db_movie is None:
         logger.warning(f"Movie with id={movie_id} not found")
@@ -95,15 +158,30 @@ def update_movie_by_id(db: Session, movie_id: int, movie: MovieUpdate, user_id:
     if movie.description and movie.description != "string" and movie.description.strip():
         db_movie.description = movie.description
 
+    record_change(db, "movie", movie_id)
     db.commit()
     db.refresh(db_movie)
+    title_index.rename(movie_id, db_movie.title)
     logger.info(f"Updated movie with id={movie_id}")
     db_movie = MovieResponse(message="Movie updated successfully", data=MovieInDB(title=db_movie.title, description=db_movie.description, release_date=db_movie.release_date, id=db_movie.movie_id, user_id=db_movie.user_id))
     return db_movie
 
-def delete_by_id(db: Session, movie_id: int, user_id: UUID) -> MovieResponse:
+def count_movie_children(db: Session, movie_id: int, limit: int) -> int:
+    """
+    Count the ratings and comments of a movie, stopping at limit + 1 so that large
+    movies cost no more than small ones to classify.
+    """
+    total = 0
+    for model in (Rating, Comment):
+        rows = select(model.id).where(model.movie_id == movie_id).limit(limit + 1 - total).subquery()
+        total += db.execute(select(func.count()).select_from(rows)).scalar()
+        if total > limit:
+            break
+    return total
+
+def delete_by_id(db: Session, movie_id: int, user_id: UUID, background_tasks: Optional[BackgroundTasks] = None) -> MovieResponse:
     logger.info(f"Deleting movie with id={movie_id}")
-    db_movie = db.query(Movie).filter(Movie.movie_id == movie_id).first()
+    db_movie = db.execute(_movie_by_id, {"movie_id": movie_id}).scalars().first()
 
     if db_movie is None:
         logger.warning(f"Movie with id={movie_id} not found")
@@ -114,9 +192,100 @@ def delete_by_id(db: Session, movie_id: int, user_id: UUID) -> MovieResponse:
         raise HTTPException(status_code=403, detail="You are not authorized to delete")
     
     data=MovieInDB(title=db_movie.title, description=db_movie.description, release_date=db_movie.release_date, id=db_movie.movie_id, user_id=db_movie.user_id)
-    
-    db.delete(db_movie)
-    db.commit()
+
+    if background_tasks is not None and count_movie_children(db, movie_id, MOVIE_PURGE_THRESHOLD) > MOVIE_PURGE_THRESHOLD:
+        # Hide the movie now and remove its children in short transactions after the response
+        logger.info(f"Movie with id={movie_id} has many ratings and comments, purging in the background")
+        db_movie.deleted_at = datetime.utcnow()
+        record_change(db, "movie", movie_id)
+        db.commit()
+        background_tasks.add_task(purge_movie, movie_id)
+    else:
+        # Set-based deletes; children are never loaded into the session
+        db.execute(delete(Rating).where(Rating.movie_id == movie_id))
+        db.execute(delete(Comment).where(Comment.movie_id == movie_id))
+        db.execute(delete(Movie).where(Movie.movie_id == movie_id))
+        record_change(db, "movie", movie_id)
+        record_change(db, "rating", movie_id)
+        db.commit()
+    title_index.remove(movie_id)
+    recommendation_service.hide(movie_id)
     logger.info(f"Deleted movie with id={movie_id}")
     db_movie = MovieResponse(message="Movie deleted successfully", data=data)
     return db_movie
+
+def purge_movie(movie_id: int, batch_size: int = MOVIE_PURGE_BATCH_SIZE, db: Optional[Session] = None) -> None:
+    """
+    Delete the ratings and comments of a movie marked deleted, one batch per transaction
+    so that no transaction holds row locks for long, then delete the movie itself. Uses
+    db if given, otherwise a session of its own.
+
+    Comments are deleted leaf first: each batch only takes comments without replies, so a
+    parent never goes before its replies even where comments.parent_id predates
+    ON DELETE CASCADE.
+    """
+    reply = aliased(Comment)
+    batches = (
+        (Rating, select(Rating.id).where(Rating.movie_id == movie_id).limit(batch_size)),
+        (Comment, select(Comment.id).where(
+            Comment.movie_id == movie_id,
+            ~select(reply.id).where(reply.parent_id == Comment.id).exists(),
+        ).limit(batch_size)),
+    )
+    own_session = db is None
+    if own_session:
+        db = database.SessionLocal()
+    try:
+        removed = 0
+        for model, batch in batches:
+            while True:
+                result = db.execute(
+                    delete(model).where(model.id.in_(batch)).execution_options(synchronize_session=False)
+                )
+                db.commit()
+                removed += result.rowcount
+                # A short batch of comments can still leave parents whose replies just went
+                if not result.rowcount:
+                    break
+        db.execute(delete(Movie).where(Movie.movie_id == movie_id).execution_options(synchronize_session=False))
+        record_change(db, "rating", movie_id)
+        db.commit()
+        logger.info(f"Purged movie with id={movie_id} and {removed} ratings and comments")
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to purge movie with id={movie_id}, it will be retried on restart: {str(e)}")
+    finally:
+        if own_session:
+            db.close()
+
+def purge_deleted_movies() -> None:
+    """
+    Purge movies that were marked deleted but not purged, e.g. because the process restarted.
+
+    Every worker calls this at startup. On PostgreSQL the first to take an advisory lock
+    does the purge and the others skip it, instead of all deleting the same rows at once.
+    """
+    # One connection for the whole job: the advisory lock belongs to it, and a session bound to
+    # it keeps it across commits instead of taking a second one from a pool that may hold one
+    with database.engine.connect() as connection:
+        db = database.SessionLocal(bind=connection)
+        try:
+            locking = connection.dialect.name == "postgresql"
+            if locking:
+                # The lock is held by the connection, so it outlives the transactions below
+                acquired = db.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": MOVIE_PURGE_LOCK_KEY}).scalar()
+                db.commit()
+                if not acquired:
+                    logger.info("Another worker is purging deleted movies")
+                    return
+            try:
+                movie_ids = db.execute(select(Movie.movie_id).where(Movie.deleted_at.is_not(None))).scalars().all()
+                db.commit()
+                for movie_id in movie_ids:
+                    purge_movie(movie_id, db=db)
+            finally:
+                if locking:
+                    db.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MOVIE_PURGE_LOCK_KEY})
+                    db.commit()
+        finally:
+            db.close()
@@ -1,72 +1,115 @@
+import os
+import math
 import logging
-from uuid import UUID, uuid4
+from uuid import UUID
 from fastapi import HTTPException
 
 from typing import List
+
+import numpy as np
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import bindparam, func, select
 from ..models.ratings import Rating
 from ..models.movies import Movie
-from ..schemas.ratings import RatingCreate, RatingResponse
+from ..schemas.ratings import RatingCreate, RatingResponse, MovieRatingStats, CatalogRatingStats
+from .. import rating_buffer
+from ..cache import LocalCache
+from ..ids import uuid7
+from ..change_feed import change_feed, record_change
 from decimal import Decimal
 
 logger = logging.getLogger(__name__)
 
+# Aggregate rating per movie id. Keyed by movie, so both rating and movie changes drop it.
+rating_cache = LocalCache("ratings")
+change_feed.subscribe("rating", rating_cache.apply_change)
+change_feed.subscribe("movie", rating_cache.apply_change)
+
+# Per-movie statistics, dropped on change like the aggregate above
+rating_stats_cache = LocalCache("rating_stats")
+change_feed.subscribe("rating", rating_stats_cache.apply_change)
+change_feed.subscribe("movie", rating_stats_cache.apply_change)
+
+# Catalog-wide statistics change with every rating, so they are only refreshed by TTL
+CATALOG_STATS_TTL_SECONDS = float(os.environ.get("CATALOG_STATS_TTL_SECONDS", 300))
+catalog_stats_cache = LocalCache("catalog_stats", max_entries=1, ttl=CATALOG_STATS_TTL_SECONDS)
+CATALOG_STATS_BATCH_SIZE = 50_000
+
+# Hot lookups are built once at import; executions only bind parameters
+_movie_rating_summary = (
+    select(Movie.title, func.avg(Rating.rating), func.count(Rating.id))
+    .outerjoin(Rating, Rating.movie_id == Movie.movie_id)
+    .where(Movie.movie_id == bindparam("movie_id"), Movie.deleted_at.is_(None))
+    .group_by(Movie.title)
+)
+_movie_title = select(Movie.title).where(Movie.movie_id == bindparam("movie_id"), Movie.deleted_at.is_(None))
+_user_rating = select(Rating).where(Rating.movie_id == bindparam("movie_id"), Rating.user_id == bindparam("user_id"))
+_average_rating = select(func.avg(Rating.rating)).where(Rating.movie_id == bindparam("movie_id"))
+
+STAR_VALUES = np.arange(1, 6)
+# Two-sided 95% normal quantile
+Z_95 = 1.96
+
 def get_ratings(db: Session, movie_id: int) -> RatingResponse:
     logger.info(f"Fetching ratings for movie {movie_id}")
-    # check if movie exists
-    movie_exists = db.query(Movie).filter(Movie.movie_id == movie_id).scalar()
-    if not movie_exists:
+    cached = rating_cache.get(movie_id)
+    if cached is not None:
+        logger.info(f"Returning cached ratings for movie {movie_id}")
+        return cached
+    generation = rating_cache.generation
+
+    # Title, average and count in one round trip; no row means the movie does not exist
+    summary = db.execute(_movie_rating_summary, {"movie_id": movie_id}).first()
+    if summary is None:
         logger.error(f"Movie with id {movie_id} does not exist")
         raise HTTPException(status_code=404, detail=f"Movie with id {movie_id} does not exist")
 
-    ratings: List[Rating] = db.query(Rating).filter(Rating.movie_id == movie_id).all()
-    
-    if not ratings:
+    movie_title, average_rating, rating_count = summary
+    if not rating_count:
         logger.error(f"No ratings found for movie {movie_id}")
         raise HTTPException(status_code=404, detail=f"No ratings found for movie with id {movie_id}")
 
     logger.info(f"Calculating average rating for movie {movie_id}")
-    average_rating = db.query(func.avg(Rating.rating)).filter(Rating.movie_id == movie_id).scalar()
     average_rating = round(average_rating, 2) if average_rating else Decimal(0.0)
-
-    movie_title = db.query(Movie.title).filter(Movie.movie_id == movie_id).scalar()
     
     result = RatingResponse(
         movie_id=movie_id,
         movie_title=movie_title,
         average_rating=average_rating
     )
+    rating_cache.set(movie_id, result, generation)
     logger.info(f"Returning ratings for movie {movie_id}")
     return result
 
 def set_movie_rating(db: Session, rating_data: RatingCreate, user_id: UUID) -> RatingResponse:
     # Check if movie exists
-    movie_title = db.query(Movie.title).filter(Movie.movie_id == rating_data.movie_id).scalar()
+    movie_title = db.execute(_movie_title, {"movie_id": rating_data.movie_id}).scalar()
 
     if not movie_title:
         logger.error(f"Movie with id {rating_data.movie_id} does not exist")
         raise HTTPException(status_code=404, detail=f"Movie with id {rating_data.movie_id} does not exist")
 
+    buffer = rating_buffer.rating_buffer
+    if buffer is not None:
+        return buffer_movie_rating(db, buffer, rating_data, user_id, movie_title)
+
     logger.info(f"Setting rating for movie {rating_data.movie_id} by user {user_id}")
-    existing_rating = db.query(Rating).filter(
-        Rating.movie_id == rating_data.movie_id,
-        Rating.user_id == user_id
-    ).first()
+    existing_rating = db.execute(_user_rating, {"movie_id": rating_data.movie_id, "user_id": user_id}).scalars().first()
     
     if existing_rating:
         logger.info(f"Rating already exists for movie {rating_data.movie_id} by user {user_id}")
         existing_rating.rating = rating_data.rating
     else:
         new_rating = Rating(
-            id=uuid4(),
+            id=uuid7(),
             movie_id=rating_data.movie_id,
             user_id=user_id,
             rating=rating_data.rating
         )
         db.add(new_rating)
     
+    record_change(db, "rating", rating_data.movie_id)
     try:
         db.commit()
     except IntegrityError as e:
@@ -78,10 +121,7 @@ def set_movie_rating(db: Session, rating_data: RatingCreate, user_id: UUID) -> R
         db.rollback()
         raise HTTPException(status_code=500, detail="An unexpected error occurred while setting the rating.")
     
-    updated_rating = db.query(Rating).filter(
-        Rating.movie_id == rating_data.movie_id,
-        Rating.user_id == user_id
-    ).first()
+    updated_rating = db.execute(_user_rating, {"movie_id": rating_data.movie_id, "user_id": user_id}).scalars().first()
 
     logger.info(f"Rating set for movie {rating_data.movie_id} by user {user_id}") 
     result = RatingResponse(
@@ -90,3 +130,97 @@ def set_movie_rating(db: Session, rating_data: RatingCreate, user_id: UUID) -> R
         average_rating=get_ratings(db, updated_rating.movie_id).average_rating
     )
     return result
+
+def buffer_movie_rating(db: Session, buffer: "rating_buffer.RatingBuffer", rating_data: RatingCreate, user_id: UUID, movie_title: str) -> RatingResponse:
+    # Write-behind mode: the rating is acknowledged once buffered and committed by the next flush,
+    # so the average returned here reflects ratings that are already durable.
+    logger.info(f"Buffering rating for movie {rating_data.movie_id} by user {user_id}")
+    if not buffer.add(rating_data.movie_id, user_id, rating_data.rating):
+        logger.error(f"Rating buffer is full; refusing rating for movie {rating_data.movie_id} by user {user_id}")
+        raise HTTPException(status_code=503, detail="Too many ratings are waiting to be saved, try again later",
+                            headers={"Retry-After": str(math.ceil(buffer.max_delay))})
+
+    average_rating = db.execute(_average_rating, {"movie_id": rating_data.movie_id}).scalar()
+    average_rating = round(average_rating, 2) if average_rating else Decimal(rating_data.rating)
+
+    return RatingResponse(
+        movie_id=rating_data.movie_id,
+        movie_title=movie_title,
+        average_rating=average_rating
+    )
+
+def summarize_histogram(histogram: np.ndarray) -> dict:
+    """
+    Compute the count, mean, sample standard deviation and 95% confidence interval of
+    the mean from the number of ratings per star value (index 0 for 1 star).
+    """
+    count = int(histogram.sum())
+    if count == 0:
+        return dict(rating_count=0, average_rating=0.0, std_dev=0.0, histogram={int(star): 0 for star in STAR_VALUES})
+    mean = float((histogram * STAR_VALUES).sum() / count)
+    variance = float((histogram * (STAR_VALUES - mean) ** 2).sum() / (count - 1)) if count > 1 else 0.0
+    std_dev = math.sqrt(variance)
+    summary = dict(
+        rating_count=count,
+        average_rating=round(mean, 2),
+        std_dev=round(std_dev, 3),
+        histogram={int(star): int(n) for star, n in zip(STAR_VALUES, histogram)},
+    )
+    if count > 1:
+        margin = Z_95 * std_dev / math.sqrt(count)
+        summary.update(confidence_low=round(max(1.0, mean - margin), 3), confidence_high=round(min(5.0, mean + margin), 3))
+    return summary
+
+def get_rating_stats(db: Session, movie_id: int) -> MovieRatingStats:
+    logger.info(f"Fetching rating statistics for movie {movie_id}")
+    cached = rating_stats_cache.get(movie_id)
+    if cached is not None:
+        return cached
+    generation = rating_stats_cache.generation
+
+    # One grouped query: a row per star value, or a single row with no rating if the movie has none
+    rows = db.execute(
+        select(Movie.title, Rating.rating, func.count(Rating.id))
+        .outerjoin(Rating, Rating.movie_id == Movie.movie_id)
+        .where(Movie.movie_id == movie_id, Movie.deleted_at.is_(None))
+        .group_by(Movie.title, Rating.rating)
+    ).all()
+    if not rows:
+        logger.error(f"Movie with id {movie_id} does not exist")
+        raise HTTPException(status_code=404, detail=f"Movie with id {movie_id} does not exist")
+
+    histogram = np.zeros(len(STAR_VALUES), dtype=np.int64)
+    for _, rating, count in rows:
+        if rating is not None:
+            histogram[rating - 1] = count
+    result = MovieRatingStats(movie_id=movie_id, movie_title=rows[0][0], **summarize_histogram(histogram))
+    rating_stats_cache.set(movie_id, result, generation)
+    return result
+
+def get_catalog_stats(db: Session) -> CatalogRatingStats:
+    """
+    Compute rating statistics across the catalog from a streamed export of the
+    (movie_id, rating) columns, counting each batch with NumPy.
+    """
+    cached = catalog_stats_cache.get("catalog")
+    if cached is not None:
+        return cached
+
+    logger.info("Computing catalog rating statistics")
+    histogram = np.zeros(len(STAR_VALUES) + 1, dtype=np.int64)
+    movie_ids = []
+    result = db.execute(
+        select(Rating.movie_id, Rating.rating)
+        .join(Movie, Movie.movie_id == Rating.movie_id)
+        .where(Movie.deleted_at.is_(None)),
+        execution_options={"yield_per": CATALOG_STATS_BATCH_SIZE},
+    )
+    for partition in result.partitions():
+        columns = np.asarray(partition, dtype=np.int64)
+        histogram += np.bincount(columns[:, 1], minlength=len(histogram))[:len(histogram)]
+        movie_ids.append(np.unique(columns[:, 0]))
+    movie_count = len(np.unique(np.concatenate(movie_ids))) if movie_ids else 0
+
+    stats = CatalogRatingStats(movie_count=movie_count, **summarize_histogram(histogram[1:]))
+    catalog_stats_cache.set("catalog", stats)
+    return stats
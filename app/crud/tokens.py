@@ -0,0 +1,161 @@
+import os
+import uuid
+import hashlib
+import secrets
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+from uuid import UUID
+
+from fastapi import HTTPException
+from sqlalchemy import delete, or_, select, update
+from sqlalchemy.orm import Session
+
+from .. import database
+from ..models.refresh_tokens import RefreshToken
+from ..models.users import User
+
+logger = logging.getLogger(__name__)
+
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.environ.get("REFRESH_TOKEN_EXPIRE_DAYS", 30))
+# Seconds between purges of expired and revoked refresh tokens
+REFRESH_TOKEN_PURGE_SECONDS = float(os.environ.get("REFRESH_TOKEN_PURGE_SECONDS", 3600))
+# Rows deleted per transaction by the purge
+REFRESH_TOKEN_PURGE_BATCH_SIZE = int(os.environ.get("REFRESH_TOKEN_PURGE_BATCH_SIZE", 1000))
+
+def hash_refresh_token(token: str) -> str:
+    """
+    Digest a refresh token for storage. Tokens carry 256 bits of randomness,
+    so a single SHA-256 is enough and keeps the lookup cheap.
+
+    Args:
+        token (str): The refresh token handed to the client.
+
+    Returns:
+        str: The hex digest stored in the database.
+    """
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def create_refresh_token(db: Session, user_id: UUID, family_id: Optional[UUID] = None) -> str:
+    """
+    Issue a refresh token. A login starts a new token family; each rotation
+    stays in the family of the token it replaces.
+
+    Args:
+        db (Session): The database session.
+        user_id (UUID): The user the token is issued to.
+        family_id (Optional[UUID]): The family to join, or None to start a new one.
+
+    Returns:
+        str: The refresh token to hand to the client. Only its digest is stored.
+    """
+    token = secrets.token_urlsafe(32)
+    db_token = RefreshToken(
+        token_hash=hash_refresh_token(token),
+        family_id=family_id or uuid.uuid4(),
+        user_id=user_id,
+        expires_at=datetime.now(timezone.utc) + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+    )
+    db.add(db_token)
+    db.commit()
+    logger.info(f"Issued refresh token in family {db_token.family_id} for user {user_id}")
+    return token
+
+def rotate_refresh_token(db: Session, token: str) -> Tuple[str, str]:
+    """
+    Consume a refresh token and issue its successor.
+
+    The token is marked used and joined to its user in a single indexed update, so
+    renewing never touches the password hash. Presenting a token that was already used
+    is treated as theft and revokes every token in its family.
+
+    Args:
+        db (Session): The database session.
+        token (str): The refresh token presented by the client.
+
+    Returns:
+        Tuple[str, str]: The username the token belongs to and the new refresh token.
+
+    Raises:
+        HTTPException: If the token is unknown, expired, revoked or reused.
+    """
+    credentials_exception = HTTPException(
+        status_code=401,
+        detail="Invalid refresh token",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    token_hash = hash_refresh_token(token)
+    now = datetime.now(timezone.utc)
+
+    consumed = db.execute(
+        update(RefreshToken)
+        .where(
+            RefreshToken.token_hash == token_hash,
+            RefreshToken.used.is_(False),
+            RefreshToken.revoked.is_(False),
+            RefreshToken.expires_at > now,
+        )
+        .values(used=True)
+        .returning(
+            RefreshToken.family_id,
+            RefreshToken.user_id,
+            select(User.username).where(User.user_id == RefreshToken.user_id).scalar_subquery().label("username"),
+        )
+    ).first()
+
+    if consumed is None:
+        db.rollback()
+        stale = db.execute(
+            select(RefreshToken.family_id, RefreshToken.used, RefreshToken.revoked)
+            .where(RefreshToken.token_hash == token_hash)
+        ).first()
+        if stale is not None and (stale.used or stale.revoked):
+            logger.warning(f"Refresh token reuse detected, revoking family {stale.family_id}")
+            db.execute(
+                update(RefreshToken)
+                .where(RefreshToken.family_id == stale.family_id)
+                .values(revoked=True)
+            )
+            db.commit()
+        else:
+            logger.warning("Unknown or expired refresh token presented")
+        raise credentials_exception
+
+    new_token = create_refresh_token(db, consumed.user_id, family_id=consumed.family_id)
+    logger.info(f"Rotated refresh token in family {consumed.family_id}")
+    return consumed.username, new_token
+
+def purge_refresh_tokens(batch_size: int = REFRESH_TOKEN_PURGE_BATCH_SIZE) -> int:
+    """
+    Delete refresh tokens that can no longer be exchanged: expired ones, used or not, and
+    revoked ones. A used token is kept until it expires, because presenting it again is
+    how reuse is detected; after that it would be rejected as expired anyway.
+
+    Args:
+        batch_size (int): Rows deleted per transaction.
+
+    Returns:
+        int: The number of tokens deleted.
+    """
+    now = datetime.now(timezone.utc)
+    batch = (
+        select(RefreshToken.id)
+        .where(or_(RefreshToken.expires_at <= now, RefreshToken.revoked.is_(True)))
+        .limit(batch_size)
+    )
+    db = database.SessionLocal()
+    try:
+        removed = 0
+        while True:
+            result = db.execute(
+                delete(RefreshToken).where(RefreshToken.id.in_(batch)).execution_options(synchronize_session=False)
+            )
+            db.commit()
+            removed += result.rowcount
+            if result.rowcount < batch_size:
+                break
+        if removed:
+            logger.info(f"Purged {removed} expired or revoked refresh tokens")
+        return removed
+    finally:
+        db.close()
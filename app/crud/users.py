@@ -1,14 +1,17 @@
+from sqlalchemy import bindparam, select
 from sqlalchemy.orm import Session
-from passlib.context import CryptContext
 import logging
 
 from ..schemas.users import UserCreate, UserResponse, UserInDB
 from ..models.users import User
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from ..hashing import password_policy
+from ..change_feed import record_change
 
 logger = logging.getLogger(__name__)
 
+# Runs on every authenticated request, so the statement is built once and only the username is bound
+_user_by_username = select(User).where(User.username == bindparam("username")).limit(1)
+
 def create_user(db: Session, user: UserCreate) -> User:
     """
     Create a new user in the database.
@@ -21,10 +24,11 @@ def create_user(db: Session, user: UserCreate) -> User:
         User: The created User object.
     """
     logger.info(f"Creating user {user.username}")
-    hashed_password = pwd_context.hash(user.password)
+    hashed_password = password_policy.hash(user.password)
     db_user = User(username=user.username, email=user.email, hashed_password=hashed_password)
     try:
         db.add(db_user)
+        record_change(db, "user", user.username)
         db.commit()
         db.refresh(db_user)  # Refresh to get the full user object from the DB, including the ID
         logger.info(f"User {user.username} created successfully")
@@ -47,7 +51,7 @@ def get_user_by_username(db: Session, username: str) -> User | None:
         User | None: The User object if found, otherwise None.
     """
     logger.info(f"Fetching user with username {username}")
-    data = db.query(User).filter(User.username == username).first()
+    data = db.execute(_user_by_username, {"username": username}).scalars().first()
     if not data:
         logger.warning(f"User with username {username} not found")
         return None
@@ -5,6 +5,8 @@ from fastapi import HTTPException
 from sqlalchemy import create_engine
 from sqlalchemy.orm import declarative_base, sessionmaker
 
+from .sessions import lazy_session_dependency
+
 load_dotenv()
 
 # Load the database URL from the environment variable
@@ -13,19 +15,46 @@ SQLALCHEMY_DATABASE_URL = os.environ.get('DB_URL')
 if not SQLALCHEMY_DATABASE_URL:
     raise HTTPException(status_code=500, detail="Database URL not found")
 
+# Connection pool sizing for one worker process
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+
+def make_engine(pool_size: int = DB_POOL_SIZE, max_overflow: int = DB_MAX_OVERFLOW):
+    """
+    Create the SQLAlchemy engine with the given pool sizing.
+    SQLite uses its own pool implementation and ignores the sizing.
+    """
+    if SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
+        return create_engine(SQLALCHEMY_DATABASE_URL)
+    return create_engine(SQLALCHEMY_DATABASE_URL, pool_size=pool_size, max_overflow=max_overflow, pool_pre_ping=True)
+
 # Create the SQLAlchemy engine
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+engine = make_engine()
 
 # Create a configured "Session" class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+def configure_engine(pool_size: int, max_overflow: int) -> None:
+    """
+    Replace the engine, e.g. with per-worker pool sizing after a fork.
+    Code that needs the engine should read database.engine at call time.
+    """
+    global engine
+    engine.dispose(close=False)
+    engine = make_engine(pool_size, max_overflow)
+    SessionLocal.configure(bind=engine)
+
+def _dispose_pool_in_child() -> None:
+    # A forked child must never reuse the parent's pooled sockets. Dropping the pool
+    # without closing leaves the parent's connections intact.
+    engine.dispose(close=False)
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_dispose_pool_in_child)
+
 # Create a Base class for declarative class definitions
 Base = declarative_base()
 
-# Dependency to get a database session
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# Dependency to get a database session. The session is only created when first used,
+# and routes built with SessionReleasingRoute return it as soon as the endpoint is done.
+get_db = lazy_session_dependency(SessionLocal)
@@ -0,0 +1,143 @@
+import os
+import math
+import time
+import logging
+import argparse
+from typing import Optional, Tuple
+
+from passlib.context import CryptContext
+
+logger = logging.getLogger(__name__)
+
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", 12))
+# When set, the rounds are calibrated at startup to hit this verify time instead
+BCRYPT_TARGET_MS = float(os.environ.get("BCRYPT_TARGET_MS", 0))
+
+MIN_ROUNDS = 4
+MAX_ROUNDS = 31
+
+
+class PasswordHashPolicy:
+    """
+    The single place where passwords are hashed and verified.
+
+    The policy hashes with an exact number of rounds. Hashes made with a cost outside
+    rounds +/- tolerance are flagged by passlib's needs_update, so they are re-hashed on
+    the next successful login, whether the cost went up or down.
+    """
+
+    def __init__(self, rounds: int):
+        self.configure(rounds)
+
+    def configure(self, rounds: int, tolerance: int = 0) -> None:
+        """
+        Switch the policy to a new bcrypt cost.
+
+        :param rounds: The bcrypt log2 cost factor.
+        :param tolerance: How many rounds either side of it existing hashes may be made with.
+        """
+        self.rounds = rounds
+        self.context = CryptContext(
+            schemes=["bcrypt"],
+            deprecated="auto",
+            bcrypt__default_rounds=rounds,
+            bcrypt__min_rounds=max(MIN_ROUNDS, rounds - tolerance),
+            bcrypt__max_rounds=min(MAX_ROUNDS, rounds + tolerance),
+        )
+        logger.info(f"Password hashing policy set to bcrypt with {rounds} rounds")
+
+    def hash(self, password: str) -> str:
+        """
+        Hash a password with the current policy.
+
+        :param password: The plaintext password.
+        :return: The bcrypt hash.
+        """
+        return self.context.hash(password)
+
+    def verify(self, password: str, hashed_password: str) -> bool:
+        """
+        Verify a password against a stored hash.
+
+        :param password: The plaintext password.
+        :param hashed_password: The stored hash.
+        :return: True if the password matches, False otherwise.
+        """
+        return self.context.verify(password, hashed_password)
+
+    def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """
+        Verify a password and, if it matches a hash made under a different cost,
+        return a replacement hash made under the current policy.
+
+        :param password: The plaintext password.
+        :param hashed_password: The stored hash.
+        :return: Whether the password matches, and the new hash or None if no update is needed.
+        """
+        return self.context.verify_and_update(password, hashed_password)
+
+
+def measure_verify_ms(rounds: int, samples: int = 3) -> float:
+    """
+    Measure how long a bcrypt verify takes on this machine.
+
+    :param rounds: The bcrypt cost to measure.
+    :param samples: How many verifies to average.
+    :return: The mean verify time in milliseconds.
+    """
+    context = CryptContext(schemes=["bcrypt"], bcrypt__default_rounds=rounds)
+    hashed = context.hash("calibration-password")
+    start = time.perf_counter()
+    for _ in range(samples):
+        context.verify("calibration-password", hashed)
+    return (time.perf_counter() - start) * 1000 / samples
+
+
+def calibrate_rounds(target_ms: float) -> int:
+    """
+    Pick the highest bcrypt cost whose verify time stays within target_ms.
+
+    bcrypt doubles its work with each round, so one cheap measurement is enough
+    to estimate the cost, which is then confirmed against the target.
+
+    :param target_ms: The verify time budget in milliseconds.
+    :return: The calibrated number of rounds.
+    """
+    base_rounds = 8
+    base_ms = measure_verify_ms(base_rounds)
+    rounds = base_rounds + math.floor(math.log2(max(target_ms, 1e-3) / base_ms))
+    rounds = max(MIN_ROUNDS, min(MAX_ROUNDS, rounds))
+
+    measured_ms = measure_verify_ms(rounds)
+    while rounds > MIN_ROUNDS and measured_ms > target_ms:
+        rounds -= 1
+        measured_ms /= 2
+    logger.info(f"Calibrated bcrypt to {rounds} rounds (~{measured_ms:.0f} ms per verify, target {target_ms:.0f} ms)")
+    return rounds
+
+
+def calibrate_from_env(tolerance: int = 1) -> None:
+    """
+    Apply startup calibration when BCRYPT_TARGET_MS is set.
+
+    app.serve calibrates once before forking, so its workers share one exact cost. Workers
+    started any other way calibrate on their own and can land a round apart on a busy
+    host, so by default hashes one round either side are accepted rather than re-hashed
+    back and forth between them. Running the CLI once and setting BCRYPT_ROUNDS avoids
+    calibrating at all.
+
+    :param tolerance: How many rounds either side of the calibrated cost are accepted.
+    """
+    if BCRYPT_TARGET_MS:
+        password_policy.configure(calibrate_rounds(BCRYPT_TARGET_MS), tolerance)
+
+
+password_policy = PasswordHashPolicy(BCRYPT_ROUNDS)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibrate the bcrypt cost for this machine.")
+    parser.add_argument("--target-ms", type=float, default=250, help="verify time budget per login in milliseconds")
+    args = parser.parse_args()
+    rounds = calibrate_rounds(args.target_ms)
+    print(f"BCRYPT_ROUNDS={rounds}")
@@ -1,17 +1,39 @@
+import os
+import time
+import asyncio
 import logging
 
-from fastapi import FastAPI
+_import_started = time.perf_counter()
+
+from fastapi import Depends, FastAPI
+from fastapi.responses import PlainTextResponse
+from fastapi.concurrency import run_in_threadpool
 from contextlib import asynccontextmanager
+from sqlalchemy import inspect, text
 
 
-from .database import Base, engine
+from . import database
+from .auth import get_current_admin
+from .database import Base
+from .crud.movies import purge_deleted_movies
+from .crud.tokens import REFRESH_TOKEN_PURGE_SECONDS, purge_refresh_tokens
+from .hashing import calibrate_from_env
+from .rating_buffer import start_rating_buffer, stop_rating_buffer
+from .recommendations import start_recommendations, stop_recommendations
+from .autocomplete import start_autocomplete, stop_autocomplete
+from .change_feed import change_feed
+from .ratelimit import RateLimitMiddleware, rate_limiter
+from .compression import CompressionMiddleware
+from .profiling import PROFILING_ENABLED, PROFILING_TOKEN, ProfilingMiddleware
+from .metrics import metrics
+from .slow_queries import slow_query_log
+from .models.users import User
+from .warmup import StartupTimer, prime_caches, warm_pool
 from .routers.comments import comments_router
 from .routers.ratings import ratings_router
 from .routers.users import users_router
 from .routers.movies import movies_router
-
-# Create all the database tables
-Base.metadata.create_all(bind=engine)
+from .routers.admin import admin_router
 
 # Setup basic logging configuration
 logging.basicConfig(
@@ -21,24 +43,126 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)  # Create a logger for this module
 
+# Run create_all on startup. Disable when the schema is managed elsewhere.
+DB_CREATE_ALL = os.environ.get("DB_CREATE_ALL", "true").lower() == "true"
+
+# Advisory lock key that makes workers starting together take turns at schema changes
+SCHEMA_LOCK_KEY = 7_301_004
+
+def create_tables():
+    # Create all the database tables
+    Base.metadata.create_all(bind=database.engine)
+    # create_all skips existing tables, so also add nullable columns and indexes declared after a table was created.
+    # Each statement commits on its own, so indexes can be built CONCURRENTLY on PostgreSQL and large tables
+    # stay writable meanwhile; an advisory lock keeps several workers from running this at once.
+    with database.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        postgres = connection.dialect.name == "postgresql"
+        if postgres:
+            connection.execute(text("SELECT pg_advisory_lock(:key)"), {"key": SCHEMA_LOCK_KEY})
+        try:
+            _add_missing_schema(connection, postgres)
+        finally:
+            if postgres:
+                connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": SCHEMA_LOCK_KEY})
+
+def _add_missing_schema(connection, postgres: bool) -> None:
+    inspector = inspect(connection)
+    # A CREATE INDEX CONCURRENTLY that failed or was interrupted leaves an invalid index behind
+    invalid = set(connection.execute(text(
+        "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE NOT i.indisvalid"
+    )).scalars()) if postgres else set()
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing and column.nullable:
+                # Adding a nullable column without a default only changes the catalog
+                column_type = column.type.compile(dialect=connection.dialect)
+                connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                logger.info(f"Added column {table.name}.{column.name}")
+        indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in indexes and index.name not in invalid:
+                continue
+            try:
+                if index.name in invalid:
+                    connection.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS {index.name}'))
+                index.dialect_kwargs["postgresql_concurrently"] = postgres
+                index.create(bind=connection)
+                logger.info(f"Created index {index.name}")
+            except Exception as e:
+                # Leave the table as it is and let startup continue; the next startup retries
+                logger.error(f"Failed to create index {index.name}: {str(e)}")
+            finally:
+                index.dialect_kwargs["postgresql_concurrently"] = False
+
+async def purge_refresh_tokens_periodically():
+    # Every worker runs this; the batched deletes are idempotent, so overlapping runs are harmless
+    while True:
+        try:
+            await run_in_threadpool(purge_refresh_tokens)
+        except Exception as e:
+            logger.error(f"Failed to purge refresh tokens: {str(e)}")
+        await asyncio.sleep(REFRESH_TOKEN_PURGE_SECONDS)
+
 # Context manager for application startup and shutdown events
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("Application startup")    
+    timer = StartupTimer()
+    timer.phases.append(("imports", (_app_created - _import_started) * 1000))
+    if DB_CREATE_ALL:
+        with timer.phase("create_all"):
+            await run_in_threadpool(create_tables)
+    with timer.phase("calibrate"):
+        await run_in_threadpool(calibrate_from_env)
+    with timer.phase("pool_warmup"):
+        await run_in_threadpool(warm_pool)
+    with timer.phase("cache_prime"):
+        await run_in_threadpool(prime_caches)
+    change_feed.start(database.engine)
+    await start_rating_buffer()
+    await start_recommendations()
+    with timer.phase("autocomplete"):
+        await start_autocomplete()
+    # Finish purges interrupted by a restart, without delaying startup
+    purge_task = asyncio.create_task(run_in_threadpool(purge_deleted_movies))
+    token_purge_task = asyncio.create_task(purge_refresh_tokens_periodically())
+    timer.log()
     yield 
+    # Commit buffered ratings before the process exits
+    await stop_rating_buffer()
+    await stop_recommendations()
+    await stop_autocomplete()
+    purge_task.cancel()
+    token_purge_task.cancel()
+    change_feed.stop()
     logger.info("Application shutdown")
 
 
 # Initialize the FastAPI app with a lifespan context manager
 app = FastAPI(lifespan=lifespan)
 
+# Profile single requests on demand; not installed at all unless configured
+if PROFILING_ENABLED and PROFILING_TOKEN:
+    app.add_middleware(ProfilingMiddleware)
+elif PROFILING_ENABLED:
+    logger.warning("PROFILING_ENABLED is set without PROFILING_TOKEN; profiling stays off")
+
+# Compress large JSON bodies; added first so it wraps the routes inside the rate limiter
+app.add_middleware(CompressionMiddleware)
+
+# Reject bursts before they reach bcrypt or the database pool
+app.add_middleware(RateLimitMiddleware, limiter=rate_limiter)
+
 
 # Include routers for different modules
 app.include_router(router=users_router,tags=["USER"])
 app.include_router(router=ratings_router,prefix="/ratings",tags=["RATING"])
 app.include_router(router=comments_router,prefix="/comments",tags=["COMMENT"])
 app.include_router(router=movies_router,prefix="/movies",tags=["MOVIE"])
+app.include_router(router=admin_router,prefix="/admin",tags=["ADMIN"])
 
+_app_created = time.perf_counter()
 
 
     
@@ -46,3 +170,18 @@ app.include_router(router=movies_router,prefix="/movies",tags=["MOVIE"])
 async def root():
     logger.info("Root endpoint accessed")
     return {"message": "Welcome to the Movie Rating App"}
+
+@app.get("/healthz", include_in_schema=False)
+async def healthz():
+    # Keep-alive pings land here: no database access and no logging
+    return {"status": "ok"}
+
+@app.get("/metrics", include_in_schema=False, response_class=PlainTextResponse)
+async def get_metrics():
+    return metrics.render()
+
+@app.get("/metrics/slow-queries", include_in_schema=False)
+async def get_slow_queries(limit: int = 20, current_admin: User = Depends(get_current_admin)):
+    # Slowest statement shapes by total time since startup, with their latest plans. Admins only:
+    # EXPLAIN output from psycopg2 contains the statement's parameter values inlined
+    return slow_query_log.report(limit)
@@ -0,0 +1,76 @@
+import threading
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, default
+
+# (name, sorted label pairs) -> value
+MetricKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+Sample = Tuple[str, Dict[str, str], float]
+
+
+class MetricsRegistry:
+    """
+    Process-local counters, plus collectors that report current values when scraped,
+    rendered in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self._counters: Dict[MetricKey, float] = defaultdict(float)
+        self._help: Dict[str, str] = {}
+        self._collectors: List[Callable[[], Iterable[Sample]]] = []
+        self._lock = threading.Lock()
+
+    def describe(self, name: str, help: str) -> None:
+        self._help[name] = help
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] += value
+
+    def value(self, name: str, **labels: str) -> float:
+        return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def add_collector(self, collector: Callable[[], Iterable[Sample]]) -> None:
+        self._collectors.append(collector)
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            samples = [(name, dict(labels), value) for (name, labels), value in self._counters.items()]
+        for collector in self._collectors:
+            samples.extend(collector())
+        return samples
+
+    def render(self) -> str:
+        lines = []
+        described = set()
+        for name, labels, value in sorted(self.samples(), key=lambda sample: sample[0]):
+            if name not in described and name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+                described.add(name)
+            label_text = ",".join(f'{key}="{val}"' for key, val in sorted(labels.items()))
+            lines.append(f"{name}{{{label_text}}} {value:g}" if label_text else f"{name} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+# How SQLAlchemy obtained the compiled form of each executed statement
+_CACHE_OUTCOMES = {
+    default.CACHE_HIT: "hit",
+    default.CACHE_MISS: "miss",
+    default.NO_CACHE_KEY: "no_key",
+    default.CACHING_DISABLED: "disabled",
+    default.NO_DIALECT_SUPPORT: "unsupported",
+}
+
+metrics.describe("db_statement_cache_total", "Executed statements by compiled statement cache outcome.")
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _count_statement_cache(conn, cursor, statement, parameters, context, executemany) -> None:
+    # Registered on the Engine class, so engines rebuilt per worker are covered too
+    outcome = "raw" if context.compiled is None else _CACHE_OUTCOMES.get(context.cache_hit, "unknown")
+    metrics.inc("db_statement_cache_total", outcome=outcome)
@@ -1,19 +1,28 @@
-from sqlalchemy import Column, ForeignKey, Text, UUID, Integer
-from sqlalchemy.orm import relationship
-import uuid
+from datetime import datetime, timezone
+
+from sqlalchemy import Column, ForeignKey, Text, UUID, Integer, Index, DateTime
+from sqlalchemy.orm import relationship, backref
 
 from ..database import Base
+from ..ids import uuid7
 
 class Comment(Base):
     __tablename__ = 'comments'
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, index=True)
-    movie_id = Column(Integer, ForeignKey('movies.movie_id'), nullable=False)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7, index=True)
+    movie_id = Column(Integer, ForeignKey('movies.movie_id', ondelete='CASCADE'), nullable=False, index=True)
     user_id = Column(UUID(as_uuid=True), ForeignKey('users.user_id'), nullable=False)
     content = Column(Text, nullable=False)
-    parent_id = Column(UUID(as_uuid=True), ForeignKey('comments.id'), nullable=True)
+    parent_id = Column(UUID(as_uuid=True), ForeignKey('comments.id', ondelete='CASCADE'), nullable=True, index=True)
+    # Orders a comment among its siblings; None for comments written before it was recorded
+    created_at = Column(DateTime(timezone=True), nullable=True, default=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        # Pages of a user's comments
+        Index('ix_comments_user_id_id', 'user_id', 'id'),
+    )
     
     # Relationships
     movie = relationship("Movie", back_populates="comments")
     user = relationship("User", back_populates="comments")
-    parent = relationship("Comment", remote_side=[id], backref="replies")
+    parent = relationship("Comment", remote_side=[id], backref=backref("replies", passive_deletes=True))
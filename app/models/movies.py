@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, Date, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, Date, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import UUID
 
@@ -12,8 +12,16 @@ class Movie(Base):
     description = Column(Text, nullable=False)
     release_date = Column(Date, nullable=False)
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.user_id"), nullable=False)
+    # Set when a movie is deleted while its ratings and comments are purged in the background
+    deleted_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # Pages of the movies a user submitted
+        Index("ix_movies_user_id_movie_id", "user_id", "movie_id"),
+    )
 
     # Relationships
     creator = relationship("User", back_populates="movies")
-    ratings = relationship("Rating", back_populates="movie")
-    comments = relationship("Comment", back_populates="movie")
+    # Children are removed by the database (ON DELETE CASCADE) or set-based deletes, never loaded to be deleted
+    ratings = relationship("Rating", back_populates="movie", passive_deletes=True)
+    comments = relationship("Comment", back_populates="movie", passive_deletes=True)
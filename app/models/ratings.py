@@ -1,19 +1,23 @@
-from sqlalchemy import Column, ForeignKey, Integer, UUID, CheckConstraint
+from sqlalchemy import Column, ForeignKey, Integer, UUID, CheckConstraint, Index
 from sqlalchemy.orm import relationship
-import uuid
 
 from ..database import Base
+from ..ids import uuid7
 
 class Rating(Base):
     __tablename__ = 'ratings'
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    movie_id = Column(Integer, ForeignKey('movies.movie_id'), nullable=False)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
+    movie_id = Column(Integer, ForeignKey('movies.movie_id', ondelete='CASCADE'), nullable=False, index=True)
     user_id = Column(UUID(as_uuid=True), ForeignKey('users.user_id'), nullable=False)
     rating = Column(Integer, nullable=False,index=True)
 
     __table_args__ = (
         CheckConstraint('rating >= 1 AND rating <= 5', name='rating_range'),
+        # Pages of a user's ratings; covering on PostgreSQL so they are index-only scans
+        Index('ix_ratings_user_id_id', 'user_id', 'id', postgresql_include=['movie_id', 'rating']),
+        # One rating per user and movie; the write-behind buffer upserts on it
+        Index('ix_ratings_movie_id_user_id', 'movie_id', 'user_id', unique=True),
     )
 
     # Relationships
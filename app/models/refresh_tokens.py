@@ -0,0 +1,21 @@
+from sqlalchemy import Column, ForeignKey, String, Boolean, DateTime
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.orm import relationship
+
+from ..database import Base
+from ..ids import uuid7
+
+class RefreshToken(Base):
+    __tablename__ = 'refresh_tokens'
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
+    token_hash = Column(String(64), unique=True, index=True, nullable=False)
+    family_id = Column(UUID(as_uuid=True), index=True, nullable=False)
+    user_id = Column(UUID(as_uuid=True), ForeignKey('users.user_id'), nullable=False)
+    # Indexed for the periodic purge of expired tokens
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+    used = Column(Boolean, nullable=False, default=False)
+    revoked = Column(Boolean, nullable=False, default=False)
+
+    # Relationships
+    user = relationship("User", back_populates="refresh_tokens")
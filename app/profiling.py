@@ -0,0 +1,206 @@
+import os
+import sys
+import hmac
+import json
+import time
+import pstats
+import cProfile
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .ids import uuid7
+
+logger = logging.getLogger(__name__)
+
+# Off by default; when off the middleware and SQL listeners are not installed at all
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "false").lower() == "true"
+# Secret a request must send in the X-Profile header to be profiled
+PROFILING_TOKEN = os.environ.get("PROFILING_TOKEN", "")
+# Where profiles are written
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+# Functions listed in the summary written next to each profile
+PROFILE_TOP_FUNCTIONS = int(os.environ.get("PROFILE_TOP_FUNCTIONS", 30))
+
+PROFILE_HEADER = "x-profile"
+
+# From Python 3.12 cProfile runs on sys.monitoring: the request's profiler already sees every
+# thread, and enabling a second profiler while it runs raises ValueError
+PROFILER_COVERS_THREADS = sys.version_info >= (3, 12)
+
+# The profile of the request being handled, if it is being profiled
+current_profile: ContextVar[Optional["RequestProfile"]] = ContextVar("current_profile", default=None)
+
+
+class RequestProfile:
+    """
+    cProfile data and executed SQL statements collected for one request, across the
+    event loop thread and the worker threads that ran its blocking work.
+    """
+
+    def __init__(self, method: str, path: str):
+        self.id = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid7().hex[-8:]}"
+        self.method = method
+        self.path = path
+        self.thread = threading.current_thread()
+        self.statements: List[dict] = []
+        self._profilers: List[cProfile.Profile] = []
+        self._lock = threading.Lock()
+
+    def add_profiler(self, profiler: cProfile.Profile) -> None:
+        with self._lock:
+            self._profilers.append(profiler)
+
+    def add_statement(self, statement: str, duration_ms: float) -> None:
+        with self._lock:
+            self.statements.append({"sql": statement, "ms": round(duration_ms, 3)})
+
+    def save(self, directory: str, duration_ms: float, status: Optional[int]) -> str:
+        """
+        Write <id>.prof (loadable with pstats or snakeviz) and <id>.json with the SQL
+        statements and the most expensive functions. Returns the .prof path.
+        """
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, self.id)
+        stats = pstats.Stats(*self._profilers)
+        stats.dump_stats(f"{base}.prof")
+
+        top = []
+        for (filename, line, function), (_, calls, own, cumulative, _) in sorted(
+            stats.stats.items(), key=lambda item: item[1][3], reverse=True
+        )[:PROFILE_TOP_FUNCTIONS]:
+            top.append({
+                "function": f"{filename}:{line}({function})",
+                "calls": calls,
+                "own_ms": round(own * 1000, 3),
+                "cumulative_ms": round(cumulative * 1000, 3),
+            })
+        summary = {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status": status,
+            "duration_ms": round(duration_ms, 3),
+            "sql_ms": round(sum(statement["ms"] for statement in self.statements), 3),
+            "statements": self.statements,
+            "top_functions": top,
+        }
+        with open(f"{base}.json", "w") as output:
+            json.dump(summary, output, indent=2)
+        return f"{base}.prof"
+
+
+@contextmanager
+def profile_thread():
+    """
+    Profile the enclosed blocking work when it runs in a worker thread on behalf of a
+    profiled request. Costs one context variable lookup otherwise.
+
+    Where the request's profiler already covers threads, or another profiler holds the
+    interpreter, no second profiler is started; the thread's SQL is still recorded.
+    """
+    profile = current_profile.get()
+    if profile is None or PROFILER_COVERS_THREADS or threading.current_thread() is profile.thread:
+        yield
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        yield
+        return
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profile.add_profiler(profiler)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    if current_profile.get() is not None:
+        conn.info.setdefault("profile_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    profile = current_profile.get()
+    started = conn.info.get("profile_started")
+    if profile is not None and started:
+        profile.add_statement(statement, (time.perf_counter() - started.pop()) * 1000)
+
+
+class ProfilingMiddleware:
+    """
+    Profiles single requests that carry the configured token in the X-Profile header.
+
+    The request runs under cProfile, its SQL statements are timed, and both are written
+    to the profile directory; the response carries the profile id in X-Profile-Id. Only
+    one request is profiled at a time, and cProfile on the event loop thread also sees
+    other requests interleaved with it, so use it on a quiet instance.
+    """
+
+    def __init__(self, app: ASGIApp, token: str = PROFILING_TOKEN, directory: str = PROFILE_DIR):
+        self.app = app
+        self.token = token
+        self.directory = directory
+        self._active = False
+        if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+            event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        supplied = Headers(scope=scope).get(PROFILE_HEADER)
+        if supplied is None:
+            await self.app(scope, receive, send)
+            return
+        if not self.token or not hmac.compare_digest(supplied.encode(), self.token.encode()):
+            logger.warning(f"Ignored profiling request with an invalid token for {scope['path']}")
+            await self.app(scope, receive, send)
+            return
+        if self._active:
+            logger.warning(f"Another request is being profiled; not profiling {scope['path']}")
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope["method"], scope["path"])
+        status = None
+
+        async def send_profiled(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                MutableHeaders(scope=message)["X-Profile-Id"] = profile.id
+            await send(message)
+
+        self._active = True
+        context_token = current_profile.set(profile)
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiling tool is active in the process; the SQL timings still work
+            logger.warning(f"cProfile is unavailable, profiling only the SQL of {scope['path']}")
+            profiler = None
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_profiled)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profile.add_profiler(profiler)
+            duration_ms = (time.perf_counter() - started) * 1000
+            current_profile.reset(context_token)
+            self._active = False
+            path = await run_in_threadpool(profile.save, self.directory, duration_ms, status)
+            logger.info(f"Profiled {profile.method} {profile.path} in {duration_ms:.1f}ms "
+                        f"with {len(profile.statements)} statements: {path}")
@@ -0,0 +1,263 @@
+import os
+import time
+import logging
+import threading
+from abc import ABC, abstractmethod
+from itertools import islice
+from typing import Dict, Optional, Tuple
+
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+# Paths that go through the expensive authentication code (bcrypt)
+AUTH_PATHS = {"/login", "/signup"}
+# Token renewal is one indexed update, far cheaper than a password check, and must not
+# be starved by (or starve) logins behind the same client address
+REFRESH_PATHS = {"/token/refresh"}
+# Long-lived event streams, kept out of the reads group so they do not hold its concurrency slots
+STREAM_PATHS = {"/ratings/stream"}
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+
+class RouteLimit:
+    """
+    Limits applied to one route group.
+
+    :param rate: Tokens added to each client's bucket per second.
+    :param burst: Bucket capacity, i.e. how many requests a client may send at once.
+    :param max_concurrency: Requests of this group allowed in flight at the same time
+        across all clients. 0 disables the concurrency limit.
+    """
+
+    def __init__(self, rate: float, burst: float, max_concurrency: int):
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+
+
+class TokenBucketBackend(ABC):
+    """
+    Storage for token buckets. Subclasses decide where bucket state lives.
+    """
+
+    @abstractmethod
+    async def consume(self, key: str, rate: float, burst: float) -> float:
+        """
+        Take one token from the bucket identified by key.
+
+        :param key: The bucket key, made of the route group and client identifier.
+        :param rate: Refill rate in tokens per second.
+        :param burst: Bucket capacity.
+        :return: 0 if the request is allowed, otherwise seconds until a token is available.
+        """
+
+
+class InMemoryBackend(TokenBucketBackend):
+    """
+    Token buckets kept in this process. Each worker enforces its own limits.
+
+    Buckets are kept least recently used first. Past max_keys, each call looks at up to
+    evict_batch of the oldest buckets and drops those that have refilled to their burst,
+    so the cost of eviction is spread over requests instead of paid by one.
+    """
+
+    def __init__(self, max_keys: int = 100_000, evict_batch: int = 64):
+        self.max_keys = max_keys
+        self.evict_batch = evict_batch
+        # key -> (tokens, updated, rate, burst)
+        self._buckets: Dict[str, Tuple[float, float, float, float]] = {}
+        self._lock = threading.Lock()
+
+    async def consume(self, key: str, rate: float, burst: float) -> float:
+        now = time.monotonic()
+        with self._lock:
+            # Popped and stored again to move the bucket to the most recently used end
+            tokens, updated, _, _ = self._buckets.pop(key, (burst, now, rate, burst))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now, rate, burst)
+            if len(self._buckets) > self.max_keys:
+                self._evict(now)
+        return wait
+
+    def _evict(self, now: float) -> None:
+        # A bucket that has refilled to its burst is what a new bucket would start with, so
+        # forgetting it changes nothing. Buckets still refilling go to the back to be seen again later.
+        for key in list(islice(self._buckets, self.evict_batch)):
+            tokens, updated, rate, burst = self._buckets.pop(key)
+            if tokens + (now - updated) * rate < burst:
+                self._buckets[key] = (tokens, updated, rate, burst)
+
+
+class RedisBackend(TokenBucketBackend):
+    """
+    Token buckets kept in Redis so that every worker shares the same limits.
+    The bucket update runs as a Lua script, making each check a single atomic round trip.
+    """
+
+    SCRIPT = """
+    local rate = tonumber(ARGV[1])
+    local burst = tonumber(ARGV[2])
+    local now = tonumber(ARGV[3])
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+    local tokens = tonumber(state[1]) or burst
+    local updated = tonumber(state[2]) or now
+    tokens = math.min(burst, tokens + (now - updated) * rate)
+    local wait = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+    else
+        wait = (1 - tokens) / rate
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+    return tostring(wait)
+    """
+
+    def __init__(self, url: str, prefix: str = "ratelimit:"):
+        try:
+            from redis import asyncio as aioredis
+        except ImportError as e:
+            raise RuntimeError("The redis package is required for a shared rate limit backend") from e
+        self.prefix = prefix
+        self._client = aioredis.from_url(url)
+        self._script = self._client.register_script(self.SCRIPT)
+
+    async def consume(self, key: str, rate: float, burst: float) -> float:
+        wait = await self._script(keys=[self.prefix + key], args=[rate, burst, time.time()])
+        return float(wait)
+
+
+def _limit_from_env(group: str, rate: float, burst: float, max_concurrency: int) -> RouteLimit:
+    prefix = f"RATE_LIMIT_{group.upper()}"
+    return RouteLimit(
+        rate=float(os.environ.get(f"{prefix}_RATE", rate)),
+        burst=float(os.environ.get(f"{prefix}_BURST", burst)),
+        max_concurrency=int(os.environ.get(f"{prefix}_CONCURRENCY", max_concurrency)),
+    )
+
+
+class RateLimiter:
+    """
+    Admission control for the API. Requests are sorted into route groups (auth, refresh,
+    writes, reads and streams); each group has a token bucket per client and a cap on requests in flight.
+    """
+
+    def __init__(
+        self,
+        limits: Dict[str, RouteLimit],
+        backend: Optional[TokenBucketBackend] = None,
+        enabled: bool = True,
+        trust_forwarded: bool = False,
+        exempt_paths: Optional[set] = None,
+    ):
+        self.limits = limits
+        self.backend = backend or InMemoryBackend()
+        self.enabled = enabled
+        self.trust_forwarded = trust_forwarded
+        self.exempt_paths = exempt_paths or set()
+        self.in_flight: Dict[str, int] = {group: 0 for group in limits}
+
+    @classmethod
+    def from_env(cls) -> "RateLimiter":
+        backend_url = os.environ.get("RATE_LIMIT_BACKEND_URL")
+        backend = RedisBackend(backend_url) if backend_url else InMemoryBackend()
+        exempt = os.environ.get("RATE_LIMIT_EXEMPT_PATHS", "/,/healthz,/metrics,/docs,/openapi.json")
+        return cls(
+            limits={
+                "auth": _limit_from_env("auth", rate=5, burst=10, max_concurrency=8),
+                "refresh": _limit_from_env("refresh", rate=10, burst=20, max_concurrency=32),
+                "writes": _limit_from_env("writes", rate=20, burst=40, max_concurrency=32),
+                "reads": _limit_from_env("reads", rate=50, burst=100, max_concurrency=64),
+                "streams": _limit_from_env("streams", rate=1, burst=5, max_concurrency=1000),
+            },
+            backend=backend,
+            enabled=os.environ.get("RATE_LIMIT_ENABLED", "true").lower() == "true",
+            trust_forwarded=os.environ.get("RATE_LIMIT_TRUST_FORWARDED", "false").lower() == "true",
+            exempt_paths={path for path in exempt.split(",") if path},
+        )
+
+    def classify(self, method: str, path: str) -> Optional[str]:
+        """
+        Return the route group of a request, or None if the request is not limited.
+        """
+        if path in self.exempt_paths:
+            return None
+        if path in AUTH_PATHS:
+            return "auth"
+        if path in REFRESH_PATHS:
+            return "refresh"
+        if path in STREAM_PATHS:
+            return "streams"
+        if method in WRITE_METHODS:
+            return "writes"
+        return "reads"
+
+    def client_id(self, scope: Scope) -> str:
+        if self.trust_forwarded:
+            for name, value in scope["headers"]:
+                if name == b"x-forwarded-for":
+                    return value.decode("latin-1").split(",")[0].strip()
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+
+class RateLimitMiddleware:
+    """
+    ASGI middleware enforcing a RateLimiter. Requests over a limit are rejected right away,
+    with 429 when the client exceeded its bucket and 503 when the route group is saturated.
+    """
+
+    def __init__(self, app: ASGIApp, limiter: RateLimiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        limiter = self.limiter
+        if scope["type"] != "http" or not limiter.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        group = limiter.classify(scope["method"], scope["path"])
+        limit = limiter.limits.get(group) if group else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        # A saturated group is checked first, so a rejected request does not cost a token
+        if limit.max_concurrency and limiter.in_flight[group] >= limit.max_concurrency:
+            logger.warning(f"Concurrency limit reached for {group} routes")
+            response = JSONResponse(
+                {"detail": "Service temporarily overloaded"},
+                status_code=503,
+                headers={"Retry-After": "1"},
+            )
+            await response(scope, receive, send)
+            return
+
+        # The slot is taken before the bucket is awaited, so other requests cannot fill it meanwhile
+        limiter.in_flight[group] += 1
+        try:
+            client = limiter.client_id(scope)
+            wait = await limiter.backend.consume(f"{group}:{client}", limit.rate, limit.burst)
+            if wait > 0:
+                logger.warning(f"Rate limit exceeded for client {client} on {group} routes")
+                response = JSONResponse(
+                    {"detail": "Too many requests"},
+                    status_code=429,
+                    headers={"Retry-After": str(max(1, round(wait)))},
+                )
+                await response(scope, receive, send)
+                return
+            await self.app(scope, receive, send)
+        finally:
+            limiter.in_flight[group] -= 1
+
+
+rate_limiter = RateLimiter.from_env()
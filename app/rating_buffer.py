@@ -0,0 +1,177 @@
+import os
+import asyncio
+import logging
+import threading
+from uuid import UUID
+from typing import Callable, Dict, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from .database import SessionLocal
+from .change_feed import record_change
+from .ids import uuid7
+from .models.movies import Movie
+from .models.ratings import Rating
+
+logger = logging.getLogger(__name__)
+
+RATING_WRITE_BEHIND = os.environ.get("RATING_WRITE_BEHIND", "false").lower() == "true"
+# Longest time an acknowledged rating may wait before it is committed
+RATING_BUFFER_MAX_DELAY_MS = int(os.environ.get("RATING_BUFFER_MAX_DELAY_MS", 200))
+# Pending ratings that trigger a flush before the delay is up
+RATING_BUFFER_MAX_ITEMS = int(os.environ.get("RATING_BUFFER_MAX_ITEMS", 1000))
+# Most ratings held, including a batch being flushed; new ratings are refused beyond it
+RATING_BUFFER_MAX_PENDING = int(os.environ.get("RATING_BUFFER_MAX_PENDING", 10_000))
+
+# INSERT ... ON CONFLICT is dialect specific
+UPSERT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+class RatingBuffer:
+    """
+    Write-behind buffer for ratings.
+
+    Ratings are acknowledged as soon as they are buffered and committed later in batches.
+    A user rating the same movie several times before a flush only writes the last value.
+    The buffer is flushed every max_delay_ms, or sooner once max_items ratings are pending.
+    Failed flushes keep their ratings, and once max_pending are held new ones are refused,
+    so an unavailable database bounds memory instead of growing it.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session], max_delay_ms: int, max_items: int,
+                 max_pending: int = RATING_BUFFER_MAX_PENDING):
+        self.session_factory = session_factory
+        self.max_delay = max_delay_ms / 1000
+        self.max_items = max_items
+        self.max_pending = max(max_pending, max_items)
+        self._pending: Dict[Tuple[int, UUID], int] = {}
+        # Size of the batch being flushed, which is put back if the flush fails
+        self._flushing = 0
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def add(self, movie_id: int, user_id: UUID, rating: int) -> bool:
+        """
+        Buffer a rating, replacing any pending rating by the same user for the same movie.
+
+        :return: False if the buffer is full and the rating was not taken.
+        """
+        key = (movie_id, user_id)
+        with self._lock:
+            if key not in self._pending and len(self._pending) + self._flushing >= self.max_pending:
+                return False
+            self._pending[key] = rating
+            full = len(self._pending) >= self.max_items
+        if full and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+        return True
+
+    def flush(self) -> int:
+        """
+        Commit every pending rating in one transaction with a batched upsert on
+        (movie_id, user_id), so concurrent writers of the same rating cannot duplicate it.
+
+        :return: The number of ratings written.
+        """
+        with self._lock:
+            batch, self._pending = self._pending, {}
+            self._flushing = len(batch)
+        if not batch:
+            return 0
+
+        db = self.session_factory()
+        try:
+            movie_ids = {movie_id for movie_id, _ in batch}
+            live_movies = set(db.execute(
+                select(Movie.movie_id).where(Movie.movie_id.in_(movie_ids), Movie.deleted_at.is_(None))
+            ).scalars())
+            for key in [key for key in batch if key[0] not in live_movies]:
+                logger.warning(f"Dropping buffered rating for deleted movie {key[0]}")
+                del batch[key]
+
+            if batch:
+                upsert = UPSERT_INSERTS[db.get_bind().dialect.name](Rating)
+                upsert = upsert.on_conflict_do_update(
+                    index_elements=[Rating.movie_id, Rating.user_id], set_={"rating": upsert.excluded.rating}
+                )
+                db.execute(upsert, [
+                    {"id": uuid7(), "movie_id": movie_id, "user_id": user_id, "rating": rating}
+                    for (movie_id, user_id), rating in batch.items()
+                ])
+            # One change per movie for the whole batch
+            for movie_id in {movie_id for movie_id, _ in batch}:
+                record_change(db, "rating", movie_id)
+            db.commit()
+        except Exception:
+            db.rollback()
+            # Put the batch back, keeping anything rated again while the flush ran
+            with self._lock:
+                for key, rating in batch.items():
+                    self._pending.setdefault(key, rating)
+                self._flushing = 0
+            raise
+        finally:
+            db.close()
+
+        with self._lock:
+            self._flushing = 0
+        logger.info(f"Flushed {len(batch)} buffered ratings for {len(movie_ids)} movies")
+        return len(batch)
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Rating write-behind started (max delay {self.max_delay * 1000:.0f} ms, max {self.max_items} items)")
+
+    async def stop(self) -> None:
+        """
+        Stop the flush loop and write out everything still pending.
+        """
+        self._stopping = True
+        if self._task is not None:
+            self._wake.set()
+            await self._task
+            self._task = None
+        try:
+            await run_in_threadpool(self.flush)
+        except Exception as e:
+            logger.error(f"Failed to flush {len(self)} buffered ratings on shutdown: {str(e)}")
+        logger.info("Rating write-behind stopped")
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.max_delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await run_in_threadpool(self.flush)
+            except Exception as e:
+                logger.error(f"Failed to flush buffered ratings: {str(e)}")
+
+
+rating_buffer: Optional[RatingBuffer] = None
+
+async def start_rating_buffer() -> None:
+    global rating_buffer
+    if RATING_WRITE_BEHIND:
+        rating_buffer = RatingBuffer(SessionLocal, RATING_BUFFER_MAX_DELAY_MS, RATING_BUFFER_MAX_ITEMS)
+        await rating_buffer.start()
+
+async def stop_rating_buffer() -> None:
+    global rating_buffer
+    if rating_buffer is not None:
+        await rating_buffer.stop()
+        rating_buffer = None
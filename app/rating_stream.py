@@ -0,0 +1,136 @@
+import os
+import asyncio
+import logging
+from typing import AsyncIterator, Callable, Dict, Optional, Set
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from . import database
+from .change_feed import ChangeEvent, change_feed
+from .models.ratings import Rating
+from .schemas.ratings import RatingUpdate
+
+logger = logging.getLogger(__name__)
+
+# At most one push per movie per interval, however many ratings arrive
+RATING_STREAM_INTERVAL_MS = int(os.environ.get("RATING_STREAM_INTERVAL_MS", 1000))
+# Comment lines sent on idle streams so proxies keep the connection open
+RATING_STREAM_KEEPALIVE_SECONDS = float(os.environ.get("RATING_STREAM_KEEPALIVE_SECONDS", 15))
+
+
+class MovieTopic:
+    """
+    The shared subscription for one movie. Each listener has a queue holding only the
+    latest update, so a slow consumer skips intermediate updates instead of buffering them.
+    """
+
+    def __init__(self, movie_id: int):
+        self.movie_id = movie_id
+        self.listeners: Set[asyncio.Queue] = set()
+        self.changed = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+
+class RatingStreamHub:
+    """
+    Fans rating changes out to Server-Sent Event listeners.
+
+    Each worker keeps one topic per movie with listeners. Rating changes arrive through
+    the change feed, so updates committed by other workers are pushed as well. A topic
+    reloads the aggregate with one query and pushes it to all its listeners, then waits
+    for the interval before it reacts to the next change.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session], interval_ms: int):
+        self.session_factory = session_factory
+        self.interval = interval_ms / 1000
+        self.topics: Dict[int, MovieTopic] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def on_change(self, change: ChangeEvent) -> None:
+        # Called from whichever thread committed or received the change
+        if self._loop is None or self._loop.is_closed():
+            return
+        if change.id is None:
+            self._loop.call_soon_threadsafe(self._mark_all_changed)
+        else:
+            self._loop.call_soon_threadsafe(self._mark_changed, int(change.id))
+
+    def _mark_changed(self, movie_id: int) -> None:
+        topic = self.topics.get(movie_id)
+        if topic is not None:
+            topic.changed.set()
+
+    def _mark_all_changed(self) -> None:
+        for topic in self.topics.values():
+            topic.changed.set()
+
+    def load(self, movie_id: int) -> RatingUpdate:
+        db = self.session_factory()
+        try:
+            average, count = db.execute(
+                select(func.avg(Rating.rating), func.count(Rating.id)).where(Rating.movie_id == movie_id)
+            ).one()
+        finally:
+            db.close()
+        return RatingUpdate(movie_id=movie_id, average_rating=round(average or 0, 2), rating_count=count)
+
+    def subscribe(self, movie_id: int) -> asyncio.Queue:
+        self._loop = asyncio.get_running_loop()
+        topic = self.topics.get(movie_id)
+        if topic is None:
+            topic = self.topics[movie_id] = MovieTopic(movie_id)
+            topic.task = asyncio.create_task(self._run(topic))
+            logger.info(f"Opened rating stream topic for movie {movie_id}")
+        queue = asyncio.Queue(maxsize=1)
+        topic.listeners.add(queue)
+        # New listeners get the current value right away
+        topic.changed.set()
+        return queue
+
+    def unsubscribe(self, movie_id: int, queue: asyncio.Queue) -> None:
+        topic = self.topics.get(movie_id)
+        if topic is None:
+            return
+        topic.listeners.discard(queue)
+        if not topic.listeners:
+            topic.task.cancel()
+            del self.topics[movie_id]
+            logger.info(f"Closed rating stream topic for movie {movie_id}")
+
+    async def _run(self, topic: MovieTopic) -> None:
+        while True:
+            await topic.changed.wait()
+            topic.changed.clear()
+            try:
+                update = await run_in_threadpool(self.load, topic.movie_id)
+            except Exception as e:
+                logger.error(f"Failed to load ratings for stream of movie {topic.movie_id}: {str(e)}")
+            else:
+                for queue in topic.listeners:
+                    if queue.full():
+                        queue.get_nowait()
+                    queue.put_nowait(update)
+            await asyncio.sleep(self.interval)
+
+    async def events(self, movie_id: int) -> AsyncIterator[str]:
+        """
+        Yield Server-Sent Events for one listener until the client disconnects.
+        """
+        queue = self.subscribe(movie_id)
+        try:
+            while True:
+                try:
+                    update = await asyncio.wait_for(queue.get(), timeout=RATING_STREAM_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: rating\ndata: {update.model_dump_json()}\n\n"
+        finally:
+            self.unsubscribe(movie_id, queue)
+
+
+rating_stream_hub = RatingStreamHub(database.SessionLocal, RATING_STREAM_INTERVAL_MS)
+change_feed.subscribe("rating", rating_stream_hub.on_change)
@@ -0,0 +1,346 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from uuid import UUID
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from scipy import sparse
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from . import database
+from .change_feed import ChangeEvent, change_feed
+from .models.movies import Movie
+from .models.ratings import Rating
+from .schemas.recommendations import RecommendationResponse, ScoredMovie
+
+logger = logging.getLogger(__name__)
+
+RECOMMENDATIONS_ENABLED = os.environ.get("RECOMMENDATIONS_ENABLED", "true").lower() == "true"
+# Neighbours kept per movie
+REC_TOP_K = int(os.environ.get("REC_TOP_K", 20))
+REC_REFRESH_SECONDS = float(os.environ.get("REC_REFRESH_SECONDS", 300))
+# Every Nth refresh recomputes the whole model instead of only the changed movies; 0 or 1
+# rebuilds on every refresh. Between rebuilds the scores of unchanged movies drift, see update()
+REC_FULL_REBUILD_EVERY = int(os.environ.get("REC_FULL_REBUILD_EVERY", 6))
+
+LOAD_BATCH_SIZE = 10_000
+# Movies whose similarity rows are computed in one sparse product
+SIMILARITY_BLOCK_SIZE = 256
+
+
+class RatingTriplets:
+    """
+    The ratings matrix in coordinate form: parallel arrays of user row, movie id and rating.
+    """
+
+    def __init__(self, user_index: Dict[UUID, int], rows: np.ndarray, movies: np.ndarray, values: np.ndarray):
+        self.user_index = user_index
+        self.rows = rows
+        self.movies = movies
+        self.values = values
+
+    @classmethod
+    def load(cls, db: Session, user_index: Optional[Dict[UUID, int]] = None, movie_ids: Optional[List[int]] = None) -> "RatingTriplets":
+        """
+        Stream (user, movie, rating) columns of live movies from the database through a
+        server-side cursor.
+        """
+        user_index = {} if user_index is None else user_index
+        stmt = (
+            select(Rating.user_id, Rating.movie_id, Rating.rating)
+            .join(Movie, Movie.movie_id == Rating.movie_id)
+            .where(Movie.deleted_at.is_(None))
+        )
+        if movie_ids is not None:
+            stmt = stmt.where(Rating.movie_id.in_(movie_ids))
+        rows, movies, values = [], [], []
+        result = db.execute(stmt, execution_options={"yield_per": LOAD_BATCH_SIZE})
+        for partition in result.partitions():
+            for user_id, movie_id, rating in partition:
+                rows.append(user_index.setdefault(user_id, len(user_index)))
+                movies.append(movie_id)
+                values.append(rating)
+        return cls(
+            user_index,
+            np.asarray(rows, dtype=np.int32),
+            np.asarray(movies, dtype=np.int64),
+            np.asarray(values, dtype=np.float32),
+        )
+
+    def replace_movies(self, fresh: "RatingTriplets", movie_ids: np.ndarray) -> "RatingTriplets":
+        """
+        Return triplets where the ratings of movie_ids are replaced by those in fresh.
+        """
+        keep = ~np.isin(self.movies, movie_ids)
+        return RatingTriplets(
+            fresh.user_index,
+            np.concatenate([self.rows[keep], fresh.rows]),
+            np.concatenate([self.movies[keep], fresh.movies]),
+            np.concatenate([self.values[keep], fresh.values]),
+        )
+
+
+class SimilarityModel:
+    """
+    An immutable item-item similarity snapshot.
+
+    Similarity is the adjusted cosine between movie columns of the user-centred ratings
+    matrix. Only the top-K neighbours of each movie are kept, in two (movies x K) arrays
+    of neighbour row and score, padded with -1 and 0. Lookups are pure array indexing.
+    """
+
+    def __init__(self, triplets: RatingTriplets, movie_ids: np.ndarray, centred: sparse.csr_matrix,
+                 neighbours: np.ndarray, scores: np.ndarray):
+        self.triplets = triplets
+        self.movie_ids = movie_ids
+        self.centred = centred
+        self.neighbours = neighbours
+        self.scores = scores
+        self.built_at = time.time()
+
+    @staticmethod
+    def _matrices(triplets: RatingTriplets) -> Tuple[np.ndarray, sparse.csr_matrix, sparse.csc_matrix]:
+        movie_ids, cols = np.unique(triplets.movies, return_inverse=True)
+        shape = (len(triplets.user_index), len(movie_ids))
+        ratings = sparse.csr_matrix((triplets.values, (triplets.rows, cols)), shape=shape)
+        counts = np.diff(ratings.indptr)
+        means = np.asarray(ratings.sum(axis=1)).ravel() / np.maximum(counts, 1)
+        centred = ratings.copy()
+        centred.data -= np.repeat(means, counts).astype(np.float32)
+        norms = np.sqrt(np.asarray(centred.multiply(centred).sum(axis=0)).ravel())
+        inverse = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+        normalized = (centred @ sparse.diags(inverse.astype(np.float32))).tocsc()
+        return movie_ids, centred, normalized
+
+    @staticmethod
+    def _top_k(normalized: sparse.csc_matrix, rows: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Compute the top-K most similar movies for the given movie rows.
+        """
+        neighbours = np.full((len(rows), top_k), -1, dtype=np.int32)
+        scores = np.zeros((len(rows), top_k), dtype=np.float32)
+        for start in range(0, len(rows), SIMILARITY_BLOCK_SIZE):
+            block = rows[start:start + SIMILARITY_BLOCK_SIZE]
+            similarity = (normalized[:, block].T @ normalized).tocsr()
+            for offset, row in enumerate(block):
+                lo, hi = similarity.indptr[offset], similarity.indptr[offset + 1]
+                indices, data = similarity.indices[lo:hi], similarity.data[lo:hi]
+                keep = (indices != row) & (data > 0)
+                indices, data = indices[keep], data[keep]
+                if len(data) > top_k:
+                    best = np.argpartition(-data, top_k)[:top_k]
+                    indices, data = indices[best], data[best]
+                order = np.argsort(-data)
+                neighbours[start + offset, :len(order)] = indices[order]
+                scores[start + offset, :len(order)] = data[order]
+        return neighbours, scores
+
+    @classmethod
+    def build(cls, triplets: RatingTriplets, top_k: int = REC_TOP_K) -> "SimilarityModel":
+        movie_ids, centred, normalized = cls._matrices(triplets)
+        neighbours, scores = cls._top_k(normalized, np.arange(len(movie_ids)), top_k)
+        return cls(triplets, movie_ids, centred, neighbours, scores)
+
+    def update(self, fresh: RatingTriplets, changed_movies: np.ndarray) -> Optional["SimilarityModel"]:
+        """
+        Build a new snapshot in which only the rows affected by changed_movies are recomputed:
+        the changed movies themselves, movies similar to them now, and movies that listed
+        them as neighbours before. Returns None when a full rebuild is needed instead.
+
+        This is an approximation. A changed rating also moves its user's mean, which shifts
+        the centred ratings, and so the similarities, of every other movie that user rated.
+        Those rows keep their old neighbours until the next full rebuild, so the drift is
+        bounded by REC_FULL_REBUILD_EVERY refreshes.
+        """
+        triplets = self.triplets.replace_movies(fresh, changed_movies)
+        movie_ids, centred, normalized = self._matrices(triplets)
+        if not np.array_equal(movie_ids, self.movie_ids):
+            return None
+
+        # Movies without ratings (new, or edited and never rated) are not in the model
+        changed_movies = changed_movies[np.isin(changed_movies, movie_ids)]
+        changed = np.searchsorted(movie_ids, changed_movies)
+        similar_now = (normalized[:, changed].T @ normalized).indices
+        listed_before = np.nonzero(np.isin(self.neighbours, changed).any(axis=1))[0]
+        affected = np.unique(np.concatenate([changed, similar_now, listed_before]))
+        if len(affected) > len(movie_ids) // 2:
+            return None
+
+        neighbours, scores = self.neighbours.copy(), self.scores.copy()
+        neighbours[affected], scores[affected] = self._top_k(normalized, affected, self.neighbours.shape[1])
+        logger.info(f"Recomputed similarity for {len(affected)} of {len(movie_ids)} movies")
+        return SimilarityModel(triplets, movie_ids, centred, neighbours, scores)
+
+    def _row(self, movie_id: int) -> Optional[int]:
+        row = int(np.searchsorted(self.movie_ids, movie_id))
+        if row < len(self.movie_ids) and self.movie_ids[row] == movie_id:
+            return row
+        return None
+
+    def similar(self, movie_id: int, limit: int) -> List[Tuple[int, float]]:
+        row = self._row(movie_id)
+        if row is None:
+            return []
+        neighbours = self.neighbours[row, :limit]
+        found = neighbours >= 0
+        return list(zip(self.movie_ids[neighbours[found]].tolist(), self.scores[row, :limit][found].tolist()))
+
+    def recommend(self, user_id: UUID, limit: int) -> List[Tuple[int, float]]:
+        """
+        Score unrated movies by the similarity-weighted, user-centred ratings of the user's
+        rated movies, and return the best ones.
+        """
+        user = self.triplets.user_index.get(user_id)
+        if user is None or user >= self.centred.shape[0]:
+            return []
+        lo, hi = self.centred.indptr[user], self.centred.indptr[user + 1]
+        rated, centred = self.centred.indices[lo:hi], self.centred.data[lo:hi]
+        if len(rated) == 0:
+            return []
+
+        neighbours, similarity = self.neighbours[rated], self.scores[rated]
+        valid = neighbours >= 0
+        candidates = neighbours[valid]
+        totals = np.bincount(candidates, weights=(similarity * centred[:, None])[valid], minlength=len(self.movie_ids))
+        weights = np.bincount(candidates, weights=similarity[valid], minlength=len(self.movie_ids))
+        predicted = np.divide(totals, weights, out=np.full(len(self.movie_ids), -np.inf), where=weights > 0)
+        predicted[rated] = -np.inf
+
+        count = min(limit, int(np.isfinite(predicted).sum()))
+        if count == 0:
+            return []
+        best = np.argpartition(-predicted, count - 1)[:count]
+        best = best[np.argsort(-predicted[best])]
+        return list(zip(self.movie_ids[best].tolist(), predicted[best].tolist()))
+
+
+class RecommendationService:
+    """
+    Owns the current similarity snapshot and refreshes it in the background.
+
+    Movies whose ratings changed (in any worker, via the change feed) are collected
+    between refreshes. A refresh recomputes just those, and every few refreshes the
+    model is rebuilt from scratch. New snapshots replace the old one in a single
+    assignment, so requests always read a complete model.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session], top_k: int = REC_TOP_K):
+        self.session_factory = session_factory
+        self.top_k = top_k
+        self.model: Optional[SimilarityModel] = None
+        self._changed: Set[int] = set()
+        # Movies deleted in this worker that the current model still contains
+        self._hidden: Set[int] = set()
+        self._lock = threading.Lock()
+        self._refreshes = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def on_change(self, change: ChangeEvent) -> None:
+        with self._lock:
+            if change.id is None:
+                self._refreshes = 0
+            else:
+                self._changed.add(int(change.id))
+
+    def hide(self, movie_id: int) -> None:
+        """
+        Leave a deleted movie out of results until a model built without it is in place.
+        """
+        with self._lock:
+            self._hidden.add(movie_id)
+
+    def refresh(self) -> None:
+        with self._lock:
+            changed, self._changed = self._changed, set()
+        model = self.model
+        full = model is None or REC_FULL_REBUILD_EVERY <= 1 or self._refreshes % REC_FULL_REBUILD_EVERY == 0
+        if not full and not changed:
+            return
+
+        start = time.perf_counter()
+        db = self.session_factory()
+        try:
+            if not full:
+                fresh = RatingTriplets.load(db, dict(model.triplets.user_index), sorted(changed))
+                new_model = model.update(fresh, np.asarray(sorted(changed), dtype=np.int64))
+                full = new_model is None
+            if full:
+                new_model = SimilarityModel.build(RatingTriplets.load(db), self.top_k)
+        except Exception:
+            with self._lock:
+                self._changed |= changed
+                # Start over from a full rebuild rather than retrying the same update
+                self._refreshes = 0
+            raise
+        finally:
+            db.close()
+
+        with self._lock:
+            # Movies deleted before the load are gone from the new model and need no more hiding
+            self._hidden = {movie_id for movie_id in self._hidden if new_model._row(movie_id) is not None}
+            self.model = new_model
+        self._refreshes += 1
+        kind = "Rebuilt" if full else "Updated"
+        logger.info(f"{kind} recommendation model: {len(new_model.movie_ids)} movies, "
+                    f"{len(new_model.triplets.user_index)} users in {(time.perf_counter() - start) * 1000:.0f}ms")
+
+    def _ready_model(self) -> SimilarityModel:
+        model = self.model
+        if model is None:
+            raise HTTPException(status_code=503, detail="Recommendations are not available yet")
+        return model
+
+    def _visible(self, movies: List[Tuple[int, float]], hidden: Set[int], limit: int) -> List[Tuple[int, float]]:
+        return [(id, score) for id, score in movies if id not in hidden][:limit]
+
+    def similar(self, movie_id: int, limit: int) -> RecommendationResponse:
+        model, hidden = self._ready_model(), self._hidden
+        # Ask for enough extra results to make up for the hidden ones
+        movies = [] if movie_id in hidden else self._visible(model.similar(movie_id, limit + len(hidden)), hidden, limit)
+        return RecommendationResponse(
+            message="Similar movies retrieved successfully",
+            data=[ScoredMovie(movie_id=id, score=round(score, 4)) for id, score in movies],
+        )
+
+    def recommend(self, user_id: UUID, limit: int) -> RecommendationResponse:
+        model, hidden = self._ready_model(), self._hidden
+        movies = self._visible(model.recommend(user_id, limit + len(hidden)), hidden, limit)
+        return RecommendationResponse(
+            message="Recommendations retrieved successfully",
+            data=[ScoredMovie(movie_id=id, score=round(score, 4)) for id, score in movies],
+        )
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await run_in_threadpool(self.refresh)
+            except Exception as e:
+                logger.error(f"Failed to refresh recommendation model: {str(e)}")
+            await asyncio.sleep(REC_REFRESH_SECONDS)
+
+
+recommendation_service = RecommendationService(database.SessionLocal)
+change_feed.subscribe("rating", recommendation_service.on_change)
+# Movies deleted in other workers drop out of the model at the next refresh
+change_feed.subscribe("movie", recommendation_service.on_change)
+
+async def start_recommendations() -> None:
+    if RECOMMENDATIONS_ENABLED:
+        await recommendation_service.start()
+
+async def stop_recommendations() -> None:
+    await recommendation_service.stop()
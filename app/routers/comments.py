@@ -1,18 +1,21 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request
+from fastapi.responses import StreamingResponse
 from typing import List
 import logging
 
 from sqlalchemy.orm import Session
 
 from ..database import get_db
+from ..sessions import SessionReleasingRoute
 from ..schemas.comments import CommentCreate, CommentInDB, CommentReply
-from ..crud.comments import add_comment, get_comments_by_movie, add_nested_comment
+from ..crud.comments import add_comment, get_comments_by_movie, add_nested_comment, stream_comments_by_movie
 from ..models.users import User
 from ..auth import get_current_user
+from ..singleflight import comment_flight
 
 logger = logging.getLogger(__name__)
 
-comments_router = APIRouter()
+comments_router = APIRouter(route_class=SessionReleasingRoute)
 
 @comments_router.post("/", response_model=CommentInDB)
 async def create_comment(payload: CommentCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
@@ -33,19 +36,27 @@ async def create_comment(payload: CommentCreate, db: Session = Depends(get_db),
     return comment
 
 @comments_router.get("/{movie_id}", response_model=List[CommentInDB])
-async def get_comments(movie_id: int, db: Session = Depends(get_db)):
+async def get_comments(movie_id: int, request: Request, db: Session = Depends(get_db)):
     """
     Retrieve all comments for a specific movie.
 
+    Clients sending `Accept: application/x-ndjson` receive the thread as a stream of
+    flat comments in depth-first order, one JSON object per line, instead of a nested list.
+
     Parameters:
         - movie_id (int): The ID of the movie.
+        - request (Request): The incoming request, used for content negotiation.
         - db (Session): The database session.
 
     Returns:
         - List[CommentInDB]: A list of all comments for the movie, including nested replies.
     """
+    if "application/x-ndjson" in request.headers.get("accept", ""):
+        logger.info(f"Streaming comments for movie_id={movie_id}")
+        return StreamingResponse(stream_comments_by_movie(db, movie_id), media_type="application/x-ndjson")
+
     logger.info(f"Fetching comments for movie_id={movie_id}")
-    comments = get_comments_by_movie(db, movie_id)
+    comments = await comment_flight.run(movie_id, db, get_comments_by_movie, movie_id)
     logger.info(f"Found {len(comments)} comments for movie_id={movie_id}")
     return comments
 
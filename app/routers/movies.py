@@ -1,47 +1,75 @@
 import logging
 
 from sqlalchemy.orm import Session
-from fastapi import APIRouter, Depends, HTTPException
-from typing import List
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query
+from typing import List, Optional
 
-from ..schemas.movies import MovieCreate, MovieResponse, MovieUpdate, MovieInDB
+from ..schemas.movies import MovieCreate, MovieFieldsResponse, MovieResponse, MovieUpdate, MovieInDB, TitleSuggestionResponse
+from ..schemas.recommendations import RecommendationResponse
 from ..database import get_db
-from ..crud.movies import get_movies, get_movie_id, add_movie, get_movie_title, update_movie_by_id, delete_by_id
+from ..sessions import SessionReleasingRoute
+from ..crud.movies import (
+    MOVIE_LIST_FIELDS, get_movies, get_movie_id, add_movie, get_movie_title, update_movie_by_id, delete_by_id,
+    parse_movie_fields, select_movie_fields,
+)
 from ..auth import get_current_user
 from ..models.users import User
+from ..recommendations import recommendation_service
+from ..autocomplete import autocomplete_service
+from ..singleflight import movie_flight
 
 logger = logging.getLogger(__name__)
 
-movies_router = APIRouter()
+movies_router = APIRouter(route_class=SessionReleasingRoute)
 
-@movies_router.get("/", response_model=MovieResponse)
-async def get_all_movies(db: Session = Depends(get_db)):
+@movies_router.get("/", response_model=MovieFieldsResponse, response_model_exclude_unset=True)
+async def get_all_movies(fields: Optional[str] = Query(None, description="Comma separated fields to return, e.g. id,title"), db: Session = Depends(get_db)):
     """
-    Retrieve all movies from the database.
+    Retrieve all movies from the database. The description is only included when
+    it is listed in fields.
     """
     logger.info("Fetching all movies")
-    db_movies = get_movies(db)
+    db_movies = get_movies(db, parse_movie_fields(fields, MOVIE_LIST_FIELDS))
     logger.info(f"Found {len(db_movies.data)} movies")
     return db_movies
 
-@movies_router.get("/{movie_id}", response_model=MovieResponse)
-async def get_movie_by_id(movie_id: int, db: Session = Depends(get_db)):
+@movies_router.get("/autocomplete", response_model=TitleSuggestionResponse)
+def autocomplete_titles(prefix: str = Query(..., min_length=1, max_length=200), limit: int = Query(10, ge=1, le=50)):
     """
-    Retrieve a specific movie by its ID.
+    Suggest movie titles starting with a prefix, most rated first.
+    Served from the in-memory title index without touching the database.
     """
+    return autocomplete_service.suggest(prefix, limit)
+
+@movies_router.get("/{movie_id}", response_model=MovieFieldsResponse, response_model_exclude_unset=True)
+async def get_movie_by_id(movie_id: int, fields: Optional[str] = Query(None, description="Comma separated fields to return, e.g. id,title"), db: Session = Depends(get_db)):
+    """
+    Retrieve a specific movie by its ID, with all fields or the ones listed in fields.
+    """
+    selected = parse_movie_fields(fields)
     logger.info(f"Fetching movie with id={movie_id}")
-    db_movie = get_movie_id(db, movie_id)
+    db_movie = await movie_flight.run(movie_id, db, get_movie_id, movie_id)
     logger.info(f"Found movie: {db_movie.data.title}")
-    return db_movie
+    # The cached movie is complete; only the requested fields are serialized
+    return MovieFieldsResponse(message=db_movie.message, data=select_movie_fields(db_movie.data, selected))
 
-@movies_router.get("/by_title/{title}", response_model=MovieResponse)
-async def get_movie_by_title(title: str, db: Session = Depends(get_db)):
+@movies_router.get("/{movie_id}/similar", response_model=RecommendationResponse)
+def get_similar_movies(movie_id: int, limit: int = Query(10, ge=1, le=100)):
     """
-    Retrieve a specific movie by its title.
+    Retrieve the movies most similar to a movie, based on how users rated both.
+    Served from the precomputed similarity model without touching the database.
+    """
+    logger.info(f"Fetching movies similar to movie with id={movie_id}")
+    return recommendation_service.similar(movie_id, limit)
+
+@movies_router.get("/by_title/{title}", response_model=MovieFieldsResponse, response_model_exclude_unset=True)
+async def get_movie_by_title(title: str, fields: Optional[str] = Query(None, description="Comma separated fields to return, e.g. id,title"), db: Session = Depends(get_db)):
+    """
+    Retrieve a specific movie by its title, with all fields or the ones listed in fields.
     """
     logger.info(f"Fetching movie with title={title}")
-    db_movie = get_movie_title(db, title)
-    logger.info(f"Found movie: {db_movie.data.title}")
+    db_movie = get_movie_title(db, title, parse_movie_fields(fields))
+    logger.info(f"Found movie: {title}")
     return db_movie
 
 @movies_router.post("/", response_model=MovieResponse)
@@ -65,11 +93,11 @@ async def update_movie(movie_id: int, payload: MovieUpdate, db: Session = Depend
     return movie
 
 @movies_router.delete("/{movie_id}", response_model=MovieResponse)
-async def delete_movie(movie_id: int, db: Session = Depends(get_db), current_user: User= Depends(get_current_user)):
+async def delete_movie(movie_id: int, background_tasks: BackgroundTasks, db: Session = Depends(get_db), current_user: User= Depends(get_current_user)):
     """
     Delete a movie from the database.
     """
     logger.info(f"Deleting movie with id={movie_id}")
-    movie = delete_by_id(db, movie_id, current_user.user_id)
+    movie = delete_by_id(db, movie_id, current_user.user_id, background_tasks)
     logger.info(f"Deleted movie with id={movie_id}")
     return movie
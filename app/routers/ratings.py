@@ -1,19 +1,24 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
 import logging
 from pydantic import conint
 
 from ..database import get_db
+from ..sessions import SessionReleasingRoute
 from ..auth import get_current_user
-from ..crud.ratings import get_ratings, set_movie_rating
-from ..schemas.ratings import RatingCreate, RatingResponse
+from ..crud.ratings import get_ratings, set_movie_rating, get_rating_stats, get_catalog_stats
+from ..crud.movies import get_movie_id
+from ..rating_stream import rating_stream_hub
+from ..singleflight import rating_flight
+from ..schemas.ratings import RatingCreate, RatingResponse, MovieRatingStats, CatalogRatingStats
 from ..schemas.users import UserInDB
 from ..models.users import User
 
 logger = logging.getLogger(__name__)
 
-ratings_router = APIRouter()
+ratings_router = APIRouter(route_class=SessionReleasingRoute)
 
 @ratings_router.get("/", response_model=RatingResponse)
 async def get_movie_ratings(movie_id: int, db: Session = Depends(get_db)):
@@ -28,10 +33,63 @@ async def get_movie_ratings(movie_id: int, db: Session = Depends(get_db)):
         - RatingResponse: The aggregate rating for the movie.
     """
     logger.info(f"Fetching rating for movie with id={movie_id}")
-    rating = get_ratings(db, movie_id)
+    rating = await rating_flight.run(movie_id, db, get_ratings, movie_id)
     logger.info(f"Returning rating for movie with id={movie_id}")
     return rating
 
+@ratings_router.get("/stats", response_model=MovieRatingStats)
+def get_movie_rating_stats(movie_id: int, db: Session = Depends(get_db)):
+    """
+    Retrieve the rating distribution of a movie.
+
+    Parameters:
+        - movie_id (int): The ID of the movie.
+        - db (Session): The database session.
+
+    Returns:
+        - MovieRatingStats: The star histogram, vote count, mean, standard deviation
+          and 95% confidence interval of the mean.
+    """
+    logger.info(f"Fetching rating statistics for movie with id={movie_id}")
+    return get_rating_stats(db, movie_id)
+
+@ratings_router.get("/stats/catalog", response_model=CatalogRatingStats)
+def get_catalog_rating_stats(db: Session = Depends(get_db)):
+    """
+    Retrieve the rating distribution across all movies. The result is cached for a few minutes.
+
+    Parameters:
+        - db (Session): The database session.
+
+    Returns:
+        - CatalogRatingStats: The same figures as the per-movie statistics, over every rating.
+    """
+    logger.info("Fetching catalog rating statistics")
+    return get_catalog_stats(db)
+
+@ratings_router.get("/stream")
+async def stream_movie_ratings(movie_id: int, db: Session = Depends(get_db)):
+    """
+    Stream live aggregate ratings for a movie as Server-Sent Events.
+
+    An `event: rating` carrying the average and count is sent when the stream opens
+    and after ratings change, at most once per interval.
+
+    Parameters:
+        - movie_id (int): The ID of the movie to follow.
+        - db (Session): The database session.
+
+    Returns:
+        - StreamingResponse: A `text/event-stream` of RatingUpdate events.
+    """
+    logger.info(f"Opening rating stream for movie with id={movie_id}")
+    get_movie_id(db, movie_id)
+    return StreamingResponse(
+        rating_stream_hub.events(movie_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @ratings_router.post("/", response_model=RatingResponse)
 async def rate_movie(rating: RatingCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     """
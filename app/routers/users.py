@@ -1,17 +1,28 @@
 import logging
 
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Optional
+from uuid import UUID
+
+from fastapi import APIRouter, Depends, HTTPException, Query
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 
-from ..auth import authenticate_user, create_access_token
+from ..auth import authenticate_user, create_access_token, get_current_user
 from ..schemas.users import UserCreate, UserResponse
+from ..schemas.tokens import TokenRefresh
+from ..schemas.recommendations import RecommendationResponse
+from ..schemas.activity import UserCommentsPage, UserMoviesPage, UserRatingsPage
+from ..models.users import User
+from ..recommendations import recommendation_service
 from ..crud.users import create_user, get_user_by_username
+from ..crud.tokens import create_refresh_token, rotate_refresh_token
+from ..crud.activity import get_user_comments, get_user_movies, get_user_ratings
 from ..database import get_db
+from ..sessions import SessionReleasingRoute
 
 logger = logging.getLogger(__name__)
 
-users_router = APIRouter()
+users_router = APIRouter(route_class=SessionReleasingRoute)
 
 @users_router.post("/signup", response_model=UserResponse)
 def signup(user: UserCreate, db: Session = Depends(get_db)):
@@ -45,7 +56,7 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
         db (Session): The database session.
 
     Returns:
-        dict: A dictionary containing the access token and token type.
+        dict: A dictionary containing the access token, refresh token and token type.
     """
     logger.info(f"Authenticating user with username={form_data.username}")
     user = authenticate_user(db, form_data.username, form_data.password)
@@ -58,5 +69,91 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
         )
     
     access_token = create_access_token(data={"sub": user.username})
+    refresh_token = create_refresh_token(db, user.user_id)
     logger.info("User authenticated successfully")
-    return {"access_token": access_token, "token_type": "bearer"}
+    return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
+
+@users_router.post("/token/refresh", response_model=dict)
+def refresh(payload: TokenRefresh, db: Session = Depends(get_db)):
+    """
+    Exchange a refresh token for a new access token without re-entering the password.
+    The refresh token is rotated: the presented token is consumed and a new one returned.
+
+    Args:
+        payload (TokenRefresh): The refresh token from the previous login or refresh.
+        db (Session): The database session.
+
+    Returns:
+        dict: A dictionary containing the new access token, refresh token and token type.
+    """
+    logger.info("Refreshing access token")
+    username, refresh_token = rotate_refresh_token(db, payload.refresh_token)
+    access_token = create_access_token(data={"sub": username})
+    logger.info(f"Access token refreshed for user {username}")
+    return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
+
+@users_router.get("/users/me/recommendations", response_model=RecommendationResponse)
+def get_my_recommendations(limit: int = Query(10, ge=1, le=100), current_user: User = Depends(get_current_user)):
+    """
+    Recommend movies the current user has not rated, from the movies they rated.
+
+    Args:
+        limit (int): The maximum number of movies to return.
+        current_user (User): The authenticated user.
+
+    Returns:
+        RecommendationResponse: The recommended movies, best first.
+    """
+    logger.info(f"Fetching recommendations for user {current_user.username}")
+    return recommendation_service.recommend(current_user.user_id, limit)
+
+@users_router.get("/users/me/ratings", response_model=UserRatingsPage)
+def get_my_ratings(after: Optional[UUID] = None, limit: int = Query(20, ge=1, le=100),
+                   db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """
+    List the current user's ratings with the title of each movie, one page at a time.
+
+    Args:
+        after (Optional[UUID]): The next_cursor of the previous page, omitted for the first page.
+        limit (int): The maximum number of ratings on the page.
+        db (Session): The database session.
+        current_user (User): The authenticated user.
+
+    Returns:
+        UserRatingsPage: The ratings on the page and the cursor of the next page.
+    """
+    return get_user_ratings(db, current_user.user_id, after, limit)
+
+@users_router.get("/users/me/comments", response_model=UserCommentsPage)
+def get_my_comments(after: Optional[UUID] = None, limit: int = Query(20, ge=1, le=100),
+                    db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """
+    List the current user's comments and replies with the title of each movie, one page at a time.
+
+    Args:
+        after (Optional[UUID]): The next_cursor of the previous page, omitted for the first page.
+        limit (int): The maximum number of comments on the page.
+        db (Session): The database session.
+        current_user (User): The authenticated user.
+
+    Returns:
+        UserCommentsPage: The comments on the page and the cursor of the next page.
+    """
+    return get_user_comments(db, current_user.user_id, after, limit)
+
+@users_router.get("/users/me/movies", response_model=UserMoviesPage)
+def get_my_movies(after: Optional[int] = None, limit: int = Query(20, ge=1, le=100),
+                  db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """
+    List the movies the current user submitted, one page at a time.
+
+    Args:
+        after (Optional[int]): The next_cursor of the previous page, omitted for the first page.
+        limit (int): The maximum number of movies on the page.
+        db (Session): The database session.
+        current_user (User): The authenticated user.
+
+    Returns:
+        UserMoviesPage: The movies on the page and the cursor of the next page.
+    """
+    return get_user_movies(db, current_user.user_id, after, limit)
@@ -0,0 +1,76 @@
+from pydantic import BaseModel
+from typing import List, Optional
+from uuid import UUID
+
+from .movies import MovieInDB
+
+class UserRatingItem(BaseModel):
+    """
+    Schema for one of the current user's ratings.
+    
+    Attributes:
+        id (UUID): The unique identifier of the rating.
+        movie_id (int): The ID of the rated movie.
+        movie_title (str): The title of the rated movie.
+        rating (int): The rating given by the user.
+    """
+    id: UUID
+    movie_id: int
+    movie_title: str
+    rating: int
+
+class UserCommentItem(BaseModel):
+    """
+    Schema for one of the current user's comments.
+    
+    Attributes:
+        id (UUID): The unique identifier of the comment.
+        movie_id (int): The ID of the movie the comment is on.
+        movie_title (str): The title of the movie the comment is on.
+        content (str): The content of the comment.
+        parent_id (Optional[UUID]): The ID of the parent comment, if the comment is a reply.
+    """
+    id: UUID
+    movie_id: int
+    movie_title: str
+    content: str
+    parent_id: Optional[UUID] = None
+
+class UserRatingsPage(BaseModel):
+    """
+    Schema for a page of the current user's ratings.
+    
+    Attributes:
+        message (str): A message indicating the status of the operation.
+        data (List[UserRatingItem]): The ratings on this page.
+        next_cursor (Optional[UUID]): Pass as `after` to fetch the next page, None on the last page.
+    """
+    message: str
+    data: List[UserRatingItem]
+    next_cursor: Optional[UUID] = None
+
+class UserCommentsPage(BaseModel):
+    """
+    Schema for a page of the current user's comments.
+    
+    Attributes:
+        message (str): A message indicating the status of the operation.
+        data (List[UserCommentItem]): The comments on this page.
+        next_cursor (Optional[UUID]): Pass as `after` to fetch the next page, None on the last page.
+    """
+    message: str
+    data: List[UserCommentItem]
+    next_cursor: Optional[UUID] = None
+
+class UserMoviesPage(BaseModel):
+    """
+    Schema for a page of the movies submitted by the current user.
+    
+    Attributes:
+        message (str): A message indicating the status of the operation.
+        data (List[MovieInDB]): The movies on this page.
+        next_cursor (Optional[int]): Pass as `after` to fetch the next page, None on the last page.
+    """
+    message: str
+    data: List[MovieInDB]
+    next_cursor: Optional[int] = None
@@ -61,3 +61,23 @@ class CommentReply(CommentBase):
     """
     parent_id: UUID
     pass
+
+class CommentStreamItem(CommentBase):
+    """
+    Schema for a single line of the NDJSON comment stream. Comments are emitted flat,
+    in depth-first order, so the tree is described by parent_id and depth instead of
+    nested replies.
+    
+    Attributes:
+        id (UUID): The unique identifier for the comment.
+        user_id (UUID): The unique identifier for the user who created the comment.
+        parent_id (Optional[UUID]): The ID of the parent comment, or None for a top-level comment.
+        depth (int): The nesting level of the comment, 0 for top-level comments.
+    
+    Inherits:
+        CommentBase: The base schema for a comment, containing content and movie_id.
+    """
+    id: UUID
+    user_id: UUID
+    parent_id: Optional[UUID] = None
+    depth: int
@@ -56,3 +56,56 @@ class MovieResponse(BaseModel):
     """
     message: str
     data: Union[MovieInDB, List[MovieInDB]]
+
+class TitleSuggestion(BaseModel):
+    """
+    A movie title suggested for a typed prefix.
+
+    Attributes:
+        id (int): The ID of the movie.
+        title (str): The title of the movie.
+        rating_count (int): How many ratings the movie had when the index was last rebuilt.
+    """
+    id: int
+    title: str
+    rating_count: int
+
+class TitleSuggestionResponse(BaseModel):
+    """
+    Schema for a title autocomplete response.
+
+    Attributes:
+        message (str): A message indicating the status of the operation.
+        data (List[TitleSuggestion]): The suggested titles, most rated first.
+    """
+    message: str
+    data: List[TitleSuggestion]
+
+class MovieFields(BaseModel):
+    """
+    Schema for a movie restricted to the fields a client asked for. Fields that were not
+    selected are left unset and omitted from the response.
+
+    Attributes:
+        id (int): The unique identifier for the movie. Always returned.
+        title (Optional[str]): The title of the movie.
+        description (Optional[str]): A brief description of the movie.
+        release_date (Optional[date]): The release date of the movie.
+        user_id (Optional[UUID]): The unique identifier for the user who created the movie.
+    """
+    id: int
+    title: Optional[str] = None
+    description: Optional[str] = None
+    release_date: Optional[date] = None
+    user_id: Optional[UUID] = None
+
+class MovieFieldsResponse(BaseModel):
+    """
+    Schema for a movie response with selected fields.
+
+    Attributes:
+        message (str): A message indicating the status of the operation.
+        data (Union[MovieFields, List[MovieFields]]): The movie data, either as a single item or a list.
+    """
+    message: str
+    data: Union[MovieFields, List[MovieFields]]
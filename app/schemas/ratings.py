@@ -1,5 +1,6 @@
 from pydantic import BaseModel, Field, ConfigDict
 from uuid import UUID
+from typing import Dict, Optional
 from decimal import Decimal
 
 class RatingBase(BaseModel):
@@ -60,4 +61,54 @@ class RatingResponse(BaseModel):
     movie_title: str
     average_rating: float
 
+class RatingUpdate(BaseModel):
+    """
+    Schema for a live rating update pushed over Server-Sent Events.
+    
+    Attributes:
+        movie_id (int): The ID of the movie.
+        average_rating (float): The average rating for the movie, 0 if it has no ratings.
+        rating_count (int): The number of ratings for the movie.
+    """
+    movie_id: int
+    average_rating: float
+    rating_count: int
+
+class RatingDistribution(BaseModel):
+    """
+    Schema for the distribution of a set of ratings.
+    
+    Attributes:
+        rating_count (int): The number of ratings.
+        average_rating (float): The mean rating, 0 if there are no ratings.
+        std_dev (float): The sample standard deviation of the ratings.
+        confidence_low (Optional[float]): The lower bound of the 95% confidence interval of the mean.
+        confidence_high (Optional[float]): The upper bound of the 95% confidence interval of the mean.
+        histogram (Dict[int, int]): The number of ratings for each star value from 1 to 5.
+    """
+    rating_count: int
+    average_rating: float
+    std_dev: float
+    confidence_low: Optional[float] = None
+    confidence_high: Optional[float] = None
+    histogram: Dict[int, int]
+
+class MovieRatingStats(RatingDistribution):
+    """
+    Schema for the rating statistics of one movie.
     
+    Attributes:
+        movie_id (int): The ID of the movie.
+        movie_title (str): The title of the movie.
+    """
+    movie_id: int
+    movie_title: str
+
+class CatalogRatingStats(RatingDistribution):
+    """
+    Schema for the rating statistics across all movies.
+    
+    Attributes:
+        movie_count (int): The number of movies with at least one rating.
+    """
+    movie_count: int
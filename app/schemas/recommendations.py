@@ -0,0 +1,24 @@
+from pydantic import BaseModel
+from typing import List
+
+class ScoredMovie(BaseModel):
+    """
+    A recommended movie and how strongly it is recommended.
+
+    Attributes:
+        movie_id (int): The ID of the recommended movie.
+        score (float): The similarity to the requested movie, or the predicted rating offset for the user.
+    """
+    movie_id: int
+    score: float
+
+class RecommendationResponse(BaseModel):
+    """
+    Schema for a recommendation response.
+
+    Attributes:
+        message (str): A message indicating the status of the operation.
+        data (List[ScoredMovie]): The recommended movies, best first.
+    """
+    message: str
+    data: List[ScoredMovie]
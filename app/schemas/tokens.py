@@ -0,0 +1,10 @@
+from pydantic import BaseModel
+
+class TokenRefresh(BaseModel):
+    """
+    Schema for exchanging a refresh token for a new access token.
+    
+    Attributes:
+        refresh_token (str): The refresh token issued at login or by the previous refresh.
+    """
+    refresh_token: str
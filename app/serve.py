@@ -0,0 +1,205 @@
+"""
+Multi-process server for the API.
+
+The app is imported once in the parent (running its import-time setup a single time),
+then N workers are forked that share one listening socket. Each worker drops the pool it
+inherited and builds its own, sized from a global connection budget so that all workers
+together never open more database connections than the budget allows.
+
+    python -m app.serve --workers 4 --host 0.0.0.0 --port 8000
+
+Forking requires a Unix platform. Use `uvicorn app.main:app` for development.
+"""
+import os
+import time
+import socket
+import signal
+import logging
+import argparse
+from typing import Dict, Optional, Tuple
+
+import uvicorn
+
+logger = logging.getLogger("app.serve")
+
+# Total database connections all workers may hold together; unset means no budget
+DB_CONNECTION_BUDGET = int(os.environ.get("DB_CONNECTION_BUDGET", 0))
+# A worker that exits sooner than this after starting counts as a failed start
+WORKER_FAST_EXIT_SECONDS = float(os.environ.get("WORKER_FAST_EXIT_SECONDS", 10))
+# Consecutive failed starts of one worker before the server gives up
+WORKER_MAX_FAST_EXITS = int(os.environ.get("WORKER_MAX_FAST_EXITS", 5))
+# Delay before restarting after the first failed start, doubled for each further one
+WORKER_RESTART_BACKOFF_SECONDS = float(os.environ.get("WORKER_RESTART_BACKOFF_SECONDS", 1))
+WORKER_RESTART_BACKOFF_MAX_SECONDS = float(os.environ.get("WORKER_RESTART_BACKOFF_MAX_SECONDS", 30))
+
+
+def worker_pool_size(workers: int, budget: int = DB_CONNECTION_BUDGET, reserved: int = 0) -> Tuple[int, int]:
+    """
+    Split the connection budget between workers.
+
+    :param workers: The number of worker processes.
+    :param budget: Total connections allowed across workers, 0 for the configured defaults.
+    :param reserved: Connections each worker holds outside its pool (e.g. a LISTEN connection).
+    :return: The pool size and max overflow for one worker.
+    """
+    from .database import DB_MAX_OVERFLOW, DB_POOL_SIZE
+
+    if not budget:
+        return DB_POOL_SIZE, DB_MAX_OVERFLOW
+    per_worker = max(1, budget // workers - reserved)
+    # A hard budget leaves no room for overflow connections
+    return per_worker, 0
+
+
+def restart_delay(fast_exits: int) -> Optional[float]:
+    """
+    Seconds to wait before restarting a worker, or None to give up.
+
+    :param fast_exits: Consecutive times the worker exited soon after starting.
+    """
+    if fast_exits >= WORKER_MAX_FAST_EXITS:
+        return None
+    if not fast_exits:
+        return 0.0
+    return min(WORKER_RESTART_BACKOFF_MAX_SECONDS, WORKER_RESTART_BACKOFF_SECONDS * 2 ** (fast_exits - 1))
+
+
+class Supervisor:
+    """
+    Forks the workers, restarts any that die, and forwards shutdown signals.
+
+    Restarts of a worker that keeps exiting right after it starts (a bad config, an
+    unreachable database) back off exponentially, and after WORKER_MAX_FAST_EXITS in a
+    row the whole server stops with a failure status instead of fork-looping.
+    """
+
+    def __init__(self, app, sock: socket.socket, workers: int, uvicorn_options: dict):
+        self.app = app
+        self.sock = sock
+        self.workers = workers
+        self.uvicorn_options = uvicorn_options
+        self.children: Dict[int, int] = {}
+        self.started: Dict[int, float] = {}
+        self.fast_exits: Dict[int, int] = {}
+        self.stopping = False
+        self.exit_code = 0
+
+    def spawn(self, index: int) -> None:
+        pid = os.fork()
+        if pid:
+            self.children[pid] = index
+            self.started[index] = time.monotonic()
+            return
+
+        # Worker process: whatever happens, it must never return into the supervisor loop
+        code = 1
+        try:
+            self.serve(index)
+            code = 0
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else 1
+        except BaseException:
+            logger.exception(f"Worker {index} (pid {os.getpid()}) failed")
+        finally:
+            os._exit(code)
+
+    def serve(self, index: int) -> None:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        from . import database
+        from .change_feed import CHANGE_FEED_BACKEND
+
+        listens = CHANGE_FEED_BACKEND != "local" and database.engine.dialect.name == "postgresql"
+        pool_size, max_overflow = worker_pool_size(self.workers, reserved=1 if listens else 0)
+        database.configure_engine(pool_size, max_overflow)
+        logger.info(f"Worker {index} (pid {os.getpid()}) started with pool_size={pool_size}, max_overflow={max_overflow}")
+
+        config = uvicorn.Config(self.app, **self.uvicorn_options)
+        uvicorn.Server(config).run(sockets=[self.sock])
+
+    def stop(self, signum, frame) -> None:
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def sleep(self, seconds: float) -> None:
+        # Wakes early when a shutdown signal arrives
+        deadline = time.monotonic() + seconds
+        while not self.stopping and time.monotonic() < deadline:
+            time.sleep(min(0.1, deadline - time.monotonic()))
+
+    def restart(self, index: int, pid: int, status: int) -> None:
+        lifetime = time.monotonic() - self.started.pop(index, 0.0)
+        fast_exits = self.fast_exits.get(index, 0) + 1 if lifetime < WORKER_FAST_EXIT_SECONDS else 0
+        self.fast_exits[index] = fast_exits
+        delay = restart_delay(fast_exits)
+        if delay is None:
+            logger.error(f"Worker {index} (pid {pid}) exited with status {status} {fast_exits} times in a row "
+                         f"within {WORKER_FAST_EXIT_SECONDS:.0f}s of starting, shutting down")
+            self.exit_code = 1
+            self.stop(None, None)
+            return
+        logger.warning(f"Worker {index} (pid {pid}) exited with status {status} after {lifetime:.1f}s, "
+                       f"restarting in {delay:.1f}s")
+        self.sleep(delay)
+        if not self.stopping:
+            self.spawn(index)
+
+    def run(self) -> int:
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for index in range(self.workers):
+            self.spawn(index)
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            index = self.children.pop(pid, None)
+            if index is not None and not self.stopping:
+                self.restart(index, pid, status)
+        logger.info("All workers stopped")
+        return self.exit_code
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve the API with several worker processes.")
+    parser.add_argument("--host", default=os.environ.get("HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 8000)))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1)))
+    parser.add_argument("--backlog", type=int, default=2048)
+    args = parser.parse_args()
+
+    # Preload: the app is imported once, then the parent's pool is closed before forking
+    from . import database, hashing, main
+
+    # Calibrate bcrypt once here so every worker inherits the same exact cost
+    if hashing.BCRYPT_TARGET_MS:
+        hashing.calibrate_from_env(tolerance=0)
+        hashing.BCRYPT_TARGET_MS = 0
+
+    # Create the tables once here rather than racing in every worker
+    if main.DB_CREATE_ALL:
+        main.create_tables()
+        main.DB_CREATE_ALL = False
+    database.engine.dispose()
+
+    sock = socket.socket(socket.AF_INET6 if ":" in args.host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(args.backlog)
+    sock.set_inheritable(True)
+    logger.info(f"Serving on {args.host}:{args.port} with {args.workers} workers")
+
+    supervisor = Supervisor(main.app, sock, args.workers, {"lifespan": "on", "backlog": args.backlog})
+    raise SystemExit(supervisor.run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import time
+import asyncio
+import functools
+from contextvars import ContextVar
+from typing import Any, Callable, Optional
+
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import Pool
+
+from .metrics import metrics
+from .profiling import profile_thread
+
+# The route template of the request being handled, used to label pool metrics
+current_route: ContextVar[str] = ContextVar("current_route", default="background")
+# The lazy session of the request being handled
+current_session: ContextVar[Optional["LazySession"]] = ContextVar("current_session", default=None)
+
+
+class LazySession:
+    """
+    Stands in for a Session and only creates it when it is first used.
+
+    Requests that fail authentication or are answered from a cache never touch the
+    pool. release() closes the session and returns its connection; if the request uses
+    the session again afterwards (e.g. a streaming body) a new one is opened.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session]):
+        self._session_factory = session_factory
+        self._session: Optional[Session] = None
+        # Whether any session of this request checked out a connection
+        self.connected = False
+
+    def __getattr__(self, name: str) -> Any:
+        if self._session is None:
+            self._session = self._session_factory()
+        return getattr(self._session, name)
+
+    def release(self) -> None:
+        session, self._session = self._session, None
+        if session is not None:
+            self.connected = self.connected or session.info.get("connected", False)
+            session.close()
+
+    close = release
+
+
+def lazy_session_dependency(session_factory: Callable[[], Session]):
+    """
+    Build a request dependency yielding a LazySession bound to session_factory.
+    """
+    async def dependency(request: Request):
+        route = request.scope.get("route")
+        current_route.set(getattr(route, "path", request.url.path))
+        db = LazySession(session_factory)
+        current_session.set(db)
+        try:
+            yield db
+        finally:
+            if db._session is not None:
+                await run_in_threadpool(db.release)
+            metrics.inc("db_request_sessions_total", connected=str(db.connected).lower())
+    return dependency
+
+
+def _holds_orm_objects(result: Any) -> bool:
+    # Mapped instances may still lazy-load while the response is serialized
+    if isinstance(result, (list, tuple)):
+        return any(hasattr(item, "_sa_instance_state") for item in result)
+    return hasattr(result, "_sa_instance_state")
+
+
+class SessionReleasingRoute(APIRoute):
+    """
+    A route that releases the request's lazy session as soon as the endpoint returns,
+    instead of after the response has been serialized. Endpoints returning mapped
+    instances keep their session until the dependency is torn down.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        endpoint = self.dependant.call
+
+        if asyncio.iscoroutinefunction(endpoint):
+            @functools.wraps(endpoint)
+            async def call(**values):
+                result = await endpoint(**values)
+                db = current_session.get()
+                if db is not None and db._session is not None and not _holds_orm_objects(result):
+                    await run_in_threadpool(db.release)
+                return result
+        else:
+            @functools.wraps(endpoint)
+            def call(**values):
+                with profile_thread():
+                    result = endpoint(**values)
+                db = current_session.get()
+                if db is not None and not _holds_orm_objects(result):
+                    db.release()
+                return result
+
+        self.dependant.call = call
+
+
+metrics.describe("db_pool_hold_seconds_sum", "Time connections were checked out of the pool, by route.")
+metrics.describe("db_pool_hold_seconds_count", "Connection checkouts, by route.")
+metrics.describe("db_request_sessions_total", "Request sessions, by whether they used a connection.")
+
+
+@event.listens_for(Session, "after_begin")
+def _mark_connected(session, transaction, connection) -> None:
+    session.info["connected"] = True
+
+
+@event.listens_for(Pool, "checkout")
+def _record_checkout(dbapi_connection, connection_record, connection_proxy) -> None:
+    connection_record.info["checked_out"] = (time.perf_counter(), current_route.get())
+
+
+@event.listens_for(Pool, "checkin")
+def _record_checkin(dbapi_connection, connection_record) -> None:
+    checked_out = connection_record.info.pop("checked_out", None)
+    if checked_out is not None:
+        started, route = checked_out
+        metrics.inc("db_pool_hold_seconds_sum", time.perf_counter() - started, route=route)
+        metrics.inc("db_pool_hold_seconds_count", route=route)
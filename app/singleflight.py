@@ -0,0 +1,76 @@
+import os
+import asyncio
+import logging
+from typing import Any, Callable, Dict, Hashable
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+
+from .metrics import metrics
+from .profiling import profile_thread
+
+logger = logging.getLogger(__name__)
+
+# Longest a caller waits for a shared computation before giving up with a 504
+SINGLE_FLIGHT_TIMEOUT_SECONDS = float(os.environ.get("SINGLE_FLIGHT_TIMEOUT_SECONDS", 10))
+
+metrics.describe("single_flight_calls_total", "Coalesced reads by role; each follower is a query saved.")
+metrics.describe("single_flight_timeouts_total", "Callers that gave up waiting for a coalesced read.")
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent reads in one worker.
+
+    The first caller for a key starts the read in the threadpool; callers arriving while
+    it runs await the same task and get the same result or exception. The read uses its
+    own session on the caller's engine, so it is not affected if the request that
+    started it goes away. Nothing is kept once the read finishes.
+    """
+
+    def __init__(self, name: str, timeout: float = SINGLE_FLIGHT_TIMEOUT_SECONDS):
+        self.name = name
+        self.timeout = timeout
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+
+    def _read(self, bind, fn: Callable[..., Any], args: tuple) -> Any:
+        db = Session(bind=bind, autoflush=False)
+        try:
+            with profile_thread():
+                return fn(db, *args)
+        finally:
+            db.close()
+
+    def _finished(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Mark the exception as retrieved even if every caller timed out
+        if not task.cancelled():
+            task.exception()
+
+    async def run(self, key: Hashable, db: Session, fn: Callable[..., Any], *args: Any) -> Any:
+        """
+        Return fn(session, *args), sharing the call with concurrent callers of the same key.
+        """
+        task = self._calls.get(key)
+        if task is None:
+            role = "leader"
+            task = asyncio.ensure_future(run_in_threadpool(self._read, db.get_bind(), fn, args))
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        else:
+            role = "follower"
+        metrics.inc("single_flight_calls_total", group=self.name, role=role)
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), self.timeout)
+        except asyncio.TimeoutError:
+            metrics.inc("single_flight_timeouts_total", group=self.name)
+            logger.error(f"Timed out after {self.timeout}s waiting for {self.name} read of {key}")
+            raise HTTPException(status_code=504, detail="Timed out waiting for the database")
+
+
+movie_flight = SingleFlight("movies")
+rating_flight = SingleFlight("ratings")
+comment_flight = SingleFlight("comments")
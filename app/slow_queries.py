@@ -0,0 +1,220 @@
+import os
+import re
+import sys
+import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .metrics import metrics
+from .sessions import current_route
+
+logger = logging.getLogger(__name__)
+
+# Statements slower than this are logged and aggregated; negative turns the log off
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", 250))
+# Share of slow SELECTs re-run under EXPLAIN (ANALYZE, BUFFERS) on Postgres
+SLOW_QUERY_EXPLAIN_SAMPLE = float(os.environ.get("SLOW_QUERY_EXPLAIN_SAMPLE", 0.1))
+# Statement shapes kept in the report; further shapes are counted but not tracked
+SLOW_QUERY_MAX_SHAPES = int(os.environ.get("SLOW_QUERY_MAX_SHAPES", 500))
+
+# EXPLAIN runs waiting or running at once; further samples are dropped
+EXPLAIN_MAX_PENDING = 4
+
+metrics.describe("db_slow_queries_total", "Statements slower than SLOW_QUERY_MS.")
+metrics.describe("db_slow_query_explains_total", "EXPLAIN plans captured for slow statements, by outcome.")
+
+_PARAMETER = re.compile(r"%\(\w+\)s|\?|\$\d+")
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+# Keywords of statements, or CTEs and locking clauses within them, that write or lock rows
+_MODIFIES = re.compile(r"\b(?:INSERT|UPDATE|DELETE|MERGE)\b", re.IGNORECASE)
+# Calls with effects that outlive a rollback or happen anyway, e.g. advisory locks, NOTIFY and sequences
+_SIDE_EFFECTS = re.compile(r"\b(?:pg_\w+|nextval|setval|set_config|lo_\w+|dblink\w*)\s*\(", re.IGNORECASE)
+_FROM = re.compile(r"\bFROM\b", re.IGNORECASE)
+
+
+def normalize(statement: str) -> str:
+    """
+    Reduce a statement to its shape: parameters and literals become ?, IN lists of any
+    length become (?) and whitespace is collapsed.
+    """
+    shape = _PARAMETER.sub("?", statement)
+    shape = _LITERAL.sub("?", shape)
+    shape = _IN_LIST.sub("(?)", shape)
+    return _WHITESPACE.sub(" ", shape).strip()
+
+
+def redact(parameters: Any) -> Any:
+    """
+    Replace parameter values with their type, keeping the structure and string lengths.
+    """
+    if isinstance(parameters, dict):
+        return {key: redact(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [redact(value) for value in parameters]
+    if parameters is None:
+        return None
+    if isinstance(parameters, str):
+        return f"<str:{len(parameters)}>"
+    return f"<{type(parameters).__name__}>"
+
+
+def _calling_function() -> str:
+    # The innermost app frame outside this module, preferring CRUD functions
+    frame = sys._getframe(2)
+    fallback = "unknown"
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if module.startswith("app.crud."):
+            return f"{module}.{frame.f_code.co_name}"
+        if fallback == "unknown" and module.startswith("app.") and module != __name__:
+            fallback = f"{module}.{frame.f_code.co_name}"
+        frame = frame.f_back
+    return fallback
+
+
+def explainable(statement: str, context: Any) -> bool:
+    """
+    Whether EXPLAIN ANALYZE can safely run a statement again: a SELECT, or a WITH whose
+    statements only read. The compiled flags catch top-level DML behind a WITH, and the
+    keyword check DML CTEs and locking clauses within a SELECT. Statements without a FROM
+    are function calls such as SELECT pg_notify(...) or pg_try_advisory_lock(...), and a
+    rollback would not undo running them again, so they and such calls elsewhere are skipped.
+    """
+    return (
+        statement.split(None, 1)[0].upper() in ("SELECT", "WITH")
+        and not (context.isinsert or context.isupdate or context.isdelete)
+        and not _MODIFIES.search(statement)
+        and _FROM.search(statement) is not None
+        and not _SIDE_EFFECTS.search(statement)
+    )
+
+
+class SlowQueryLog:
+    """
+    Aggregates slow statements by shape: count, total and worst time, the routes and
+    functions they came from, redacted parameters of the latest one and, on Postgres,
+    the latest captured plan.
+    """
+
+    def __init__(self, max_shapes: int = SLOW_QUERY_MAX_SHAPES):
+        self.max_shapes = max_shapes
+        self._shapes: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._explainer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="slow-query-explain")
+        self._pending = 0
+
+    def record(self, statement: str, parameters: Any, duration_ms: float, route: str, function: str) -> Optional[dict]:
+        shape = normalize(statement)
+        with self._lock:
+            entry = self._shapes.get(shape)
+            if entry is None:
+                if len(self._shapes) >= self.max_shapes:
+                    return None
+                entry = self._shapes[shape] = {
+                    "shape": shape, "count": 0, "total_ms": 0.0, "max_ms": 0.0,
+                    "routes": set(), "functions": set(), "parameters": None, "plan": None,
+                }
+            entry["count"] += 1
+            entry["total_ms"] += duration_ms
+            entry["max_ms"] = max(entry["max_ms"], duration_ms)
+            entry["routes"].add(route)
+            entry["functions"].add(function)
+            entry["parameters"] = redact(parameters)
+        return entry
+
+    def explain(self, engine: Engine, entry: dict, statement: str, parameters: Any) -> None:
+        """
+        Capture EXPLAIN (ANALYZE, BUFFERS) for a statement in the background. ANALYZE runs
+        the statement again, so only SELECTs are explained, inside a rolled back transaction.
+        """
+        with self._lock:
+            if self._pending >= EXPLAIN_MAX_PENDING:
+                metrics.inc("db_slow_query_explains_total", outcome="dropped")
+                return
+            self._pending += 1
+        self._explainer.submit(self._capture_plan, engine, entry, statement, parameters)
+
+    def _capture_plan(self, engine: Engine, entry: dict, statement: str, parameters: Any) -> None:
+        try:
+            with engine.connect() as connection:
+                rows = connection.exec_driver_sql(f"EXPLAIN (ANALYZE, BUFFERS) {statement}", parameters).fetchall()
+                connection.rollback()
+            entry["plan"] = "\n".join(row[0] for row in rows)
+            metrics.inc("db_slow_query_explains_total", outcome="captured")
+        except Exception as e:
+            metrics.inc("db_slow_query_explains_total", outcome="failed")
+            logger.warning(f"Could not explain slow statement: {e}")
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def report(self, limit: int = 20) -> List[dict]:
+        """
+        The slowest statement shapes by total time.
+        """
+        with self._lock:
+            entries = sorted(self._shapes.values(), key=lambda entry: entry["total_ms"], reverse=True)[:limit]
+            return [
+                {
+                    "shape": entry["shape"],
+                    "count": entry["count"],
+                    "total_ms": round(entry["total_ms"], 3),
+                    "mean_ms": round(entry["total_ms"] / entry["count"], 3),
+                    "max_ms": round(entry["max_ms"], 3),
+                    "routes": sorted(entry["routes"]),
+                    "functions": sorted(entry["functions"]),
+                    "parameters": entry["parameters"],
+                    "plan": entry["plan"],
+                }
+                for entry in entries
+            ]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._shapes.clear()
+
+
+slow_query_log = SlowQueryLog()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_timer(conn, cursor, statement, parameters, context, executemany) -> None:
+    # Kept on the execution context, so statements that fail leave nothing behind
+    if context is not None:
+        context._slow_query_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _check_duration(conn, cursor, statement, parameters, context, executemany) -> None:
+    started = getattr(context, "_slow_query_started", None)
+    if started is None:
+        return
+    duration_ms = (time.perf_counter() - started) * 1000
+    if SLOW_QUERY_MS < 0 or duration_ms < SLOW_QUERY_MS or statement.startswith("EXPLAIN"):
+        return
+
+    route = current_route.get()
+    function = _calling_function()
+    metrics.inc("db_slow_queries_total", route=route)
+    logger.warning(f"Slow statement ({duration_ms:.1f}ms) from {function} on {route}: "
+                   f"{_WHITESPACE.sub(' ', statement)} {redact(parameters)}")
+    entry = slow_query_log.record(statement, parameters, duration_ms, route, function)
+
+    # Every new shape gets a plan; after that a sample of occurrences refreshes it
+    if (
+        entry is not None
+        and conn.dialect.name == "postgresql"
+        and not executemany
+        and explainable(statement, context)
+        and SLOW_QUERY_EXPLAIN_SAMPLE > 0
+        and (entry["plan"] is None or random.random() < SLOW_QUERY_EXPLAIN_SAMPLE)
+    ):
+        slow_query_log.explain(conn.engine, entry, statement, parameters)
@@ -0,0 +1,88 @@
+import os
+import time
+import logging
+from contextlib import contextmanager
+from typing import List, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import func, select
+from sqlalchemy.pool import QueuePool
+
+from . import database
+from .models.ratings import Rating
+
+logger = logging.getLogger(__name__)
+
+# Connections opened before the first request arrives
+DB_POOL_WARM = int(os.environ.get("DB_POOL_WARM", 2))
+# Most-rated movies loaded into the caches at startup
+WARM_CACHE_MOVIES = int(os.environ.get("WARM_CACHE_MOVIES", 20))
+
+
+class StartupTimer:
+    """
+    Records how long each startup phase takes and logs the breakdown.
+    """
+
+    def __init__(self):
+        self.phases: List[Tuple[str, float]] = []
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, (time.perf_counter() - start) * 1000))
+
+    def log(self) -> None:
+        total = sum(ms for _, ms in self.phases)
+        breakdown = ", ".join(f"{name}={ms:.1f}ms" for name, ms in self.phases)
+        logger.info(f"Startup finished in {total:.1f}ms ({breakdown})")
+
+
+def warm_pool(connections: int = DB_POOL_WARM) -> None:
+    """
+    Open connections up front so the first requests do not pay for the connect.
+    They are checked out together, so the pool keeps that many distinct connections.
+    Never more than the pool keeps: overflow connections are closed when returned, and
+    waiting for more than the pool can hand out would time out and fail startup.
+    """
+    pool = database.engine.pool
+    if isinstance(pool, QueuePool):
+        connections = min(connections, pool.size())
+    checked_out = []
+    try:
+        for _ in range(connections):
+            checked_out.append(database.engine.connect())
+    finally:
+        for connection in checked_out:
+            connection.close()
+
+
+def prime_caches(movies: int = WARM_CACHE_MOVIES) -> None:
+    """
+    Load the most-rated movies and their aggregate ratings into the caches.
+    """
+    from .crud.movies import get_movie_id
+    from .crud.ratings import get_ratings
+
+    if movies <= 0:
+        return
+    db = database.SessionLocal()
+    try:
+        movie_ids = db.execute(
+            select(Rating.movie_id)
+            .group_by(Rating.movie_id)
+            .order_by(func.count().desc())
+            .limit(movies)
+        ).scalars().all()
+        for movie_id in movie_ids:
+            try:
+                get_movie_id(db, movie_id)
+                get_ratings(db, movie_id)
+            except HTTPException:
+                continue
+    finally:
+        db.close()
+    logger.info(f"Primed caches for {len(movie_ids)} movies")
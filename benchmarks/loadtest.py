@@ -0,0 +1,307 @@
+"""
+HTTP load generator for capacity testing.
+
+Drives a running server, or one it starts with uvicorn, with a weighted mix of
+scenarios, stepping the number of concurrent virtual users up. For each step it
+reports throughput, latency percentiles and error rates per endpoint, and writes
+them as JSON.
+
+    python -m benchmarks.loadtest --start-server --steps 8,16,32,64 --step-seconds 20
+    python -m benchmarks.loadtest --base-url http://127.0.0.1:8000 --mix movie_read=60,rating_write=10
+    python -m benchmarks.loadtest --start-server --replay access.log --steps 16,32
+
+A started server gets RATE_LIMIT_ENABLED=false, so the limits do not shape the results,
+and uses DB_URL from the environment. Replay reads uvicorn access log lines
+('"GET /movies/2 HTTP/1.1" 200') or common log format lines and re-sends GET requests
+in order, looping over the log.
+"""
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import subprocess
+from collections import defaultdict
+from datetime import date
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+# Relative weights of the default traffic mix: mostly reads, some writes, rare signups
+DEFAULT_MIX = {
+    "movie_list": 10,
+    "movie_read": 35,
+    "rating_read": 20,
+    "comment_read": 15,
+    "rating_write": 10,
+    "comment_write": 5,
+    "signup_login": 1,
+}
+
+ACCESS_LOG_LINE = re.compile(r'"(GET|HEAD) (\S+) HTTP/[\d.]+"')
+# Integer and UUID path segments, replaced by a placeholder when labelling replayed requests
+PATH_ID = re.compile(r"/(\d+|[0-9a-f]{8}-[0-9a-f-]{27})(?=/|$)")
+
+
+class Recorder:
+    """
+    Collects latencies and status codes per endpoint label for one step.
+    """
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    def record(self, label: str, seconds: float, ok: bool) -> None:
+        self.latencies[label].append(seconds)
+        if not ok:
+            self.errors[label] += 1
+
+    def summary(self, elapsed: float) -> Dict[str, dict]:
+        report = {}
+        for label, samples in sorted(self.latencies.items()):
+            samples = sorted(samples)
+            report[label] = {
+                "requests": len(samples),
+                "rps": round(len(samples) / elapsed, 1),
+                "error_rate": round(self.errors[label] / len(samples), 4),
+                "p50_ms": round(percentile(samples, 50) * 1000, 2),
+                "p90_ms": round(percentile(samples, 90) * 1000, 2),
+                "p99_ms": round(percentile(samples, 99) * 1000, 2),
+                "max_ms": round(samples[-1] * 1000, 2),
+            }
+        return report
+
+
+def percentile(sorted_samples: List[float], pct: float) -> float:
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, max(0, round(pct / 100 * len(sorted_samples)) - 1))
+    return sorted_samples[index]
+
+
+class LoadTest:
+    """
+    Holds the shared state of a run: the client, the users that can write and the
+    movies and comments that exist, so scenarios target real ids.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, rng: random.Random):
+        self.client = client
+        self.rng = rng
+        self.tokens: List[str] = []
+        self.movie_ids: List[int] = []
+        self.comment_ids: Dict[int, List[str]] = defaultdict(list)
+
+    async def timed(self, recorder: Recorder, label: str, method: str, url: str, **kwargs) -> Optional[httpx.Response]:
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            recorder.record(label, time.perf_counter() - started, ok=False)
+            return None
+        # 404s on reads of movies without ratings or comments are expected answers
+        recorder.record(label, time.perf_counter() - started, ok=response.status_code < 500 and response.status_code != 429)
+        return response
+
+    def auth(self) -> dict:
+        return {"Authorization": f"Bearer {self.rng.choice(self.tokens)}"}
+
+    async def signup_login(self, recorder: Recorder) -> None:
+        name = f"load-{uuid.uuid4().hex[:12]}"
+        await self.timed(recorder, "POST /signup", "POST", "/signup",
+                         json={"username": name, "password": "load-password", "email": f"{name}@example.com"})
+        response = await self.timed(recorder, "POST /login", "POST", "/login",
+                                    data={"username": name, "password": "load-password"})
+        if response is not None and response.status_code == 200:
+            self.tokens.append(response.json()["access_token"])
+
+    async def movie_list(self, recorder: Recorder) -> None:
+        await self.timed(recorder, "GET /movies/", "GET", "/movies/")
+
+    async def movie_read(self, recorder: Recorder) -> None:
+        await self.timed(recorder, "GET /movies/{movie_id}", "GET", f"/movies/{self.pick_movie()}")
+
+    async def rating_read(self, recorder: Recorder) -> None:
+        await self.timed(recorder, "GET /ratings/", "GET", "/ratings/", params={"movie_id": self.pick_movie()})
+
+    async def comment_read(self, recorder: Recorder) -> None:
+        await self.timed(recorder, "GET /comments/{movie_id}", "GET", f"/comments/{self.pick_movie()}")
+
+    async def rating_write(self, recorder: Recorder) -> None:
+        await self.timed(recorder, "POST /ratings/", "POST", "/ratings/", headers=self.auth(),
+                         json={"movie_id": self.pick_movie(), "rating": self.rng.randint(1, 5)})
+
+    async def comment_write(self, recorder: Recorder) -> None:
+        movie_id = self.pick_movie()
+        parents = self.comment_ids[movie_id]
+        if parents and self.rng.random() < 0.5:
+            parent_id = self.rng.choice(parents)
+            await self.timed(recorder, "POST /comments/reply/{parent_id}", "POST", f"/comments/reply/{parent_id}",
+                             headers=self.auth(), json={"movie_id": movie_id, "content": "Load reply", "parent_id": parent_id})
+            return
+        response = await self.timed(recorder, "POST /comments/", "POST", "/comments/", headers=self.auth(),
+                                    json={"movie_id": movie_id, "content": "Load comment"})
+        if response is not None and response.status_code == 200:
+            parents.append(response.json()["id"])
+
+    def pick_movie(self) -> int:
+        # Skewed towards a few popular movies, like real traffic
+        return self.movie_ids[min(int(self.rng.expovariate(1 / 3)), len(self.movie_ids) - 1)]
+
+    async def seed(self, users: int, movies: int) -> None:
+        recorder = Recorder()
+        for _ in range(users):
+            await self.signup_login(recorder)
+        if not self.tokens:
+            raise SystemExit("Could not sign up any users; is the server reachable?")
+        for index in range(movies):
+            response = await self.client.post("/movies/", headers=self.auth(), json={
+                "title": f"Load movie {uuid.uuid4().hex[:8]}",
+                "description": "Created by the load test",
+                "release_date": date(2000 + index % 25, 1, 1).isoformat(),
+            })
+            response.raise_for_status()
+            self.movie_ids.append(response.json()["data"]["id"])
+
+
+async def run_step(concurrency: int, seconds: float, next_request: Callable[[Recorder], Awaitable[None]]) -> dict:
+    recorder = Recorder()
+    deadline = time.perf_counter() + seconds
+
+    async def user() -> None:
+        while time.perf_counter() < deadline:
+            await next_request(recorder)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    endpoints = recorder.summary(elapsed)
+    total = sum(endpoint["requests"] for endpoint in endpoints.values())
+    all_samples = sorted(sample for samples in recorder.latencies.values() for sample in samples)
+    return {
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 2),
+        "requests": total,
+        "rps": round(total / elapsed, 1),
+        "error_rate": round(sum(recorder.errors.values()) / total, 4) if total else 0.0,
+        "p50_ms": round(percentile(all_samples, 50) * 1000, 2),
+        "p99_ms": round(percentile(all_samples, 99) * 1000, 2),
+        "endpoints": endpoints,
+    }
+
+
+def parse_mix(text: Optional[str]) -> Dict[str, float]:
+    if not text:
+        return dict(DEFAULT_MIX)
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in DEFAULT_MIX:
+            raise SystemExit(f"Unknown scenario {name!r}; choose from {', '.join(DEFAULT_MIX)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def read_access_log(path: str) -> List[Tuple[str, str]]:
+    requests = []
+    with open(path) as log:
+        for line in log:
+            match = ACCESS_LOG_LINE.search(line)
+            if match:
+                requests.append((match.group(1), match.group(2)))
+    if not requests:
+        raise SystemExit(f"No GET requests found in {path}")
+    return requests
+
+
+def start_server(port: int) -> subprocess.Popen:
+    env = dict(os.environ, RATE_LIMIT_ENABLED="false")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        env=env,
+    )
+
+
+async def wait_until_ready(client: httpx.AsyncClient, timeout: float = 30) -> None:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if (await client.get("/healthz")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.2)
+    raise SystemExit("Server did not become ready")
+
+
+async def main_async(args: argparse.Namespace) -> dict:
+    rng = random.Random(args.seed)
+    limits = httpx.Limits(max_connections=max(args.steps) + 10, max_keepalive_connections=max(args.steps) + 10)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        await wait_until_ready(client)
+        if args.replay:
+            log = read_access_log(args.replay)
+            position = 0
+            test = LoadTest(client, rng)
+
+            async def next_request(recorder: Recorder) -> None:
+                nonlocal position
+                method, path = log[position % len(log)]
+                position += 1
+                # Label by the path without ids so percentiles group per endpoint
+                label = f"{method} {PATH_ID.sub('/{id}', path.split('?')[0])}"
+                await test.timed(recorder, label, method, path)
+        else:
+            test = LoadTest(client, rng)
+            await test.seed(args.users, args.movies)
+            mix = parse_mix(args.mix)
+            scenarios = [getattr(test, name) for name in mix]
+            weights = list(mix.values())
+
+            async def next_request(recorder: Recorder) -> None:
+                await rng.choices(scenarios, weights)[0](recorder)
+
+        steps = []
+        for concurrency in args.steps:
+            result = await run_step(concurrency, args.step_seconds, next_request)
+            steps.append(result)
+            print(f"concurrency {concurrency:4d}: {result['rps']:8.1f} req/s, p50 {result['p50_ms']:7.1f}ms, "
+                  f"p99 {result['p99_ms']:7.1f}ms, errors {result['error_rate'] * 100:.2f}%")
+    return {"base_url": args.base_url, "mix": None if args.replay else parse_mix(args.mix), "replay": args.replay, "steps": steps}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load test the API with a stepped concurrency ramp.")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8765")
+    parser.add_argument("--start-server", action="store_true", help="Start uvicorn on the base URL's port first")
+    parser.add_argument("--steps", default="4,8,16,32", help="Comma separated concurrency levels")
+    parser.add_argument("--step-seconds", type=float, default=15)
+    parser.add_argument("--mix", help="Comma separated scenario=weight pairs, e.g. movie_read=50,rating_write=5")
+    parser.add_argument("--replay", help="Replay GET requests from an access log instead of the mix")
+    parser.add_argument("--users", type=int, default=20, help="Users signed up before the run")
+    parser.add_argument("--movies", type=int, default=50, help="Movies created before the run")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="loadtest-results.json")
+    args = parser.parse_args()
+    args.steps = [int(step) for step in args.steps.split(",")]
+
+    server = start_server(httpx.URL(args.base_url).port or 80) if args.start_server else None
+    try:
+        report = asyncio.run(main_async(args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    with open(args.output, "w") as output:
+        json.dump(report, output, indent=2)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Latency and memory of the read paths per 1,000 rows: loading ORM entities and copying
+them into response models, against selecting plain column tuples with Core and mapping
+them straight into the models, as app.crud now does.
+
+    python -m benchmarks.read_path --rows 1000 --repeat 20
+
+Movies are read 1,000 at a time. Comments are one movie's thread of 1,000 comments,
+read with the previous per-comment reply queries and with the single tree query. Runs
+against DB_URL, or an in-memory SQLite database when it is unset; memory is the peak
+traced by tracemalloc during one read.
+"""
+import os
+import time
+import argparse
+import statistics
+import tracemalloc
+from datetime import date
+from typing import Callable, Tuple
+
+os.environ.setdefault("DB_URL", "sqlite://")
+
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from app import database
+from app.models import comments, movies, ratings, refresh_tokens, users  # noqa: F401 (register mappers)
+from app.models.comments import Comment
+from app.models.movies import Movie
+from app.models.users import User
+from app.crud.comments import get_comments_by_movie
+from app.crud.movies import MOVIE_FIELDS
+from app.schemas.comments import CommentInDB
+from app.schemas.movies import MovieInDB
+
+
+def entity_movies(db, limit: int):
+    rows = db.execute(select(Movie).where(Movie.deleted_at.is_(None)).order_by(Movie.movie_id).limit(limit)).scalars().all()
+    return [
+        MovieInDB(id=movie.movie_id, title=movie.title, description=movie.description,
+                  release_date=movie.release_date, user_id=movie.user_id)
+        for movie in rows
+    ]
+
+
+def projected_movies(db, limit: int):
+    rows = db.execute(
+        select(*MOVIE_FIELDS.values()).where(Movie.deleted_at.is_(None)).order_by(Movie.movie_id).limit(limit)
+    ).all()
+    return [MovieInDB.model_construct(**dict(zip(MOVIE_FIELDS, row))) for row in rows]
+
+
+def entity_comments(db, movie_id: int):
+    # The previous implementation: top-level entities, then one query per comment for its replies
+    top_level = (
+        db.query(Comment)
+        .join(Movie, Movie.movie_id == Comment.movie_id)
+        .filter(Comment.movie_id == movie_id, Comment.parent_id.is_(None), Movie.deleted_at.is_(None))
+        .all()
+    )
+
+    def fetch_replies(comment):
+        replies = db.query(Comment).filter(Comment.parent_id == comment.id).all()
+        return CommentInDB(id=comment.id, user_id=comment.user_id, content=comment.content, movie_id=comment.movie_id,
+                           parent_id=comment.parent_id, replies=[fetch_replies(reply) for reply in replies])
+
+    return [fetch_replies(comment) for comment in top_level]
+
+
+def measure(read: Callable[[Session], object], repeat: int) -> Tuple[float, float]:
+    """
+    Median milliseconds per read, each in a fresh session, and peak KiB traced for one read.
+    """
+    timings = []
+    for _ in range(repeat + 1):
+        db = database.SessionLocal()
+        start = time.perf_counter()
+        read(db)
+        timings.append((time.perf_counter() - start) * 1000)
+        db.close()
+    db = database.SessionLocal()
+    tracemalloc.start()
+    read(db)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    db.close()
+    return statistics.median(timings[1:]), peak / 1024
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark entity and column projection read paths.")
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    database.Base.metadata.create_all(database.engine)
+    db = database.SessionLocal()
+    user = User(username="read-bench", email="read-bench@example.com", hashed_password="x")
+    db.add(user)
+    db.flush()
+    db.add_all([
+        Movie(title=f"Bench movie {index}", description="A description of a typical length. " * 12,
+              release_date=date(2000 + index % 25, 1, 1), user_id=user.user_id)
+        for index in range(args.rows)
+    ])
+    thread = Movie(title="Bench thread", description="Thread", release_date=date(2024, 1, 1), user_id=user.user_id)
+    db.add(thread)
+    db.flush()
+    # A thread of top-level comments with four replies each
+    for _ in range(args.rows // 5):
+        parent = Comment(movie_id=thread.movie_id, user_id=user.user_id, content="A top-level comment " * 5)
+        db.add(parent)
+        db.flush()
+        db.add_all([Comment(movie_id=thread.movie_id, user_id=user.user_id, parent_id=parent.id, content="A reply " * 5)
+                    for _ in range(4)])
+    db.commit()
+    user_id, thread_id = user.user_id, thread.movie_id
+    db.close()
+
+    cases = [
+        (f"{args.rows} movies", lambda db: entity_movies(db, args.rows), lambda db: projected_movies(db, args.rows)),
+        (f"{args.rows} comments", lambda db: entity_comments(db, thread_id), lambda db: get_comments_by_movie(db, thread_id)),
+    ]
+    print(f"{'read':<16}{'entities ms':>12}{'columns ms':>12}{'entities KiB':>14}{'columns KiB':>13}")
+    try:
+        for name, before, after in cases:
+            before_ms, before_kib = measure(before, args.repeat)
+            after_ms, after_kib = measure(after, args.repeat)
+            print(f"{name:<16}{before_ms:12.2f}{after_ms:12.2f}{before_kib:14.0f}{after_kib:13.0f}")
+    finally:
+        db = database.SessionLocal()
+        db.execute(delete(Comment).where(Comment.movie_id == thread_id))
+        db.execute(delete(Movie).where(Movie.user_id == user_id))
+        db.execute(delete(User).where(User.user_id == user_id))
+        db.commit()
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Per-call cost of the hot lookups written as a fresh Query per call against the
+prebuilt select() statements in app.crud that only bind parameters.
+
+    python -m benchmarks.statement_overhead --calls 20000
+
+The lookups run against an in-memory SQLite database holding one row each, so the
+time measured is almost entirely Python-side statement construction, caching and
+result handling.
+"""
+import os
+import time
+import argparse
+from datetime import date
+from typing import Callable
+
+os.environ.setdefault("DB_URL", "sqlite://")
+
+from app import database
+from app.models import comments, movies, ratings, refresh_tokens, users  # noqa: F401 (register mappers)
+from app.models.movies import Movie
+from app.models.ratings import Rating
+from app.models.users import User
+from app.crud import movies as movie_crud, ratings as rating_crud, users as user_crud
+from app.metrics import metrics
+
+
+def per_call_us(function: Callable[[], object], calls: int) -> float:
+    function()
+    start = time.perf_counter()
+    for _ in range(calls):
+        function()
+    return (time.perf_counter() - start) / calls * 1_000_000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark prebuilt statements against per-call queries.")
+    parser.add_argument("--calls", type=int, default=20_000)
+    args = parser.parse_args()
+
+    database.Base.metadata.create_all(database.engine)
+    db = database.SessionLocal()
+    user = User(username="bench", email="bench@example.com", hashed_password="x")
+    db.add(user)
+    db.flush()
+    movie = Movie(title="Bench", description="Bench", release_date=date(2024, 1, 1), user_id=user.user_id)
+    db.add(movie)
+    db.flush()
+    db.add(Rating(movie_id=movie.movie_id, user_id=user.user_id, rating=4))
+    db.commit()
+    user_id, movie_id = user.user_id, movie.movie_id
+
+    cases = [
+        ("user by username",
+         lambda: db.query(User).filter(User.username == "bench").first(),
+         lambda: db.execute(user_crud._user_by_username, {"username": "bench"}).scalars().first()),
+        ("movie by id",
+         lambda: db.query(Movie).filter(Movie.movie_id == movie_id, Movie.deleted_at.is_(None)).first(),
+         lambda: db.execute(movie_crud._movie_by_id, {"movie_id": movie_id}).scalars().first()),
+        ("user rating",
+         lambda: db.query(Rating).filter(Rating.movie_id == movie_id, Rating.user_id == user_id).first(),
+         lambda: db.execute(rating_crud._user_rating, {"movie_id": movie_id, "user_id": user_id}).scalars().first()),
+    ]
+
+    print(f"{'lookup':<18}{'query() us':>12}{'prebuilt us':>13}{'saved':>8}")
+    for name, legacy, prebuilt in cases:
+        before = per_call_us(legacy, args.calls)
+        after = per_call_us(prebuilt, args.calls)
+        print(f"{name:<18}{before:12.1f}{after:13.1f}{(1 - after / before) * 100:7.0f}%")
+
+    hits = metrics.value("db_statement_cache_total", outcome="hit")
+    misses = metrics.value("db_statement_cache_total", outcome="miss")
+    print(f"compiled statement cache: {hits:.0f} hits, {misses:.0f} misses")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Compare random (v4) and time-ordered (v7) primary keys on the rating write path.
+
+Two copies of the ratings table are filled with the same rows through the batched INSERT
+used by the write-behind buffer, differing only in how ids are generated. The script
+reports insert throughput and the size of the primary key index for each.
+
+    python -m benchmarks.uuid_keys --rows 1000000
+    DB_URL=postgresql://... python -m benchmarks.uuid_keys --rows 5000000
+
+Without DB_URL a temporary SQLite database is used. The tables are dropped afterwards.
+"""
+import os
+import time
+import uuid
+import random
+import argparse
+import tempfile
+from typing import Callable
+
+from sqlalchemy import Column, Index, Integer, MetaData, Table, UUID, create_engine, insert, text
+
+from app.ids import uuid7
+
+
+def rating_table(metadata: MetaData, name: str) -> Table:
+    # Same columns and indexes as the ratings table, without the foreign keys
+    return Table(
+        name, metadata,
+        Column("id", UUID(as_uuid=True), primary_key=True),
+        Column("movie_id", Integer, nullable=False, index=True),
+        Column("user_id", UUID(as_uuid=True), nullable=False),
+        Column("rating", Integer, nullable=False),
+        Index(f"ix_{name}_user_id_id", "user_id", "id"),
+    )
+
+
+def index_size(engine, table: Table) -> int:
+    with engine.connect() as connection:
+        if engine.dialect.name == "postgresql":
+            return connection.execute(text(f"SELECT pg_relation_size('{table.name}_pkey')")).scalar()
+        # SQLite keeps the primary key of a non-rowid key column in an autoindex
+        return connection.execute(
+            text("SELECT SUM(pgsize) FROM dbstat WHERE name LIKE :name"),
+            {"name": f"sqlite_autoindex_{table.name}_%"},
+        ).scalar()
+
+
+def fill(engine, table: Table, new_id: Callable[[], uuid.UUID], rows: int, batch_size: int, seed: int) -> float:
+    generator = random.Random(seed)
+    users = [uuid.UUID(int=generator.getrandbits(128)) for _ in range(10_000)]
+    start = time.perf_counter()
+    with engine.connect() as connection:
+        for offset in range(0, rows, batch_size):
+            batch = [
+                {"id": new_id(), "movie_id": generator.randrange(50_000), "user_id": generator.choice(users), "rating": generator.randint(1, 5)}
+                for _ in range(min(batch_size, rows - offset))
+            ]
+            connection.execute(insert(table), batch)
+            connection.commit()
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark v4 against v7 rating primary keys.")
+    parser.add_argument("--rows", type=int, default=500_000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    url = os.environ.get("DB_URL")
+    if not url:
+        url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'uuid_keys.db')}"
+    engine = create_engine(url)
+    metadata = MetaData()
+    tables = {"uuid4": rating_table(metadata, "bench_ratings_v4"), "uuid7": rating_table(metadata, "bench_ratings_v7")}
+    metadata.drop_all(engine)
+    metadata.create_all(engine)
+
+    try:
+        print(f"{engine.dialect.name}, {args.rows} rows in batches of {args.batch_size}")
+        for name, new_id in (("uuid4", uuid.uuid4), ("uuid7", uuid7)):
+            elapsed = fill(engine, tables[name], new_id, args.rows, args.batch_size, seed=1)
+            size = index_size(engine, tables[name])
+            print(f"{name}: {args.rows / elapsed:10.0f} rows/s, primary key index {size / 1024 / 1024:8.1f} MiB")
+    finally:
+        metadata.drop_all(engine)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 #!/bin/bash
 
 # Replace with your FastAPI app's URL
-APP_URL="https://movie-app-with-fastapi-and-postgresql.onrender.com/"
+APP_URL="https://movie-app-with-fastapi-and-postgresql.onrender.com/healthz"
 
 # Send a GET request to the FastAPI app
 curl  $APP_URL
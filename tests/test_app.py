@@ -1,6 +1,7 @@
+import json
 import pytest
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
 from app.database import Base, get_db
@@ -359,3 +360,1162 @@ def test_get_comments(client, setup_database, username1, password1,username2,pas
     data = response.json()
     assert len(data) == 1
     assert data[0]["content"] == "Test Comment"
+
+
+@pytest.mark.parametrize("username, password", [("testuser", "testpassword")])
+def test_stream_comments(client, setup_database, username, password):
+    response = client.post("/login", data={"username": username, "password": password})
+    token = response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    parent_id = client.get("/comments/2").json()[0]["id"]
+    response = client.post(
+        f"/comments/reply/{parent_id}",
+        json={"movie_id": 2, "content": "Test Reply", "parent_id": parent_id},
+        headers=headers
+    )
+    assert response.status_code == 200
+    response = client.post("/comments/", json={"movie_id": 2, "content": "Second Comment"}, headers=headers)
+    assert response.status_code == 200
+
+    # Stream the thread as NDJSON
+    response = client.get("/comments/2", headers={"Accept": "application/x-ndjson"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert len(lines) == 3
+    # Replies follow their parent directly
+    reply_index = next(i for i, line in enumerate(lines) if line["content"] == "Test Reply")
+    assert lines[reply_index]["depth"] == 1
+    assert lines[reply_index - 1]["id"] == parent_id
+    assert lines[reply_index - 1]["depth"] == 0
+
+    # Stream for a movie without comments
+    response = client.get("/comments/3", headers={"Accept": "application/x-ndjson"})
+    assert response.status_code == 404
+
+
+def test_rate_limit(client, setup_database):
+    from app.ratelimit import InMemoryBackend, RouteLimit, TokenBucketBackend, rate_limiter
+
+    limits, backend = rate_limiter.limits, rate_limiter.backend
+    rate_limiter.backend = InMemoryBackend()
+    rate_limiter.limits = {**limits, "reads": RouteLimit(rate=0.01, burst=2, max_concurrency=0)}
+    try:
+        assert client.get("/movies/2").status_code == 200
+        assert client.get("/movies/2").status_code == 200
+        response = client.get("/movies/2")
+        assert response.status_code == 429
+        assert response.json() == {"detail": "Too many requests"}
+        assert "Retry-After" in response.headers
+
+        # Exempt paths are never limited
+        assert client.get("/").status_code == 200
+
+        # Saturated route group is rejected instead of queued
+        rate_limiter.backend = InMemoryBackend()
+        rate_limiter.limits["reads"] = RouteLimit(rate=100, burst=100, max_concurrency=1)
+        rate_limiter.in_flight["reads"] = 1
+        response = client.get("/movies/2")
+        assert response.status_code == 503
+
+        # Requests turned away by a saturated group keep their tokens
+        rate_limiter.limits["reads"] = RouteLimit(rate=0.01, burst=1, max_concurrency=1)
+        assert client.get("/movies/2").status_code == 503
+        rate_limiter.in_flight["reads"] = 0
+        assert client.get("/movies/2").status_code == 200
+        assert client.get("/movies/2").status_code == 429
+
+        # Eviction only forgets buckets that have refilled to their own burst
+        import time
+        import asyncio
+        backend = InMemoryBackend(max_keys=2, evict_batch=2)
+        consume = lambda key, rate, burst: asyncio.run(backend.consume(key, rate, burst))
+        assert consume("auth:a", 0.001, 1) == 0
+        assert consume("reads:b", 1000, 1) == 0
+        time.sleep(0.01)
+        consume("reads:c", 1000, 1)
+        assert set(backend._buckets) == {"auth:a", "reads:c"}
+        assert consume("auth:a", 0.001, 1) > 0
+
+        # A backend must implement consume
+        with pytest.raises(TypeError):
+            TokenBucketBackend()
+    finally:
+        rate_limiter.in_flight["reads"] = 0
+        rate_limiter.limits, rate_limiter.backend = limits, backend
+
+
+@pytest.mark.parametrize("username, password", [("testuser", "testpassword")])
+def test_refresh_token(client, setup_database, monkeypatch, username, password):
+    response = client.post("/login", data={"username": username, "password": password})
+    assert response.status_code == 200
+    first_refresh = response.json()["refresh_token"]
+
+    # Exchange the refresh token
+    response = client.post("/token/refresh", json={"refresh_token": first_refresh})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["token_type"] == "bearer"
+    second_refresh = data["refresh_token"]
+    assert second_refresh != first_refresh
+
+    # The new access token works
+    response = client.post("/comments/", json={"movie_id": 2, "content": "Refreshed"},
+                           headers={"Authorization": f"Bearer {data['access_token']}"})
+    assert response.status_code == 200
+
+    # Reusing a consumed token revokes the whole family
+    response = client.post("/token/refresh", json={"refresh_token": first_refresh})
+    assert response.status_code == 401
+    response = client.post("/token/refresh", json={"refresh_token": second_refresh})
+    assert response.status_code == 401
+
+    # Unknown token
+    response = client.post("/token/refresh", json={"refresh_token": "not-a-token"})
+    assert response.status_code == 401
+
+    # Renewal has its own rate limit bucket, apart from the password endpoints
+    from app.ratelimit import rate_limiter
+    assert rate_limiter.classify("POST", "/token/refresh") == "refresh"
+    assert rate_limiter.classify("POST", "/login") == "auth"
+
+    # The purge drops revoked and expired tokens, and keeps used ones until they expire
+    from datetime import datetime, timedelta, timezone
+    from app import database
+    from app.crud.tokens import hash_refresh_token, purge_refresh_tokens
+    from app.models.refresh_tokens import RefreshToken
+
+    monkeypatch.setattr(database, "SessionLocal", TestingSessionLocal)
+    used = client.post("/login", data={"username": username, "password": password}).json()["refresh_token"]
+    live = client.post("/token/refresh", json={"refresh_token": used}).json()["refresh_token"]
+    db = TestingSessionLocal()
+    try:
+        db.query(RefreshToken).filter(RefreshToken.token_hash == hash_refresh_token(live)).update(
+            {"expires_at": datetime.now(timezone.utc) - timedelta(seconds=1)}, synchronize_session=False)
+        db.commit()
+        assert purge_refresh_tokens(batch_size=1) >= 3
+        remaining = {token for (token,) in db.query(RefreshToken.token_hash).all()}
+        assert hash_refresh_token(used) in remaining
+        assert not {hash_refresh_token(token) for token in (first_refresh, second_refresh, live)} & remaining
+    finally:
+        db.close()
+
+
+@pytest.mark.parametrize("username, password", [("testuser", "testpassword")])
+def test_rehash_on_login(client, setup_database, username, password):
+    from app.hashing import password_policy
+    from app.models.users import User
+
+    rounds = password_policy.rounds
+    password_policy.configure(5)
+    try:
+        response = client.post("/login", data={"username": username, "password": password})
+        assert response.status_code == 200
+        db = TestingSessionLocal()
+        try:
+            user = db.query(User).filter(User.username == username).first()
+            assert user.hashed_password.startswith("$2b$05$")
+        finally:
+            db.close()
+
+        # A wrong password never rewrites the hash
+        response = client.post("/login", data={"username": username, "password": "wrongpassword"})
+        assert response.status_code == 400
+    finally:
+        password_policy.configure(rounds)
+
+
+def test_hash_policy_tolerance():
+    from app.hashing import PasswordHashPolicy
+
+    # Workers calibrated a round apart accept each other's hashes instead of rewriting them
+    five, six = PasswordHashPolicy(5).hash("secret"), PasswordHashPolicy(6).hash("secret")
+    policy = PasswordHashPolicy(5)
+    policy.configure(5, tolerance=1)
+    assert policy.verify_and_update("secret", six) == (True, None)
+    assert policy.verify_and_update("secret", PasswordHashPolicy(7).hash("secret"))[1].startswith("$2b$05$")
+    # An exact policy re-hashes any other cost
+    policy.configure(6)
+    assert policy.verify_and_update("secret", six) == (True, None)
+    assert policy.verify_and_update("secret", five)[1].startswith("$2b$06$")
+
+
+@pytest.mark.parametrize("username, password", [("testuser2", "testpassword2")])
+def test_rating_write_behind(client, setup_database, username, password):
+    from app import rating_buffer
+    from app.models.ratings import Rating
+    from app.models.users import User
+
+    response = client.post("/login", data={"username": username, "password": password})
+    token = response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    buffer = rating_buffer.RatingBuffer(TestingSessionLocal, max_delay_ms=60_000, max_items=100)
+    rating_buffer.rating_buffer = buffer
+    try:
+        # Ratings are acknowledged before they are written
+        response = client.post("/ratings/", json={"movie_id": 3, "rating": 2}, headers=headers)
+        assert response.status_code == 200
+        assert response.json()["average_rating"] == 2.0
+        response = client.post("/ratings/", json={"movie_id": 3, "rating": 5}, headers=headers)
+        assert response.status_code == 200
+        response = client.post("/ratings/", json={"movie_id": 2, "rating": 1}, headers=headers)
+        assert response.status_code == 200
+        assert client.get("/ratings/", params={"movie_id": 3}).status_code == 404
+
+        # Repeated ratings by the same user are coalesced
+        assert len(buffer) == 2
+        assert buffer.flush() == 2
+        assert len(buffer) == 0
+    finally:
+        rating_buffer.rating_buffer = None
+
+    db = TestingSessionLocal()
+    try:
+        user = db.query(User).filter(User.username == username).first()
+        ratings = db.query(Rating).filter(Rating.user_id == user.user_id).all()
+        assert {(r.movie_id, r.rating) for r in ratings} == {(2, 1), (3, 5)}
+    finally:
+        db.close()
+    assert client.get("/ratings/", params={"movie_id": 3}).json()["average_rating"] == 5.0
+
+    # Flushes upsert, so a rating written meanwhile by another worker is updated, not duplicated
+    buffer.add(3, user.user_id, 4)
+    assert buffer.flush() == 1
+    db = TestingSessionLocal()
+    try:
+        assert [r.rating for r in db.query(Rating).filter(Rating.user_id == user.user_id, Rating.movie_id == 3)] == [4]
+    finally:
+        db.close()
+
+    # A full buffer refuses new ratings, also while a failed flush holds them
+    unavailable = sessionmaker(bind=create_engine("sqlite:////nonexistent/ratings.db"))
+    full = rating_buffer.RatingBuffer(unavailable, max_delay_ms=60_000, max_items=1, max_pending=2)
+    assert full.add(10, user.user_id, 3) and full.add(11, user.user_id, 3)
+    assert not full.add(12, user.user_id, 3)
+    assert full.add(11, user.user_id, 2)
+    with pytest.raises(Exception):
+        full.flush()
+    assert len(full) == 2 and not full.add(12, user.user_id, 3)
+    rating_buffer.rating_buffer = full
+    try:
+        response = client.post("/ratings/", json={"movie_id": 2, "rating": 2}, headers=headers)
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "60"
+    finally:
+        rating_buffer.rating_buffer = None
+
+
+@pytest.mark.parametrize("username, password", [("testuser", "testpassword")])
+def test_change_feed_invalidates_cache(client, setup_database, username, password):
+    from app.change_feed import ChangeEvent, change_feed
+    from app.crud.movies import movie_cache
+
+    response = client.post("/login", data={"username": username, "password": password})
+    token = response.json()["access_token"]
+
+    assert client.get("/movies/2").json()["data"]["title"] == "Test Book 2"
+    assert movie_cache.get(2) is not None
+
+    # A committed write drops the cached entry
+    response = client.put("/movies/2",
+                          json={"title": "Cached Book", "description": "Test Description 2", "release_date": "2024-08-15"},
+                          headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+    assert movie_cache.get(2) is None
+    assert client.get("/movies/2").json()["data"]["title"] == "Cached Book"
+
+    # So does a change published by another worker
+    change_feed.dispatch(ChangeEvent.decode(ChangeEvent("movie", "2", 1).encode()))
+    assert movie_cache.get(2) is None
+
+    # Keys may contain colons; anything else on the channel is rejected, not misread
+    assert ChangeEvent.decode(ChangeEvent("stats", "2:30d", 7).encode()) == ChangeEvent("stats", "2:30d", 7)
+    for payload in ("movie", "movie:2", "movie:2:latest"):
+        with pytest.raises(ValueError):
+            ChangeEvent.decode(payload)
+
+    response = client.put("/movies/2",
+                          json={"title": "Test Book 2", "description": "Test Description 2", "release_date": "2024-08-15"},
+                          headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+
+
+def test_worker_pool_size():
+    from app.serve import worker_pool_size
+
+    # The budget is split between workers, minus connections held outside the pool
+    assert worker_pool_size(4, budget=40) == (10, 0)
+    assert worker_pool_size(4, budget=40, reserved=1) == (9, 0)
+    # Every worker gets at least one connection
+    assert worker_pool_size(8, budget=4) == (1, 0)
+
+
+def test_warm_pool_of_one(monkeypatch, tmp_path):
+    from sqlalchemy.pool import QueuePool
+    from app import database
+    from app.warmup import warm_pool
+
+    # The smallest per-worker pool: one connection and no overflow
+    engine = create_engine(f"sqlite:///{tmp_path / 'pool.db'}", poolclass=QueuePool, pool_size=1, max_overflow=0, pool_timeout=1)
+    monkeypatch.setattr(database, "engine", engine)
+    warm_pool(2)
+    assert engine.pool.checkedin() == 1
+
+
+def test_create_tables_upgrades_existing_schema(monkeypatch, tmp_path):
+    from sqlalchemy import inspect, text
+    from app import database, main
+
+    # A database from before comments.created_at and the ratings indexes
+    old_engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    Base.metadata.create_all(old_engine)
+    with old_engine.begin() as connection:
+        connection.execute(text("DROP INDEX ix_ratings_movie_id_user_id"))
+        connection.execute(text("DROP INDEX ix_ratings_user_id_id"))
+        connection.execute(text("ALTER TABLE comments DROP COLUMN created_at"))
+        # Duplicates keep the unique index from being built, but not the other one
+        connection.execute(text("INSERT INTO ratings (id, movie_id, user_id, rating) VALUES ('a', 1, 'u', 3), ('b', 1, 'u', 4)"))
+    monkeypatch.setattr(database, "engine", old_engine)
+
+    main.create_tables()
+    inspector = inspect(old_engine)
+    assert "created_at" in {column["name"] for column in inspector.get_columns("comments")}
+    indexes = {index["name"] for index in inspector.get_indexes("ratings")}
+    assert "ix_ratings_user_id_id" in indexes and "ix_ratings_movie_id_user_id" not in indexes
+
+    with old_engine.begin() as connection:
+        connection.execute(text("DELETE FROM ratings WHERE id = 'a'"))
+    main.create_tables()
+    assert "ix_ratings_movie_id_user_id" in {index["name"] for index in inspect(old_engine).get_indexes("ratings")}
+
+
+def test_worker_restart_delay(monkeypatch):
+    from app import serve
+    monkeypatch.setattr(serve, "WORKER_MAX_FAST_EXITS", 4)
+    monkeypatch.setattr(serve, "WORKER_RESTART_BACKOFF_SECONDS", 1)
+    monkeypatch.setattr(serve, "WORKER_RESTART_BACKOFF_MAX_SECONDS", 3)
+    assert [serve.restart_delay(fast_exits) for fast_exits in range(5)] == [0.0, 1, 2, 3, None]
+
+
+def test_healthz(client):
+    response = client.get("/healthz")
+    assert response.status_code == 200
+    assert response.json() == {"status": "ok"}
+
+
+def test_rating_stream_hub(client, setup_database):
+    import asyncio
+    from app.change_feed import ChangeEvent
+    from app.rating_stream import RatingStreamHub
+
+    async def follow():
+        hub = RatingStreamHub(TestingSessionLocal, interval_ms=10)
+        events = hub.events(2)
+        first = await events.__anext__()
+        assert first.startswith("event: rating\n")
+        assert json.loads(first.split("data: ")[1])["movie_id"] == 2
+
+        # Listeners of the same movie share one topic
+        second_listener = hub.subscribe(2)
+        assert len(hub.topics) == 1
+        assert len(hub.topics[2].listeners) == 2
+
+        # Bursts of changes are coalesced, and a slow listener only keeps the latest value
+        for _ in range(5):
+            hub.on_change(ChangeEvent("rating", "2", 0))
+        update = await asyncio.wait_for(events.__anext__(), timeout=2)
+        assert json.loads(update.split("data: ")[1])["rating_count"] >= 1
+        assert second_listener.qsize() == 1
+
+        hub.unsubscribe(2, second_listener)
+        await events.aclose()
+        assert hub.topics == {}
+
+    asyncio.run(follow())
+
+    # Unknown movie
+    response = client.get("/ratings/stream", params={"movie_id": 99})
+    assert response.status_code == 404
+
+
+@pytest.mark.parametrize("username, password", [("testuser2", "testpassword2")])
+def test_recommendations(client, setup_database, monkeypatch, username, password):
+    import numpy as np
+    from uuid import uuid4
+    from app.recommendations import RatingTriplets, RecommendationService, SimilarityModel, recommendation_service
+
+    # Users who like movie 10 also like 11 and dislike 12; movies 20-24 are rated by others
+    users = [uuid4() for _ in range(6)]
+    ratings = [(0, 10, 5), (0, 11, 5), (0, 12, 1), (1, 10, 4), (1, 11, 5), (1, 12, 2),
+               (2, 10, 1), (2, 11, 2), (2, 12, 5), (3, 10, 5), (3, 12, 1)]
+    ratings += [(user, movie, (user + movie) % 5 + 1) for user in (4, 5) for movie in range(20, 25)]
+    rows, movies, values = (np.array(column) for column in zip(*ratings))
+    triplets = RatingTriplets({user: index for index, user in enumerate(users)},
+                              rows.astype(np.int32), movies.astype(np.int64), values.astype(np.float32))
+    model = SimilarityModel.build(triplets, top_k=2)
+    assert [movie_id for movie_id, _ in model.similar(10, 5)] == [11]
+    assert model.similar(99, 5) == []
+    assert [movie_id for movie_id, _ in model.recommend(users[3], 5)] == [11]
+    assert model.recommend(uuid4(), 5) == []
+
+    # Only the changed movie's ratings are reloaded on an incremental refresh
+    fresh = RatingTriplets(dict(triplets.user_index), np.array([3], dtype=np.int32),
+                           np.array([11], dtype=np.int64), np.array([1], dtype=np.float32))
+    updated = model.update(fresh, np.array([11], dtype=np.int64))
+    assert updated is not None and updated.recommend(users[3], 5) == []
+    assert [movie_id for movie_id, _ in model.recommend(users[3], 5)] == [11]
+
+    # Endpoints serve from the model built by the service
+    service = RecommendationService(TestingSessionLocal)
+    service.refresh()
+    recommendation_service.model = service.model
+    response = client.get("/movies/2/similar")
+    assert response.status_code == 200
+    assert all(movie["movie_id"] != 2 for movie in response.json()["data"])
+
+    response = client.post("/login", data={"username": username, "password": password})
+    token = response.json()["access_token"]
+    response = client.get("/users/me/recommendations", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+    assert isinstance(response.json()["data"], list)
+
+    response = client.get("/users/me/recommendations")
+    assert response.status_code == 401
+
+    # Deleted movies leave the results at once, and the model at the next refresh
+    service.model = model
+    service.hide(11)
+    assert [movie.movie_id for movie in service.similar(10, 5).data] == []
+    assert service.similar(11, 5).data == []
+    assert service.recommend(users[3], 5).data == []
+
+    # Rebuilding on every refresh is allowed
+    from app import recommendations
+    monkeypatch.setattr(recommendations, "REC_FULL_REBUILD_EVERY", 0)
+    service.refresh()
+    assert service.model is not model
+
+
+@pytest.mark.parametrize("username, password", [("testuser", "testpassword")])
+def test_recommendations_skip_unrated_movies(client, setup_database, monkeypatch, username, password):
+    from app.change_feed import ChangeEvent
+    from app.recommendations import RatingTriplets, RecommendationService
+
+    response = client.post("/login", data={"username": username, "password": password})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    service = RecommendationService(TestingSessionLocal)
+    service.refresh()
+    model = service.model
+
+    # A new movie has the highest id and no ratings yet
+    response = client.post("/movies/", json={"title": "Unrated", "description": "No ratings", "release_date": "2024-01-01"}, headers=headers)
+    movie_id = response.json()["data"]["id"]
+    assert movie_id > model.movie_ids.max()
+    service.on_change(ChangeEvent("movie", str(movie_id), 1))
+    service.refresh()
+    assert service._refreshes == 2
+    assert service.model is not model and (service.model.neighbours == model.neighbours).all()
+
+    # Editing an unrated movie below the highest id leaves every row alone
+    unrated = next(id for id in range(1, int(model.movie_ids.max())) if id not in model.movie_ids)
+    client.put(f"/movies/{unrated}", json={"description": "Edited"}, headers=headers)
+    service.on_change(ChangeEvent("movie", str(unrated), 2))
+    service.refresh()
+    assert service._refreshes == 3
+    assert (service.model.neighbours == model.neighbours).all()
+
+    # A failed refresh is followed by a full rebuild
+    service.on_change(ChangeEvent("rating", "2", 3))
+    with monkeypatch.context() as patch:
+        patch.setattr(RatingTriplets, "load", classmethod(lambda cls, db, *args: 1 / 0))
+        with pytest.raises(ZeroDivisionError):
+            service.refresh()
+    model = service.model
+    service.refresh()
+    assert service._refreshes == 1 and service.model is not model
+
+
+def test_rating_stats(client, setup_database):
+    import numpy as np
+    from app.crud.ratings import catalog_stats_cache, summarize_histogram
+
+    summary = summarize_histogram(np.array([0, 0, 0, 1, 1]))
+    assert summary["rating_count"] == 2
+    assert summary["average_rating"] == 4.5
+    assert summary["std_dev"] == 0.707
+    assert summary["confidence_low"] < 4.5 < summary["confidence_high"]
+    assert summarize_histogram(np.zeros(5))["average_rating"] == 0.0
+
+    response = client.get("/ratings/stats", params={"movie_id": 2})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["movie_title"] == "Test Book 2"
+    assert sum(data["histogram"].values()) == data["rating_count"] > 0
+    assert set(data["histogram"]) == {"1", "2", "3", "4", "5"}
+
+    response = client.get("/ratings/stats", params={"movie_id": 99})
+    assert response.status_code == 404
+
+    catalog_stats_cache.invalidate()
+    response = client.get("/ratings/stats/catalog")
+    assert response.status_code == 200
+    catalog = response.json()
+    assert catalog["movie_count"] >= 2
+    assert catalog["rating_count"] >= data["rating_count"]
+
+
+@pytest.mark.parametrize("username, password", [("testuser", "testpassword")])
+def test_my_activity(client, setup_database, username, password):
+    response = client.post("/login", data={"username": username, "password": password})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    for path in ("/users/me/ratings", "/users/me/comments", "/users/me/movies"):
+        # Walk all pages one item at a time and compare with a single large page
+        response = client.get(path, params={"limit": 100}, headers=headers)
+        assert response.status_code == 200
+        everything = response.json()["data"]
+        assert everything and response.json()["next_cursor"] is None
+
+        seen, after = [], None
+        while True:
+            params = {"limit": 1} if after is None else {"limit": 1, "after": after}
+            page = client.get(path, params=params, headers=headers).json()
+            seen += page["data"]
+            after = page["next_cursor"]
+            if after is None:
+                break
+        assert seen == everything
+
+    ratings = client.get("/users/me/ratings", headers=headers).json()["data"]
+    assert all(item["movie_title"] for item in ratings)
+
+    response = client.get("/users/me/ratings")
+    assert response.status_code == 401
+
+
+@pytest.mark.parametrize("username, password", [("testuser", "testpassword")])
+def test_delete_movie_with_purge(client, setup_database, monkeypatch, username, password):
+    from app import database
+    from app.crud import movies as movie_crud
+    from app.models.comments import Comment
+    from app.models.movies import Movie
+    from app.models.ratings import Rating
+
+    response = client.post("/login", data={"username": username, "password": password})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    def create_movie_with_children():
+        response = client.post("/movies/", json={"title": "Doomed", "description": "To be deleted", "release_date": "2024-01-01"}, headers=headers)
+        movie_id = response.json()["data"]["id"]
+        client.post("/ratings/", json={"movie_id": movie_id, "rating": 3}, headers=headers)
+        response = client.post("/comments/", json={"movie_id": movie_id, "content": "Top"}, headers=headers)
+        client.post(f"/comments/reply/{response.json()['id']}", json={"movie_id": movie_id, "content": "Reply", "parent_id": response.json()["id"]}, headers=headers)
+        return movie_id
+
+    def children(movie_id):
+        db = TestingSessionLocal()
+        try:
+            return (db.query(Rating).filter(Rating.movie_id == movie_id).count(),
+                    db.query(Comment).filter(Comment.movie_id == movie_id).count())
+        finally:
+            db.close()
+
+    # Small movies are deleted with their children in the request
+    movie_id = create_movie_with_children()
+    assert children(movie_id) == (1, 2)
+    response = client.delete(f"/movies/{movie_id}", headers=headers)
+    assert response.status_code == 200
+    assert children(movie_id) == (0, 0)
+
+    # Large movies are hidden at once and purged in batches after the response
+    monkeypatch.setattr(movie_crud, "MOVIE_PURGE_THRESHOLD", 1)
+    monkeypatch.setattr(database, "SessionLocal", TestingSessionLocal)
+    movie_id = create_movie_with_children()
+    purged = []
+    monkeypatch.setattr(movie_crud, "purge_movie", lambda movie_id: purged.append(movie_id))
+    response = client.delete(f"/movies/{movie_id}", headers=headers)
+    assert response.status_code == 200
+    assert purged == [movie_id]
+    assert client.get(f"/movies/{movie_id}").status_code == 404
+    assert client.get(f"/comments/{movie_id}").status_code == 404
+    assert children(movie_id) == (1, 2)
+
+    monkeypatch.undo()
+    monkeypatch.setattr(database, "SessionLocal", TestingSessionLocal)
+    # A reply to the reply, so the purge has to take the thread apart leaf first
+    db = TestingSessionLocal()
+    reply = db.query(Comment).filter(Comment.movie_id == movie_id, Comment.parent_id.is_not(None)).one()
+    db.add(Comment(movie_id=movie_id, user_id=reply.user_id, parent_id=reply.id, content="Nested"))
+    db.commit()
+    db.close()
+
+    # Without ON DELETE CASCADE on parent_id, no batch may leave a reply without its parent
+    orphans = []
+
+    def count_orphans(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("DELETE FROM comments"):
+            orphans.append(conn.exec_driver_sql(
+                "SELECT count(*) FROM comments WHERE parent_id IS NOT NULL "
+                "AND parent_id NOT IN (SELECT id FROM comments)"
+            ).scalar())
+
+    event.listen(engine, "after_cursor_execute", count_orphans)
+    try:
+        movie_crud.purge_movie(movie_id, batch_size=1)
+    finally:
+        event.remove(engine, "after_cursor_execute", count_orphans)
+    assert len(orphans) > 3 and not any(orphans)
+    assert children(movie_id) == (0, 0)
+    db = TestingSessionLocal()
+    assert db.get(Movie, movie_id) is None
+    db.close()
+
+
+def test_purge_deleted_movies_with_pool_of_one(monkeypatch, tmp_path):
+    from datetime import date, datetime
+    from uuid import uuid4
+    from sqlalchemy.pool import QueuePool
+    from app import database
+    from app.crud.movies import purge_deleted_movies
+    from app.models.movies import Movie
+    from app.models.ratings import Rating
+
+    # The smallest per-worker pool: the startup purge must not need a second connection
+    pool_engine = create_engine(f"sqlite:///{tmp_path / 'purge.db'}", poolclass=QueuePool, pool_size=1, max_overflow=0, pool_timeout=1)
+    Base.metadata.create_all(pool_engine)
+    monkeypatch.setattr(database, "engine", pool_engine)
+    monkeypatch.setattr(database, "SessionLocal", sessionmaker(bind=pool_engine))
+    db = database.SessionLocal()
+    movie = Movie(title="Purged", description="Deleted", release_date=date(2024, 1, 1), user_id=uuid4(), deleted_at=datetime.utcnow())
+    db.add(movie)
+    db.flush()
+    db.add(Rating(movie_id=movie.movie_id, user_id=uuid4(), rating=3))
+    db.commit()
+    db.close()
+
+    purge_deleted_movies()
+    db = database.SessionLocal()
+    assert db.query(Movie).count() == 0 and db.query(Rating).count() == 0
+    db.close()
+    assert pool_engine.pool.checkedout() == 0
+
+
+def test_uuid7():
+    import time
+    import uuid
+    from app.ids import uuid7
+
+    ids = [uuid7() for _ in range(5000)]
+    assert all(id.version == 7 and id.variant == uuid.RFC_4122 for id in ids)
+    # Strictly increasing, so new rows go to the end of the primary key index
+    assert ids == sorted(ids) and len(set(ids)) == len(ids)
+    assert abs((ids[-1].int >> 80) - time.time() * 1000) < 60_000
+
+
+@pytest.mark.parametrize("username, password", [("testuser", "testpassword")])
+def test_statement_cache_metrics(client, setup_database, username, password):
+    from app.metrics import metrics
+
+    response = client.post("/login", data={"username": username, "password": password})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    hits = metrics.value("db_statement_cache_total", outcome="hit")
+    # The prebuilt user lookup of every authenticated request is served from the compiled cache
+    for _ in range(3):
+        assert client.get("/users/me/movies", headers=headers).status_code == 200
+    assert metrics.value("db_statement_cache_total", outcome="hit") >= hits + 3
+
+    response = client.get("/ratings/", params={"movie_id": 2})
+    assert response.status_code == 200
+    assert response.json()["movie_title"] == "Test Book 2"
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert 'db_statement_cache_total{outcome="hit"}' in response.text
+
+
+@pytest.mark.parametrize("username, password", [("testuser", "testpassword")])
+def test_lazy_session(client, setup_database, username, password):
+    from app.crud.movies import movie_cache
+    from app.metrics import metrics
+    from app.sessions import lazy_session_dependency
+
+    app.dependency_overrides[get_db] = lazy_session_dependency(TestingSessionLocal)
+    try:
+        # A request answered from the cache never opens a session
+        client.get("/movies/2")
+        unused = metrics.value("db_request_sessions_total", connected="false")
+        assert client.get("/movies/2").status_code == 200
+        assert metrics.value("db_request_sessions_total", connected="false") == unused + 1
+
+        # Pool hold time is recorded under the route template
+        movie_cache.invalidate()
+        holds = metrics.value("db_pool_hold_seconds_count", route="/movies/{movie_id}")
+        assert client.get("/movies/2").status_code == 200
+        assert metrics.value("db_pool_hold_seconds_count", route="/movies/{movie_id}") == holds + 1
+
+        # Streaming bodies and endpoints returning mapped objects still work after early release
+        response = client.get("/comments/2", headers={"Accept": "application/x-ndjson"})
+        assert response.status_code == 200 and response.text.count("\n") >= 1
+        response = client.post("/login", data={"username": username, "password": password})
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        response = client.post("/comments/", json={"movie_id": 2, "content": "Lazy"}, headers=headers)
+        assert response.status_code == 200
+        assert response.json()["content"] == "Lazy"
+    finally:
+        app.dependency_overrides[get_db] = override_get_db
+
+
+def test_single_flight(client, setup_database):
+    import asyncio
+    import threading
+    from fastapi import HTTPException
+    from app.metrics import metrics
+    from app.singleflight import SingleFlight
+
+    calls = []
+    release = threading.Event()
+
+    def slow_read(db, movie_id):
+        calls.append(movie_id)
+        release.wait(timeout=5)
+        if movie_id == 99:
+            raise HTTPException(status_code=404, detail="Movie not found")
+        return f"movie {movie_id}"
+
+    async def burst():
+        flight = SingleFlight("test", timeout=5)
+        db = TestingSessionLocal()
+        readers = [asyncio.ensure_future(flight.run(movie_id, db, slow_read, movie_id)) for movie_id in (2, 2, 2, 99, 99)]
+        await asyncio.sleep(0.1)
+        release.set()
+        results = await asyncio.gather(*readers, return_exceptions=True)
+        db.close()
+        return flight, results
+
+    followers = metrics.value("single_flight_calls_total", group="test", role="follower")
+    flight, results = asyncio.run(burst())
+    # One read per key; errors reach every caller of that key
+    assert sorted(calls) == [2, 99]
+    assert results[:3] == ["movie 2"] * 3
+    assert all(isinstance(result, HTTPException) and result.status_code == 404 for result in results[3:])
+    assert metrics.value("single_flight_calls_total", group="test", role="follower") == followers + 3
+    assert flight._calls == {}
+
+    async def timeout():
+        flight = SingleFlight("test", timeout=0.05)
+        db = TestingSessionLocal()
+        release.clear()
+        try:
+            await flight.run(1, db, slow_read, 1)
+        finally:
+            release.set()
+            db.close()
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(timeout())
+    assert error.value.status_code == 504
+
+    # The coalesced endpoints still answer normally
+    assert client.get("/movies/2").status_code == 200
+    assert client.get("/ratings/", params={"movie_id": 2}).status_code == 200
+    assert client.get("/comments/2").status_code == 200
+    assert client.get("/movies/99").status_code == 404
+
+
+def test_compression(client):
+    import gzip
+    from app.compression import choose_encoding
+    from app.metrics import metrics
+
+    assert choose_encoding("gzip, deflate") == "gzip"
+    assert choose_encoding("gzip;q=0, identity") is None
+    assert choose_encoding("") is None
+
+    response = client.get("/openapi.json", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert int(response.headers["content-length"]) < len(response.content)
+    assert response.json()["openapi"]
+
+    # The same body is served from the compressed body cache
+    hits = metrics.value("http_compression_cache_total", outcome="hit")
+    client.get("/openapi.json", headers={"Accept-Encoding": "gzip"})
+    assert metrics.value("http_compression_cache_total", outcome="hit") == hits + 1
+
+    # Small bodies, clients that do not accept gzip and streams are left alone
+    assert "content-encoding" not in client.get("/healthz", headers={"Accept-Encoding": "gzip"}).headers
+    assert "content-encoding" not in client.get("/openapi.json", headers={"Accept-Encoding": "identity"}).headers
+    response = client.get("/comments/2", headers={"Accept": "application/x-ndjson", "Accept-Encoding": "gzip"})
+    assert response.status_code == 200 and "content-encoding" not in response.headers
+
+
+def test_profiling(client, tmp_path):
+    from app.profiling import ProfilingMiddleware
+    from app.crud.ratings import rating_cache
+
+    profiled = TestClient(ProfilingMiddleware(app, token="profile-secret", directory=str(tmp_path)))
+
+    # Requests without the header, or with the wrong token, are not profiled
+    assert "x-profile-id" not in profiled.get("/movies/2").headers
+    assert "x-profile-id" not in profiled.get("/movies/2", headers={"X-Profile": "wrong"}).headers
+    assert not list(tmp_path.iterdir())
+
+    # Bypass the rating cache so the profile includes the query
+    rating_cache.invalidate(2)
+    response = profiled.get("/ratings/", params={"movie_id": 2}, headers={"X-Profile": "profile-secret"})
+    assert response.status_code == 200
+    profile_id = response.headers["x-profile-id"]
+    summary = json.loads((tmp_path / f"{profile_id}.json").read_text())
+    assert summary["path"] == "/ratings/" and summary["status"] == 200
+    assert summary["statements"] and all(statement["ms"] >= 0 for statement in summary["statements"])
+    assert any("get_ratings" in function["function"] for function in summary["top_functions"])
+
+    import pstats
+    assert pstats.Stats(str(tmp_path / f"{profile_id}.prof")).total_calls > 0
+
+
+def test_profiling_without_cprofile(client, tmp_path, monkeypatch):
+    import cProfile
+    from app import profiling
+    from app.crud.ratings import rating_cache
+
+    # As on Python 3.12+ when another profiler already holds sys.monitoring
+    class BusyProfile(cProfile.Profile):
+        def enable(self, *args, **kwargs):
+            raise ValueError("Another profiling tool is already active")
+
+    monkeypatch.setattr(profiling.cProfile, "Profile", BusyProfile)
+    profiled = TestClient(profiling.ProfilingMiddleware(app, token="profile-secret", directory=str(tmp_path)))
+    rating_cache.invalidate(2)
+    response = profiled.get("/ratings/", params={"movie_id": 2}, headers={"X-Profile": "profile-secret"})
+    assert response.status_code == 200
+    summary = json.loads((tmp_path / f"{response.headers['x-profile-id']}.json").read_text())
+    assert summary["statements"] and summary["top_functions"] == []
+
+
+def test_slow_query_log(client, setup_database, monkeypatch):
+    from app import auth, slow_queries
+    from types import SimpleNamespace
+    from app.slow_queries import explainable, normalize, redact, slow_query_log
+
+    assert normalize("SELECT * FROM movies WHERE id IN (?, ?, ?)  AND title = 'x'") == "SELECT * FROM movies WHERE id IN (?) AND title = ?"
+    assert normalize("SELECT 1 WHERE a = %(a_1)s") == normalize("SELECT 2 WHERE a = %(a_2)s")
+    assert redact({"username": "secret", "movie_id": 4}) == {"username": "<str:6>", "movie_id": "<int>"}
+
+    # Only statements that read are re-run under EXPLAIN ANALYZE
+    reads = SimpleNamespace(isinsert=False, isupdate=False, isdelete=False)
+    assert explainable("SELECT movies.deleted_at FROM movies", reads)
+    assert explainable("WITH recent AS (SELECT 1) SELECT * FROM recent", reads)
+    assert not explainable("WITH gone AS (DELETE FROM ratings RETURNING id) SELECT count(*) FROM gone", reads)
+    assert not explainable("SELECT * FROM movies FOR UPDATE", reads)
+    # Function calls whose effects a rollback does not undo
+    assert not explainable("SELECT pg_try_advisory_lock(%(key)s)", reads)
+    assert not explainable("SELECT pg_notify(%(channel)s, %(payload)s)", reads)
+    assert not explainable("SELECT nextval('movies_movie_id_seq') FROM movies", reads)
+    assert not explainable("SELECT 1", reads)
+    inserts = SimpleNamespace(isinsert=True, isupdate=False, isdelete=False)
+    assert not explainable("WITH rows AS (SELECT 1) INSERT INTO t SELECT * FROM rows", inserts)
+
+    # Treat every statement as slow
+    monkeypatch.setattr(slow_queries, "SLOW_QUERY_MS", 0)
+    slow_query_log.reset()
+    assert client.get("/movies/", params={"skip": 1}).status_code == 200
+    assert client.get("/movies/", params={"skip": 2}).status_code == 200
+
+    # Plans can contain parameter values, so the report is for admins only
+    assert client.get("/metrics/slow-queries").status_code == 401
+    monkeypatch.setattr(auth, "ADMIN_USERNAMES", {"testuser"})
+    token = client.post("/login", data={"username": "testuser", "password": "testpassword"}).json()["access_token"]
+    admin = {"Authorization": f"Bearer {token}"}
+    report = client.get("/metrics/slow-queries", headers=admin).json()
+    assert report
+    movies_query = next(entry for entry in report if "FROM movies" in entry["shape"])
+    assert movies_query["count"] >= 2
+    assert any(function.startswith("app.crud.movies.") for function in movies_query["functions"])
+    assert all(value is None or value.startswith("<") for value in movies_query["parameters"])
+    # No plans on SQLite
+    assert movies_query["plan"] is None
+
+    monkeypatch.setattr(slow_queries, "SLOW_QUERY_MS", -1)
+    slow_query_log.reset()
+    client.get("/movies/")
+    assert client.get("/metrics/slow-queries", headers=admin).json() == []
+
+
+@pytest.mark.parametrize("username, password", [("testuser", "testpassword")])
+def test_autocomplete(client, setup_database, monkeypatch, username, password):
+    from app import autocomplete
+    from app.autocomplete import autocomplete_service, title_index
+
+    response = client.post("/login", data={"username": username, "password": password})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    movie_ids = []
+    for title in ("Zorro Returns", "zorro  rising", "Zoology"):
+        response = client.post("/movies/", json={"title": title, "description": "Autocomplete", "release_date": "2024-01-01"}, headers=headers)
+        movie_ids.append(response.json()["data"]["id"])
+    client.post("/ratings/", json={"movie_id": movie_ids[1], "rating": 4}, headers=headers)
+
+    # Build from the test database; rating counts come from the scan
+    db = TestingSessionLocal()
+    try:
+        title_index.build(db)
+    finally:
+        db.close()
+    assert autocomplete_service.index.built
+
+    response = client.get("/movies/autocomplete", params={"prefix": "ZORRO"})
+    assert response.status_code == 200
+    data = response.json()["data"]
+    assert [movie["id"] for movie in data] == [movie_ids[1], movie_ids[0]]
+    assert data[0] == {"id": movie_ids[1], "title": "zorro  rising", "rating_count": 1}
+    assert [movie["id"] for movie in client.get("/movies/autocomplete", params={"prefix": "zorro r", "limit": 1}).json()["data"]] == [movie_ids[1]]
+    assert {movie["id"] for movie in client.get("/movies/autocomplete", params={"prefix": "zo"}).json()["data"]} >= set(movie_ids)
+
+    # Writes update the index in place
+    client.put(f"/movies/{movie_ids[2]}", json={"title": "Zorro Forever", "description": "Autocomplete", "release_date": "2024-01-01"}, headers=headers)
+    client.delete(f"/movies/{movie_ids[0]}", headers=headers)
+    ids = [movie["id"] for movie in client.get("/movies/autocomplete", params={"prefix": "zorro"}).json()["data"]]
+    assert ids == [movie_ids[1], movie_ids[2]]
+    assert [movie["id"] for movie in client.get("/movies/autocomplete", params={"prefix": "zoo"}).json()["data"]] == []
+
+    assert client.get("/movies/autocomplete", params={"prefix": ""}).status_code == 422
+    assert client.get("/movies/autocomplete", params={"prefix": "   "}).status_code == 400
+
+    # Writes only drop the memoized results of their own title's prefixes
+    zorro = title_index.search("zorro", 10)
+    title_index.add(10_000_001, "Alpha")
+    assert title_index.search("zorro", 10) is zorro
+    title_index.add(10_000_002, "Zorro Again")
+    assert title_index.search("zorro", 10) is not zorro
+    assert 10_000_002 in [movie.id for movie in title_index.search("zorro", 10)]
+    title_index.remove(10_000_002)
+    assert 10_000_002 not in [movie.id for movie in title_index.search("zorro", 10)]
+    title_index.remove(10_000_001)
+
+    # Short prefixes, and longer ones their precomputed titles answer, are ranked in full
+    # however few titles a scan may rank
+    monkeypatch.setattr(autocomplete, "AUTOCOMPLETE_MAX_SCAN", 1)
+    assert [movie.id for movie in title_index.search("z", 1)] == [movie_ids[1]]
+    assert [movie.id for movie in title_index.search("zorro", 5)] == [movie_ids[1], movie_ids[2]]
+    # Removing a precomputed title ranks its prefixes again
+    title_index.remove(movie_ids[1])
+    assert [movie.id for movie in title_index.search("z", 2)] == [movie_ids[2]]
+    assert "autocomplete_index_bytes" in client.get("/metrics").text
+
+
+def test_admin_export(client, setup_database, monkeypatch):
+    import csv
+    import io
+    from datetime import datetime, timedelta
+    from app import auth
+    from app.crud import exports
+    from app.models.movies import Movie
+    from app.models.ratings import Rating
+
+    monkeypatch.setattr(auth, "ADMIN_USERNAMES", {"testuser"})
+    # Small chunks so the export spans several transactions
+    monkeypatch.setattr(exports, "EXPORT_CHUNK_ROWS", 2)
+
+    def login(username, password):
+        response = client.post("/login", data={"username": username, "password": password})
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    admin = login("testuser", "testpassword")
+    assert client.get("/admin/export/ratings", headers=login("testuser2", "testpassword2")).status_code == 403
+    assert client.get("/admin/export/ratings").status_code == 401
+
+    db = TestingSessionLocal()
+    try:
+        rating_ids = sorted(str(id) for (id,) in db.query(Rating.id).all())
+        movie_count = db.query(Movie).filter(Movie.deleted_at.is_(None)).count()
+    finally:
+        db.close()
+    assert len(rating_ids) > 2
+
+    response = client.get("/admin/export/ratings", headers=admin)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["id"] for row in rows] == rating_ids
+    assert set(rows[0]) == {"id", "movie_id", "user_id", "rating"}
+
+    # An interrupted export resumes after the last key it sent
+    response = client.get("/admin/export/ratings", params={"after": rating_ids[1]}, headers=admin)
+    assert [json.loads(line)["id"] for line in response.text.splitlines()] == rating_ids[2:]
+    future = (datetime.utcnow() + timedelta(days=1)).isoformat()
+    assert client.get("/admin/export/ratings", params={"since": future}, headers=admin).text == ""
+
+    response = client.get("/admin/export/movies", params={"format": "csv"}, headers=admin)
+    assert response.headers["content-type"].startswith("text/csv")
+    movies = list(csv.DictReader(io.StringIO(response.text)))
+    assert len(movies) == movie_count
+    assert list(movies[0]) == ["movie_id", "title", "description", "release_date", "user_id"]
+
+    assert client.get("/admin/export/movies", params={"since": future}, headers=admin).status_code == 400
+    assert client.get("/admin/export/movies", params={"after": "abc"}, headers=admin).status_code == 400
+    assert client.get("/admin/export/users", headers=admin).status_code == 404
+    assert client.get("/admin/export/comments", params={"format": "xml"}, headers=admin).status_code == 422
+
+
+def test_export_mixed_key_versions(client, setup_database, monkeypatch):
+    from datetime import datetime, timedelta, timezone
+    from uuid import UUID, uuid4
+    from app import auth
+    from app.crud import exports
+    from app.ids import uuid7
+    from app.models.movies import Movie
+    from app.models.ratings import Rating
+    from app.models.users import User
+
+    monkeypatch.setattr(auth, "ADMIN_USERNAMES", {"testuser"})
+    monkeypatch.setattr(exports, "EXPORT_CHUNK_ROWS", 3)
+    token = client.post("/login", data={"username": "testuser", "password": "testpassword"}).json()["access_token"]
+    admin = {"Authorization": f"Bearer {token}"}
+
+    def export(**params):
+        response = client.get("/admin/export/ratings", params=params, headers=admin)
+        return [json.loads(line)["id"] for line in response.text.splitlines()]
+
+    # Ratings from before the switch to UUIDv7 (random ids, the lowest possible one among
+    # them) alongside new time-ordered ones
+    db = TestingSessionLocal()
+    try:
+        movie_id = db.query(Movie.movie_id).filter(Movie.deleted_at.is_(None)).first()[0]
+        old_ids = [UUID("00000000-0000-4000-8000-00000000000a"), *(uuid4() for _ in range(4))]
+        new_ids = [uuid7() for _ in range(4)]
+        # One rater each, as a user rates a movie once
+        users = [User(username=f"export-{index}", email=f"export-{index}@example.com", hashed_password="x")
+                 for index in range(len(old_ids + new_ids))]
+        db.add_all(users)
+        db.flush()
+        db.add_all(Rating(id=id, movie_id=movie_id, user_id=user.user_id, rating=3) for id, user in zip(old_ids + new_ids, users))
+        db.commit()
+        expected = sorted(str(id) for (id,) in db.query(Rating.id).all())
+    finally:
+        db.close()
+
+    # A full export returns every row once whatever the key versions, and so does one
+    # resumed after any key it sent
+    full = export()
+    assert full == expected
+    for position in range(len(full)):
+        assert full[:position + 1] + export(after=full[position]) == expected
+
+    # since= covers every new id, but old random ids fall on either side of it whatever their age
+    recent = set(export(since=(datetime.now(timezone.utc) - timedelta(minutes=1)).isoformat()))
+    assert {str(id) for id in new_ids} <= recent
+    assert str(old_ids[0]) not in recent
+
+    db = TestingSessionLocal()
+    try:
+        db.query(Rating).filter(Rating.id.in_(old_ids + new_ids)).delete(synchronize_session=False)
+        db.query(User).filter(User.username.like("export-%")).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_sparse_fieldsets(client):
+    # Lists leave out the description by default
+    response = client.get("/movies/")
+    assert response.status_code == 200
+    assert all(set(movie) == {"id", "title", "release_date", "user_id"} for movie in response.json()["data"])
+
+    response = client.get("/movies/", params={"fields": "title"})
+    assert all(set(movie) == {"id", "title"} for movie in response.json()["data"])
+    response = client.get("/movies/", params={"fields": "title,description"})
+    assert all(movie["description"] for movie in response.json()["data"])
+
+    # Single movies return everything unless fields are given
+    assert set(client.get("/movies/2").json()["data"]) == {"id", "title", "description", "release_date", "user_id"}
+    assert client.get("/movies/2", params={"fields": "id,title"}).json()["data"] == {"id": 2, "title": "Test Book 2"}
+    response = client.get("/movies/by_title/Test Book 2", params={"fields": "release_date"})
+    assert response.json()["data"] == {"id": 2, "release_date": "2024-08-15"}
+
+    response = client.get("/movies/", params={"fields": "title,budget"})
+    assert response.status_code == 400
+    assert "budget" in response.json()["detail"]
+
+
+@pytest.mark.parametrize("username, password", [("testuser", "testpassword")])
+def test_comment_tree_projection(client, setup_database, username, password):
+    response = client.post("/login", data={"username": username, "password": password})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    response = client.post("/movies/", json={"title": "Threaded", "description": "Comment tree", "release_date": "2024-01-01"}, headers=headers)
+    movie_id = response.json()["data"]["id"]
+
+    first = client.post("/comments/", json={"movie_id": movie_id, "content": "First"}, headers=headers).json()["id"]
+    second = client.post("/comments/", json={"movie_id": movie_id, "content": "Second"}, headers=headers).json()["id"]
+    reply = client.post(f"/comments/reply/{first}", json={"movie_id": movie_id, "content": "Reply", "parent_id": first}, headers=headers).json()["id"]
+    client.post(f"/comments/reply/{reply}", json={"movie_id": movie_id, "content": "Nested", "parent_id": reply}, headers=headers)
+
+    tree = client.get(f"/comments/{movie_id}").json()
+    assert [comment["id"] for comment in tree] == [first, second]
+    assert tree[1]["replies"] == []
+    (reply_item,) = tree[0]["replies"]
+    assert reply_item["id"] == reply and reply_item["parent_id"] == first
+    assert [nested["content"] for nested in reply_item["replies"]] == ["Nested"]
+    assert set(tree[0]) == {"id", "user_id", "content", "movie_id", "parent_id", "replies"}
+
+    # The nested view and the stream walk the same tree
+    def flatten(comments):
+        for comment in comments:
+            yield comment["id"]
+            yield from flatten(comment["replies"])
+    response = client.get(f"/comments/{movie_id}", headers={"Accept": "application/x-ndjson"})
+    assert [json.loads(line)["id"] for line in response.text.splitlines()] == list(flatten(tree))
+
+    # Movie reads project columns into the response models
+    response = client.get(f"/movies/{movie_id}")
+    assert response.json()["data"]["description"] == "Comment tree"
+    assert client.delete(f"/movies/{movie_id}", headers=headers).status_code == 200
+    assert client.get(f"/comments/{movie_id}").status_code == 404
+
+
+@pytest.mark.parametrize("username, password", [("testuser", "testpassword")])
+def test_comment_stream_order(client, setup_database, username, password, monkeypatch):
+    from datetime import datetime, timedelta, timezone
+    from app.crud import comments as comment_crud
+    from app.models.comments import Comment
+
+    response = client.post("/login", data={"username": username, "password": password})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    response = client.post("/movies/", json={"title": "Ordered", "description": "Sibling order", "release_date": "2024-01-01"}, headers=headers)
+    movie_id = response.json()["data"]["id"]
+
+    legacy, first, second = [
+        client.post("/comments/", json={"movie_id": movie_id, "content": content}, headers=headers).json()["id"]
+        for content in ("Legacy", "First", "Second")
+    ]
+    early, late = [
+        client.post(f"/comments/reply/{first}", json={"movie_id": movie_id, "content": content, "parent_id": first}, headers=headers).json()["id"]
+        for content in ("Early", "Late")
+    ]
+
+    # Siblings follow created_at, not their ids; rows written before it was recorded come first
+    db = TestingSessionLocal()
+    try:
+        rows = {str(comment.id): comment for comment in db.query(Comment).filter(Comment.movie_id == movie_id)}
+        rows[legacy].created_at = None
+        start = datetime.now(timezone.utc)
+        rows[early].created_at = start + timedelta(seconds=2)
+        rows[late].created_at = start + timedelta(seconds=1)
+        db.commit()
+    finally:
+        db.close()
+
+    tree = client.get(f"/comments/{movie_id}").json()
+    assert [comment["id"] for comment in tree] == [legacy, first, second]
+    assert [reply["id"] for reply in tree[1]["replies"]] == [late, early]
+
+    # One top-level comment per query, so the stream crosses every page boundary
+    monkeypatch.setattr(comment_crud, "COMMENT_STREAM_THREADS", 1)
+    monkeypatch.setattr(comment_crud, "COMMENT_STREAM_BATCH_SIZE", 1)
+    response = client.get(f"/comments/{movie_id}", headers={"Accept": "application/x-ndjson"})
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["id"] for line in lines] == [legacy, first, late, early, second]
+    assert [line["depth"] for line in lines] == [0, 0, 1, 1, 0]